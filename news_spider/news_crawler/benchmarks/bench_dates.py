@@ -0,0 +1,92 @@
+"""
+Benchmark for created_at normalization.
+
+Compares what NewsCrawlerPipeline used to do, dateutil.parser.parse on every
+value plus pytz.timezone() on every conversion, with DateNormalizer on a
+realistic mix: mostly trafilatura's YYYY-MM-DD, some ISO timestamps, and a
+few sources that publish "May 1, 2025", "05/01/2025" or RFC 822 dates, with
+the same dates repeating across articles. Checks both give the same
+datetimes and reports dates/sec.
+
+    python -m benchmarks.bench_dates --dates 50000
+"""
+import argparse
+import datetime
+import random
+import time
+
+import dateutil.parser
+import pytz
+
+from news_crawler.pipelines import DateNormalizer
+
+STYLES = [
+    # (share of sources, strftime format)
+    (0.70, '%Y-%m-%d'),
+    (0.10, '%Y-%m-%dT%H:%M:%S-04:00'),
+    (0.08, '%B %d, %Y'),
+    (0.05, '%m/%d/%Y'),
+    (0.04, '%a, %d %b %Y %H:%M:%S +0000'),
+    (0.03, '%d %B %Y'),
+]
+
+
+def make_dates(count, sources, seed, days=30):
+    rng = random.Random(seed)
+    shares, formats = zip(*STYLES)
+    source_formats = {f'Source {n}': rng.choices(formats, shares)[0] for n in range(sources)}
+    source_timezones = {name: 'America/New_York' for name in source_formats if rng.random() < 0.5}
+    start = datetime.datetime(2025, 5, 1, 9, 30)
+    dates = []
+    for _ in range(count):
+        source = rng.choice(list(source_formats))
+        # A crawl mostly sees the last few weeks of each source
+        published = start + datetime.timedelta(days=rng.randint(0, days), hours=rng.randint(0, 8))
+        dates.append((published.strftime(source_formats[source]), source))
+    return dates, source_timezones
+
+
+def legacy_normalize(value, timezone):
+    parsed = dateutil.parser.parse(value)
+    if timezone:
+        if parsed.tzinfo is None:
+            parsed = pytz.timezone(timezone).localize(parsed)
+        parsed = parsed.astimezone(pytz.UTC)
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dates', type=int, default=50000)
+    parser.add_argument('--sources', type=int, default=300)
+    parser.add_argument('--days', type=int, default=30, help='publication dates spread over this many days')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    dates, timezones = make_dates(args.dates, args.sources, args.seed, args.days)
+
+    started = time.perf_counter()
+    expected = [legacy_normalize(value, timezones.get(source)) for value, source in dates]
+    legacy_time = time.perf_counter() - started
+
+    results = {}
+    for label, cache_size in (('DateNormalizer, no memo', 0), ('DateNormalizer', 4096)):
+        normalizer = DateNormalizer(cache_size=cache_size)
+        started = time.perf_counter()
+        actual = [normalizer.normalize(value, source, timezones.get(source)) for value, source in dates]
+        results[label] = (time.perf_counter() - started, normalizer)
+        mismatches = [(value, old, new) for (value, _), old, new in zip(dates, expected, actual)
+                      if old != new or old.utcoffset() != new.utcoffset()]
+        if mismatches:
+            raise SystemExit(f'{label} disagrees with dateutil, e.g. {mismatches[0]}')
+
+    print(f'{args.dates} dates from {args.sources} sources, identical results')
+    print(f'{"dateutil + pytz.timezone()":<28} {args.dates / legacy_time:>10,.0f} dates/sec')
+    for label, (elapsed, normalizer) in results.items():
+        paths = ', '.join(f'{path} {count}' for path, count in normalizer.counts.most_common())
+        print(f'{label:<28} {args.dates / elapsed:>10,.0f} dates/sec  '
+              f'({legacy_time / elapsed:.1f}x; {paths})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Benchmark for WriteToDbPipeline against a local Postgres.
+
+Compares the original per-item INSERT ... RETURNING id + commit against the
+batched multi-row INSERT used by WriteToDbPipeline, and reports rows/sec.
+Uses a scratch schema that is dropped afterwards. Start a throwaway server
+first, e.g.
+
+    docker run --rm -d -p 5432:5432 -e POSTGRES_PASSWORD=bench postgres:16
+
+and point the POSTGRES_* variables from env.template at it:
+
+    POSTGRES_ADDRESS=localhost POSTGRES_USERNAME=postgres POSTGRES_PASS=bench \\
+    POSTGRES_DBNAME=postgres python -m benchmarks.bench_db_writer --rows 5000
+"""
+import argparse
+import datetime
+import os
+import time
+
+import psycopg2
+from scrapy.settings import Settings
+
+from news_crawler.pipelines import WriteToDbPipeline
+
+SCHEMA = 'bench_db_writer'
+TABLE = 'article_objects'
+COLUMNS = ['title', 'url', 'image_url', 'document_url', 'created_at', 'description', 'md',
+           'collection_name', 'topic', 'branch', 'country']
+
+
+def make_rows(count):
+    created_at = datetime.datetime(2025, 5, 1, tzinfo=datetime.timezone.utc)
+    return [
+        {
+            'title': f'Agency announces program update {n}',
+            'url': f'https://www.example.gov/news/2025/05/agency-announces-program-update-{n}',
+            'image_url': None,
+            'document_url': None,
+            'created_at': created_at,
+            'description': 'The agency announced an update to the program. ' * 4,
+            'md': '# Agency announces program update\n\n' + 'Body text of the release. ' * 200,
+            'collection_name': 'Benchmark Agency News',
+            'topic': 'Economy',
+            'branch': 'Executive',
+            'country': 'United States',
+        }
+        for n in range(count)
+    ]
+
+
+def connection_kwargs():
+    return {
+        'user': os.environ.get('POSTGRES_USERNAME'),
+        'password': os.environ.get('POSTGRES_PASS'),
+        'host': os.environ.get('POSTGRES_ADDRESS', 'localhost'),
+        'port': os.environ.get('POSTGRES_PORT'),
+        'database': os.environ.get('POSTGRES_DBNAME'),
+    }
+
+
+def reset_table(connection):
+    with connection.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cur.execute(f'CREATE SCHEMA {SCHEMA}')
+        cur.execute(
+            f'CREATE TABLE {SCHEMA}.{TABLE} (id SERIAL PRIMARY KEY, title TEXT, url TEXT, '
+            'image_url TEXT, document_url TEXT, created_at TIMESTAMPTZ, description TEXT, md TEXT, '
+            'collection_name TEXT, topic TEXT, branch TEXT, country TEXT)'
+        )
+    connection.commit()
+
+
+def per_item_insert(connection, rows):
+    # What WriteToDbPipeline.process_item used to do for every item
+    cur = connection.cursor()
+    ids = []
+    for row in rows:
+        columns = ', '.join(row.keys())
+        values = ', '.join('%({})s'.format(key) for key in row.keys())
+        cur.execute(f'INSERT INTO {SCHEMA}.{TABLE} ({columns}) VALUES ({values}) RETURNING id', row)
+        ids.append(cur.fetchone()[0])
+        connection.commit()
+    cur.close()
+    return ids
+
+
+def batched_insert(pipeline, rows, batch_size):
+    ids = []
+    for start in range(0, len(rows), batch_size):
+        ids.extend(pipeline.write_rows(TABLE, COLUMNS, rows[start:start + batch_size]))
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    kwargs = connection_kwargs()
+    connection = psycopg2.connect(**kwargs)
+    try:
+        reset_table(connection)
+        started = time.perf_counter()
+        per_item_ids = per_item_insert(connection, rows)
+        per_item_time = time.perf_counter() - started
+
+        reset_table(connection)
+        pipeline = WriteToDbPipeline(Settings({
+            'DB_SCHEMA': SCHEMA,
+            'POSTGRES_USERNAME': kwargs['user'],
+            'POSTGRES_PASSWORD': kwargs['password'],
+            'POSTGRES_ADDRESS': kwargs['host'],
+            'POSTGRES_PORT': kwargs['port'],
+            'POSTGRES_DBNAME': kwargs['database'],
+        }))
+        pipeline.open_spider(None)
+        pipeline.flush_loop.stop()
+        started = time.perf_counter()
+        batched_ids = batched_insert(pipeline, rows, args.batch_size)
+        batched_time = time.perf_counter() - started
+        pipeline.pool.closeall()
+
+        if per_item_ids != batched_ids:
+            raise SystemExit('batched insert returned different ids')
+    finally:
+        with connection.cursor() as cur:
+            cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        connection.commit()
+        connection.close()
+
+    print(f'{args.rows} rows, batches of {args.batch_size}')
+    print(f'{"per-item INSERT + commit":<28} {args.rows / per_item_time:>10,.0f} rows/sec')
+    print(f'{"batched execute_values":<28} {args.rows / batched_time:>10,.0f} rows/sec  '
+          f'({per_item_time / batched_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
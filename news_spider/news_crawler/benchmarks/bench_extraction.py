@@ -0,0 +1,132 @@
+"""
+Benchmark for article extraction and markdown conversion.
+
+Compares the original path, trafilatura JSON in parse_article followed by
+readability's Document(...).summary() and markdownify in
+NewsCrawlerPipeline, against extract_article, which parses the page once
+and renders both the metadata and the markdown from that tree. Reports CPU
+ms per article, peak RSS growth and the per-stage split of extract_article.
+
+Pass a directory of saved article pages (*.html) or let the script generate
+synthetic ones. The original path needs the packages it used:
+
+    pip install readability-lxml markdownify
+    python -m benchmarks.bench_extraction --pages saved_articles/
+    python -m benchmarks.bench_extraction --synthetic 200
+"""
+import argparse
+import glob
+import os
+import random
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from trafilatura import extract
+
+from news_crawler.extraction import EXTRACTION_STAGES, extract_article
+
+WORDS = [
+    'agency', 'announces', 'grant', 'funding', 'rural', 'water', 'safety', 'weather', 'report',
+    'statement', 'secretary', 'program', 'health', 'energy', 'climate', 'housing', 'tax', 'labor',
+    'transport', 'education', 'veterans', 'border', 'trade', 'census', 'economy', 'farm',
+]
+
+
+def synthetic_article(rng, index):
+    def sentence():
+        words = rng.sample(WORDS, 10)
+        words[2] = '<strong>%s</strong>' % words[2]
+        return ' '.join(words).capitalize() + '.'
+
+    sections = ''.join(
+        '<h2>%s</h2><p>%s</p><p>%s</p><ul>%s</ul>' % (
+            ' '.join(rng.sample(WORDS, 4)).title(),
+            ' '.join(sentence() for _ in range(6)),
+            ' '.join(sentence() for _ in range(4)),
+            ''.join('<li>%s</li>' % ' '.join(rng.sample(WORDS, 6)) for _ in range(4)),
+        )
+        for _ in range(rng.randint(4, 10))
+    )
+    nav = ''.join('<li><a href="/topics/%s">%s</a></li>' % (word, word) for word in WORDS)
+    return (
+        '<!DOCTYPE html><html><head><title>Release %d</title>'
+        '<meta name="description" content="%s">'
+        '<meta property="article:published_time" content="2025-05-%02dT10:00:00-04:00">'
+        '<script>window.dataLayer = [];</script><style>body { margin: 0 }</style></head><body>'
+        '<header><nav><ul>%s</ul></nav></header>'
+        '<main><article><h1>%s</h1>%s</article></main>'
+        '<aside class="related"><ul>%s</ul></aside><footer><ul>%s</ul></footer></body></html>'
+    ) % (index, ' '.join(rng.sample(WORDS, 12)), rng.randint(1, 28), nav,
+         ' '.join(rng.sample(WORDS, 6)).title(), sections, nav, nav)
+
+
+def load_pages(args):
+    if args.pages:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(args.pages, '*.html'))):
+            with open(path, encoding='utf-8', errors='replace') as page_file:
+                pages.append(page_file.read())
+        return pages
+    rng = random.Random(1)
+    return [synthetic_article(rng, n) for n in range(args.synthetic)]
+
+
+def legacy_extract(html):
+    from markdownify import markdownify as md
+    from readability import Document
+
+    data = extract(html, output_format="json", with_metadata=True)
+    return data, md(Document(html).summary())
+
+
+def measure(method, pages):
+    # Runs in a fresh child process so ru_maxrss belongs to this method alone
+    convert = legacy_extract if method == 'legacy' else extract_article
+    convert(pages[0])
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stages = dict.fromkeys(EXTRACTION_STAGES, 0.0)
+    started = time.process_time()
+    for html in pages:
+        data = convert(html)
+        if method == 'current' and data is not None:
+            for stage, ms in data['timings'].items():
+                stages[stage] += ms
+    elapsed = time.process_time() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    return elapsed, peak * 1024, stages
+
+
+def measure_in_child(method, pages):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(measure, method, pages).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', help='directory of saved article pages')
+    parser.add_argument('--synthetic', type=int, default=200)
+    args = parser.parse_args()
+
+    pages = load_pages(args)
+    if not pages:
+        raise SystemExit('no pages to benchmark')
+    try:
+        import markdownify, readability  # noqa: F401
+    except ImportError:
+        raise SystemExit('the original path needs readability-lxml and markdownify installed')
+
+    legacy_time, legacy_peak, _ = measure_in_child('legacy', pages)
+    current_time, current_peak, stages = measure_in_child('current', pages)
+
+    print(f'{len(pages)} articles')
+    for label, elapsed, peak in (('trafilatura + readability + markdownify', legacy_time, legacy_peak),
+                                 ('extract_article (single parse)', current_time, current_peak)):
+        print(f'{label:<40} {elapsed * 1000 / len(pages):>7.2f} CPU ms/article  '
+              f'peak RSS +{peak / 1024 / 1024:.1f} MiB')
+    print('extract_article stages: ' + ', '.join(
+        f'{stage} {ms / len(pages):.2f} ms' for stage, ms in stages.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark for sitemap parsing.
+
+Parses one large synthetic sitemap, gzipped like most .gov sitemaps, with
+scrapy.utils.sitemap.Sitemap, which builds the whole tree before the first
+entry comes out, and with iter_feed_entries, which streams it with
+iterparse. Checks both read the same URLs and lastmods and reports entries
+per second and peak RSS growth of each, in a fresh child process.
+
+    python -m benchmarks.bench_feeds --urls 200000
+"""
+import argparse
+import gzip
+import hashlib
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy.utils.gz import gunzip
+from scrapy.utils.sitemap import Sitemap
+
+from news_crawler.feeds import iter_feed_entries, parse_feed_date
+
+
+def make_sitemap(count):
+    entries = ''.join(
+        f'<url><loc>https://www.agency.gov/news/{2015 + n % 10}/{n % 12 + 1:02d}/'
+        f'agency-announces-update-{n}</loc><lastmod>{2015 + n % 10}-{n % 12 + 1:02d}-'
+        f'{n % 28 + 1:02d}T10:00:00+00:00</lastmod><changefreq>monthly</changefreq></url>'
+        for n in range(count)
+    )
+    return gzip.compress(
+        ('<?xml version="1.0" encoding="UTF-8"?>'
+         '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+         f'{entries}</urlset>').encode('utf-8')
+    )
+
+
+def read_scrapy(body):
+    for entry in Sitemap(gunzip(body)):
+        yield entry['loc'], parse_feed_date(entry.get('lastmod'))
+
+
+def read_streaming(body):
+    for _, url, date in iter_feed_entries(body):
+        yield url, date
+
+
+def measure(method, body):
+    # Runs in a fresh child process so ru_maxrss belongs to this method alone
+    read = read_scrapy if method == 'scrapy' else read_streaming
+    digest = hashlib.sha1()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for url, date in read(body):
+        digest.update(f'{url} {date.isoformat()}\n'.encode('utf-8'))
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    return digest.hexdigest(), elapsed, peak * 1024
+
+
+def measure_in_child(method, body):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(measure, method, body).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--urls', type=int, default=200000)
+    args = parser.parse_args()
+
+    body = make_sitemap(args.urls)
+    results = {method: measure_in_child(method, body) for method in ('scrapy', 'streaming')}
+    if results['scrapy'][0] != results['streaming'][0]:
+        raise SystemExit('the two parsers disagree')
+
+    print(f'{args.urls} URLs, {len(body) / 1024 / 1024:.1f} MiB gzipped, identical entries')
+    for label, method in (('Sitemap (full tree)', 'scrapy'), ('iter_feed_entries', 'streaming')):
+        _, elapsed, peak = results[method]
+        print(f'{label:<22} {args.urls / elapsed:>10,.0f} entries/sec  peak RSS +{peak / 1024 / 1024:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
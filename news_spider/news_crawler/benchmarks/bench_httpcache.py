@@ -0,0 +1,152 @@
+"""
+Benchmark of HTTP cache storage backends.
+
+Stores --responses synthetic government pages (listing and article HTML of
+--page-kb KiB on average) in Scrapy's FilesystemCacheStorage, the default,
+and in SegmentCacheStorage, then reads --lookups random ones back (half of
+them cached, half not) and reports store rate, lookup latency percentiles,
+the time to open an existing cache and the disk footprint (allocated
+blocks, and files). Lookups run twice: "cold", after dropping the cache
+files from the OS page cache (posix_fadvise), as on a cache larger than
+memory or the first run of the day, then "warm".
+
+    python -m benchmarks.bench_httpcache --responses 5000 --page-kb 40
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from scrapy.utils.reactor import install_reactor
+
+install_reactor('twisted.internet.asyncioreactor.AsyncioSelectorReactor')
+
+from scrapy import Spider  # noqa: E402
+from scrapy.extensions.httpcache import FilesystemCacheStorage  # noqa: E402
+from scrapy.http import HtmlResponse, Request  # noqa: E402
+from scrapy.utils.test import get_crawler  # noqa: E402
+
+from news_crawler.httpcache import SegmentCacheStorage  # noqa: E402
+
+WORDS = ['agency', 'announces', 'grant', 'funding', 'rural', 'water', 'safety', 'report', 'statement',
+         'secretary', 'program', 'health', 'energy', 'housing', 'federal', 'communities', 'families']
+
+BACKENDS = {
+    'FilesystemCacheStorage': FilesystemCacheStorage,
+    'SegmentCacheStorage': SegmentCacheStorage,
+}
+
+
+def page(rng, n, size):
+    paragraphs = []
+    while sum(map(len, paragraphs)) < size:
+        paragraphs.append(f'<p>The Secretary’s office {" ".join(rng.choice(WORDS) for _ in range(30))} {n}.</p>')
+    return (f'<html><head><meta charset="utf-8"><title>Release {n}</title></head><body>'
+            f'<nav>{"<a href=/x>Link</a>" * 40}</nav><article>{"".join(paragraphs)}</article></body></html>'
+            ).encode('utf-8')
+
+
+def make_responses(count, page_size, rng):
+    responses = []
+    for n in range(count):
+        url = f'https://www.agency{n % 50}.gov/news/2025/05/release-{n}'
+        responses.append(HtmlResponse(url, body=page(rng, n, rng.randint(page_size // 2, page_size * 3 // 2)),
+                                      headers={'Content-Type': 'text/html; charset=utf-8',
+                                               'Last-Modified': 'Thu, 01 May 2025 12:00:00 GMT'},
+                                      request=Request(url)))
+    return responses
+
+
+def open_storage(backend, directory):
+    crawler = get_crawler(Spider, {'HTTPCACHE_DIR': directory})
+    spider = Spider('bench')
+    spider.crawler = crawler
+    crawler.stats.open_spider(spider)
+    storage = backend(crawler.settings)
+    started = time.perf_counter()
+    storage.open_spider(spider)
+    return storage, spider, time.perf_counter() - started
+
+
+def footprint(directory):
+    allocated = files = 0
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            allocated += os.stat(os.path.join(root, name)).st_blocks * 512
+            files += 1
+    return allocated, files
+
+
+def evict_page_cache(directory):
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            fd = os.open(os.path.join(root, name), os.O_RDONLY)
+            try:
+                os.fdatasync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+
+def lookup(storage, spider, urls):
+    """Latencies of the lookups that hit and of the ones that missed."""
+    hits, misses = [], []
+    for url in urls:
+        request = Request(url)
+        started = time.perf_counter()
+        response = storage.retrieve_response(spider, request)
+        (hits if response is not None else misses).append(time.perf_counter() - started)
+    return hits, misses
+
+
+def percentile(values, share):
+    return sorted(values)[min(len(values) - 1, int(len(values) * share))]
+
+
+def measure(label, backend, responses, lookups, rng):
+    with tempfile.TemporaryDirectory() as directory:
+        storage, spider, _ = open_storage(backend, directory)
+        started = time.perf_counter()
+        for response in responses:
+            storage.store_response(spider, response.request, response)
+        stored = time.perf_counter() - started
+        storage.close_spider(spider)
+
+        evict_page_cache(directory)
+        storage, spider, opened = open_storage(backend, directory)
+        cold = lookup(storage, spider, lookups)
+        warm = lookup(storage, spider, lookups)
+        storage.close_spider(spider)
+        allocated, files = footprint(directory)
+
+    body = sum(len(response.body) for response in responses)
+    print(f'{label}: store {len(responses) / stored:,.0f}/s, open {opened * 1000:.1f} ms, '
+          f'disk {allocated / 1024 / 1024:.1f} MiB ({allocated / body:.0%} of bodies) in {files} files')
+    for name, (hits, misses) in (('cold', cold), ('warm', warm)):
+        for kind, latencies in (('hit', hits), ('miss', misses)):
+            print(f'    {name} {kind:<4} {len(latencies):6d}  mean {sum(latencies) / len(latencies) * 1e6:8.1f} us  '
+                  f'p50 {percentile(latencies, 0.5) * 1e6:8.1f} us  p99 {percentile(latencies, 0.99) * 1e6:8.1f} us')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--responses', type=int, default=5000)
+    parser.add_argument('--page-kb', type=int, default=40)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    responses = make_responses(args.responses, args.page_kb * 1024, rng)
+    lookups = [rng.choice(responses).url if rng.random() < 0.5 else f'https://www.agency.gov/missing/{n}'
+               for n in range(args.lookups)]
+    body = sum(len(response.body) for response in responses)
+    print(f'{len(responses)} responses, {body / 1024 / 1024:.1f} MiB of bodies, {len(lookups)} lookups')
+    for label, backend in BACKENDS.items():
+        measure(label, backend, responses, lookups, rng)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark of the project's import time.
+
+Imports each of --modules in a fresh interpreter under `python -X
+importtime` and reports, as the median of --repeat runs, the module's
+cumulative import time, the part of it spent in Scrapy (which every module
+pays once), and the third-party packages it pulled in, slowest first.
+Modules the interpreter imports before running anything are left out. Also
+times `scrapy list` from start to exit.
+
+Exits with status 1 when one of the modules imports a dependency that is
+only meant to be imported on first use (LAZY), or takes more than
+--budget-ms beyond Scrapy, so it can guard startup time in CI:
+
+    python -m benchmarks.bench_imports --repeat 7
+    python -m benchmarks.bench_imports --budget-ms 150
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+MODULES = (
+    'news_crawler.settings',
+    'news_crawler.spiders.gov_news',
+    'news_crawler.pipelines',
+    'news_crawler.middlewares',
+    'news_crawler.extensions',
+    'news_crawler.ranking',
+)
+
+# Imported where they are first used, never at startup
+LAZY = ('trafilatura', 'requests', 'psycopg2', 'dateutil', 'pytz')
+
+_LINE_RE = re.compile(r'import time:\s+\d+ \|\s+(\d+) \| *(\S+)')
+
+
+def import_times(statement):
+    """{module: cumulative microseconds} of a fresh interpreter running `statement`."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for match in _LINE_RE.finditer(result.stderr):
+        times[match.group(2)] = int(match.group(1))
+    return times
+
+
+def third_party(times, startup):
+    """Cumulative microseconds of the top-level non-stdlib packages in `times` that aren't in `startup`."""
+    packages = {}
+    for name, cumulative in times.items():
+        if '.' not in name and name not in sys.stdlib_module_names and name not in startup \
+                and not name.startswith('_') and name != 'news_crawler':
+            packages[name] = cumulative
+    return packages
+
+
+def median_times(statement, repeat):
+    runs = defaultdict(list)
+    for _ in range(repeat):
+        for name, cumulative in import_times(statement).items():
+            runs[name].append(cumulative)
+    return {name: statistics.median(values) for name, values in runs.items()}
+
+
+def scrapy_list(repeat):
+    elapsed = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'scrapy', 'list'], capture_output=True, check=True)
+        elapsed.append(time.perf_counter() - started)
+    return statistics.median(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='third-party packages listed per module')
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='fail when a module takes longer than this beyond Scrapy')
+    args = parser.parse_args()
+
+    # Compile the .pyc files first, so the first run isn't slower
+    import_times('; '.join(f'import {module}' for module in args.modules))
+    startup = set(import_times('pass'))
+
+    failures = []
+    print(f'{"module":<32} {"total ms":>9} {"scrapy ms":>10} {"own ms":>8}  slowest packages (ms)')
+    for module in args.modules:
+        times = median_times(f'import {module}', args.repeat)
+        total = times[module] / 1000
+        in_scrapy = times.get('scrapy', 0) / 1000
+        packages = third_party(times, startup)
+        loaded = [name for name in LAZY if name in packages]
+        slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        print(f'{module:<32} {total:9.1f} {in_scrapy:10.1f} {total - in_scrapy:8.1f}  '
+              + ', '.join(f'{name} {cumulative / 1000:.0f}' for name, cumulative in slowest))
+        if loaded:
+            failures.append(f'{module} imports {", ".join(loaded)} at startup')
+        if args.budget_ms is not None and total - in_scrapy > args.budget_ms:
+            failures.append(f'{module} takes {total - in_scrapy:.1f} ms beyond Scrapy, over {args.budget_ms:g} ms')
+
+    print(f'scrapy list: {scrapy_list(args.repeat) * 1000:.0f} ms')
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark of memory held per in-flight article.
+
+While an article item goes through the pipelines Scrapy keeps its response
+alive, and the suspended parse_article keeps its locals. Builds --items
+articles from synthetic pages the way parse_article used to (response.text
+cached on the response, trafilatura's output kept alive, a NewsItems dict)
+and the way it does now (response_html, output released, ArticleRecord),
+and reports peak RSS growth per 10k in-flight items for each, plus the
+items alone. Each case runs in a fresh child process.
+
+    python -m benchmarks.bench_items --items 10000 --page-kb 30
+"""
+import argparse
+import random
+import resource
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy.http import HtmlResponse
+
+from news_crawler.extraction import response_html
+from news_crawler.items import ArticleRecord, NewsItems
+
+WORDS = ['agency', 'announces', 'grant', 'funding', 'rural', 'water', 'safety', 'report', 'statement',
+         'secretary', 'program', 'health', 'energy', 'housing', 'federal', 'communities', 'families']
+
+CASES = {
+    'before': 'NewsItems, response.text cached, extraction output kept',
+    'after': 'ArticleRecord, response_html, extraction output released',
+    'news_items': 'NewsItems alone',
+    'article_record': 'ArticleRecord alone',
+}
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def page(rng, n, size):
+    # Smart quotes, as on most agency sites, make the decoded text 2 bytes per character
+    paragraphs = []
+    while sum(map(len, paragraphs)) < size:
+        paragraphs.append(f'<p>The Secretary’s office {words(rng, 30)} {n}.</p>')
+    return (f'<html><head><meta charset="utf-8"><title>Release {n}</title></head><body>'
+            f'<nav>{"<a href=/x>Link</a>" * 40}</nav><article>{"".join(paragraphs)}</article></body></html>'
+            ).encode('utf-8')
+
+
+def extraction_output(rng, n):
+    # The dict ExtractionExecutor.extract returns for an article
+    text = words(rng, 900) + f' {n}'
+    return {'title': f'Agency announces update {n}', 'date': '2025-05-01', 'text': text, 'raw_text': text + ' ',
+            'md': '# Agency announces update\n\n' + text, 'excerpt': None, 'comments': '', 'image': None,
+            'author': None, 'hostname': 'www.agency.gov', 'categories': '', 'tags': '',
+            'timings': {'parse': 20.0, 'metadata': 5.0, 'markdown': 1.0}}
+
+
+def fields(data, url):
+    return dict(title=data['title'], url=url, image_url=None, document_url=None, created_at=data['date'],
+                description=data['excerpt'] or data['raw_text'], md=data['md'], collection_name='Agency',
+                topic='Health', branch='Executive', country='United States')
+
+
+def measure(case, count, page_size):
+    rng = random.Random(1)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    in_flight = []
+    for n in range(count):
+        url = f'https://www.agency.gov/news/2025/05/update-{n}'
+        data = extraction_output(rng, n)
+        if case == 'news_items':
+            in_flight.append(NewsItems(fields(data, url)))
+            continue
+        if case == 'article_record':
+            in_flight.append(ArticleRecord(**fields(data, url)))
+            continue
+        response = HtmlResponse(url, body=page(rng, n, page_size),
+                                headers={'Content-Type': 'text/html; charset=utf-8'})
+        if case == 'before':
+            response.text
+            in_flight.append((response, data, NewsItems(fields(data, url))))
+        else:
+            response_html(response)
+            in_flight.append((response, ArticleRecord(**fields(data, url))))
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--page-kb', type=int, default=30, help='HTML size of each article page')
+    args = parser.parse_args()
+
+    print(f'{args.items} in-flight articles, {args.page_kb} KiB pages')
+    for case, label in CASES.items():
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            peak = executor.submit(measure, case, args.items, args.page_kb * 1024).result()
+        print(f'{label:<58} peak RSS +{peak / 1024 / 1024:8.1f} MiB  '
+              f'({peak / 1024 / 1024 * 10000 / args.items:8.1f} MiB per 10k items)')
+
+
+if __name__ == '__main__':
+    main()
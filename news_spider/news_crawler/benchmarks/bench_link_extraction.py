@@ -0,0 +1,141 @@
+"""
+Benchmark for listing-page link extraction.
+
+Compares the original BeautifulSoup decompose + re-serialize + LinkExtractor
+path from GovNewsSpider.parse against BoilerplateLinkExtractor. Reports
+pages/sec, peak RSS growth and whether both produce the same link set.
+
+Pass a directory of saved listing pages (*.html, the file name is used as
+the page URL path) or let the script generate synthetic ones:
+
+    python -m benchmarks.bench_link_extraction --pages saved_pages/
+    python -m benchmarks.bench_link_extraction --synthetic 200
+"""
+import argparse
+import glob
+import os
+import random
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup
+from scrapy.http import HtmlResponse
+from scrapy.linkextractors import LinkExtractor
+
+from news_crawler.linkextractors import BoilerplateLinkExtractor
+
+LEGACY_SELECTORS = [
+    'header', 'nav', 'footer', 'aside', '.sidebar', '.footer', '.header', '.nav', '.sidenav',
+    'sidebar', '.pagination', '.pager', '.related-links', '.related-posts', 'comments', '.comment',
+    '.share-buttons', '.social-links', '.ad', '.advertisement', '.promo', '.promotion',
+]
+
+
+def legacy_extract_links(response):
+    soup = BeautifulSoup(response.text, 'html.parser')
+    for selector in LEGACY_SELECTORS:
+        for element in soup.select(selector):
+            element.decompose()
+    processed_response = HtmlResponse(url=response.url, body=str(soup), encoding='utf-8')
+    return LinkExtractor().extract_links(processed_response)
+
+
+def synthetic_page(rng, index):
+    def links(prefix, count):
+        return ''.join(
+            '<li><a href="%s/%s-%d">Link %d</a></li>' % (prefix, '-'.join(rng.sample(WORDS, 5)), n, n)
+            for n in range(count)
+        )
+
+    articles = ''.join(
+        '<article class="teaser"><h3><a href="/news/%d/%02d/%s">Story %d</a></h3>'
+        '<p>%s</p></article>' % (rng.randint(2020, 2025), rng.randint(1, 12),
+                                  '-'.join(rng.sample(WORDS, 7)), n, ' '.join(rng.sample(WORDS, 12)))
+        for n in range(rng.randint(20, 60))
+    )
+    return (
+        '<!DOCTYPE html><html><head><title>News %d</title></head><body>'
+        '<header><a href="/">Home</a><nav><ul>%s</ul></nav></header>'
+        '<div class="layout"><main>%s'
+        '<ul class="pagination">%s</ul></main>'
+        '<div class="sidebar related-links"><ul>%s</ul></div>'
+        '<div class="ad promo"><a href="https://ads.example.com/x">Ad</a></div></div>'
+        '<footer><ul>%s</ul><a href="https://www.facebook.com/agency">fb</a></footer>'
+        '</body></html>'
+    ) % (index, links('/topics', 40), articles, links('/news/page', 10), links('/resources', 25),
+         links('/about', 30))
+
+
+WORDS = [
+    'agency', 'announces', 'grant', 'funding', 'rural', 'water', 'safety', 'weather', 'report',
+    'statement', 'secretary', 'program', 'health', 'energy', 'climate', 'housing', 'tax', 'labor',
+    'transport', 'education', 'veterans', 'border', 'trade', 'census', 'economy', 'farm',
+]
+
+
+def load_pages(args):
+    if args.pages:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(args.pages, '*.html'))):
+            with open(path, 'rb') as page_file:
+                name = os.path.splitext(os.path.basename(path))[0]
+                pages.append(('https://www.example.gov/%s' % name, page_file.read()))
+        return pages
+    rng = random.Random(1)
+    return [('https://www.example.gov/news/%d' % n, synthetic_page(rng, n).encode('utf-8'))
+            for n in range(args.synthetic)]
+
+
+def run(extract, pages):
+    results = []
+    for url, body in pages:
+        # Build a fresh response each time so the parse is part of the cost
+        response = HtmlResponse(url=url, body=body, encoding='utf-8')
+        results.append({link.url for link in extract(response)})
+    return results
+
+
+def measure(method, pages):
+    # Runs in a fresh child process so ru_maxrss belongs to this method
+    # alone; lxml allocates outside the Python heap, so tracemalloc would
+    # not see most of it.
+    extract = legacy_extract_links if method == 'legacy' else BoilerplateLinkExtractor().extract_links
+    run(extract, pages[:1])
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    results = run(extract, pages)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    return results, elapsed, peak * 1024
+
+
+def measure_in_child(method, pages):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(measure, method, pages).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', help='directory of saved listing pages')
+    parser.add_argument('--synthetic', type=int, default=200)
+    args = parser.parse_args()
+
+    pages = load_pages(args)
+    if not pages:
+        raise SystemExit('no pages to benchmark')
+
+    legacy, legacy_time, legacy_peak = measure_in_child('legacy', pages)
+    current, current_time, current_peak = measure_in_child('current', pages)
+
+    mismatches = sum(1 for old, new in zip(legacy, current) if old != new)
+    print(f'{len(pages)} pages, {sum(map(len, current))} links, '
+          f'{mismatches} pages with a different link set')
+    for label, elapsed, peak in (('BeautifulSoup + LinkExtractor', legacy_time, legacy_peak),
+                                 ('BoilerplateLinkExtractor', current_time, current_peak)):
+        print(f'{label:<30} {len(pages) / elapsed:>9,.1f} pages/sec  '
+              f'peak RSS +{peak / 1024 / 1024:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
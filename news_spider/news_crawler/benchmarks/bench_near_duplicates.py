@@ -0,0 +1,105 @@
+"""
+Benchmark for the near-duplicate index.
+
+Fills a NearDuplicateIndex with signatures of distinct articles, then times
+minhash_signature on article-sized texts and NearDuplicateIndex.find for
+unrelated articles and for edited copies of stored ones (a few words
+changed, a dateline and a contact line added), and reports how many copies
+were found and how many unrelated articles were flagged.
+
+    python -m benchmarks.bench_near_duplicates --docs 1000000   (filling takes a few minutes)
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from news_crawler.dedup import (SIGNATURE_SIZE, _SIGNATURE, NearDuplicateIndex, band_keys,
+                                minhash_signature)
+
+WORDS = [
+    'agency', 'announces', 'grant', 'funding', 'rural', 'water', 'safety', 'weather', 'report',
+    'statement', 'secretary', 'program', 'health', 'energy', 'climate', 'housing', 'tax', 'labor',
+    'transport', 'education', 'veterans', 'border', 'trade', 'census', 'economy', 'farm', 'state',
+    'county', 'million', 'public', 'federal', 'new', 'support', 'communities', 'families', 'year',
+]
+
+
+def article(rng, words):
+    return ' '.join(rng.choice(WORDS) + str(rng.randrange(40)) for _ in range(words))
+
+
+def edited_copy(rng, text):
+    words = text.split()
+    for _ in range(3):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return ('WASHINGTON (May 9) - ' + ' '.join(words)
+            + ' For more information contact the press office at press@agency.gov.')
+
+
+def fill(index, count, rng, texts):
+    # Stored articles we know the text of, then random signatures standing in
+    # for the millions of other distinct articles
+    for n, text in enumerate(texts):
+        index.add(minhash_signature(text), f'https://www.agency.gov/stored/{n}')
+    db = index.db
+    db.execute("BEGIN")
+    for start in range(0, count - len(texts), 10000):
+        rows = []
+        for _ in range(min(10000, count - len(texts) - start)):
+            signature = tuple(rng.getrandbits(32) for _ in range(SIGNATURE_SIZE))
+            rows.append((signature, _SIGNATURE.pack(*signature)))
+        first = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM docs").fetchone()[0]
+        db.executemany("INSERT INTO docs (id, signature) VALUES (?, ?)",
+                       [(first + n, packed) for n, (_, packed) in enumerate(rows)])
+        db.executemany("INSERT INTO bands (key, doc_id) VALUES (?, ?)",
+                       [(key, first + n) for n, (signature, _) in enumerate(rows) for key in band_keys(signature)])
+    db.execute("COMMIT")
+
+
+def timed(function, values):
+    results, times = [], []
+    for value in values:
+        started = time.perf_counter()
+        results.append(function(value))
+        times.append((time.perf_counter() - started) * 1000)
+    times.sort()
+    return results, statistics.median(times), times[int(0.99 * (len(times) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=1000000, help='signatures in the index')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--words', type=int, default=400, help='words per article')
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stored = [article(rng, args.words) for _ in range(args.queries)]
+    copies = [edited_copy(rng, text) for text in stored]
+    unrelated = [article(rng, args.words) for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = NearDuplicateIndex(os.path.join(tmp, 'near_duplicates.sqlite'), threshold=args.threshold)
+        started = time.perf_counter()
+        fill(index, args.docs, rng, stored)
+        print(f'{len(index):,} signatures indexed in {time.perf_counter() - started:.0f}s, '
+              f'{os.path.getsize(os.path.join(tmp, "near_duplicates.sqlite")) / len(index):.0f} bytes each')
+
+        signatures, median, p99 = timed(minhash_signature, copies)
+        print(f'{"minhash_signature":<24} median {median:.3f} ms  p99 {p99:.3f} ms  ({args.words} words)')
+        found, median, p99 = timed(index.find, signatures)
+        recall = sum(match is not None for match in found) / len(found)
+        print(f'{"find, edited copies":<24} median {median:.3f} ms  p99 {p99:.3f} ms  found {recall:.1%}')
+        flagged, median, p99 = timed(index.find, [minhash_signature(text) for text in unrelated])
+        false_positives = sum(match is not None for match in flagged)
+        print(f'{"find, unrelated":<24} median {median:.3f} ms  p99 {p99:.3f} ms  flagged {false_positives}')
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+Benchmark of notification delivery.
+
+Starts a local stand-in for the notification service that answers each POST
+after --latency seconds and fails --fail-rate of them with a 503, then
+sends a burst of NotificationModels (spread over a few collections and
+topics, some for the same row twice) two ways:
+
+    inline               one POST per notification before the item moves on,
+                         what sending them from the item pipeline costs
+    NotificationPipeline accepted at once, coalesced and delivered in batches
+                         in the background, with retries
+
+and reports how long the crawl is held, how long delivery takes, how many
+requests were made, and checks every row was delivered.
+
+    python -m benchmarks.bench_notifications --notifications 2000 --latency 0.1
+    python -m benchmarks.bench_notifications --serve 8800   (stand-in only, for a crawl
+                                                             with NOTIFICATIONS_URL=http://127.0.0.1:8800/)
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from twisted.internet import defer
+
+from scrapy.utils.test import get_crawler
+
+from news_crawler.items import NotificationModel
+from news_crawler.pipelines import NotificationPipeline
+
+
+class StandInService:
+    """Notification endpoint that records the rows it accepts."""
+
+    def __init__(self, latency=0.1, fail_rate=0.0, seed=1, verbose=False):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rows = []
+
+    def serve(self, port=0):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                batch = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                time.sleep(service.latency)
+                with service.lock:
+                    service.requests += 1
+                    failed = service.rng.random() < service.fail_rate
+                    if not failed:
+                        service.rows.extend((n['country_schema'], n['table_source_name'], n['table_id'])
+                                            for n in batch.get('notifications', [batch]))
+                if service.verbose:
+                    print(f"{'503' if failed else '200'} {batch.get('collection_name')} / {batch.get('topic')}: "
+                          f"{len(batch.get('notifications', [batch]))} notifications")
+                self.send_response(503 if failed else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def reset(self):
+        self.requests = 0
+        self.rows = []
+
+
+def make_notifications(count, collections, topics, repeat_share, rng):
+    notifications = []
+    for n in range(count):
+        if notifications and rng.random() < repeat_share:
+            # A recent row again, e.g. the same release reached through two listings
+            notifications.append(dict(rng.choice(notifications[-50:])))
+            continue
+        notifications.append({
+            'title': f'Agency announces update {n}',
+            'table_id': n,
+            'country_schema': 'united_states_of_america',
+            'table_source_name': 'article_objects',
+            'image_url': None,
+            'description': 'Summary of the announcement. ' * 5,
+            'topic': f'topic-{rng.randrange(topics)}',
+            'collection_name': f'collection-{rng.randrange(collections)}',
+        })
+    return notifications
+
+
+def run_inline(url, notifications):
+    session = requests.Session()
+    started = time.perf_counter()
+    for notification in notifications:
+        for _ in range(4):
+            if session.post(url, json=notification, timeout=10).ok:
+                break
+    return time.perf_counter() - started
+
+
+@defer.inlineCallbacks
+def run_pipeline(url, notifications, args):
+    crawler = get_crawler(settings_dict={
+        'NOTIFICATIONS_URL': url,
+        'NOTIFICATIONS_WINDOW': args.window,
+        'NOTIFICATIONS_MAX_PENDING': args.max_pending,
+        'NOTIFICATIONS_RETRY_BACKOFF': 0.05,
+    })
+    pipeline = NotificationPipeline.from_crawler(crawler)
+    started = time.perf_counter()
+    yield defer.DeferredList([
+        pipeline.process_item(NotificationModel(notification), None) for notification in notifications
+    ])
+    accepted = time.perf_counter() - started
+    yield pipeline.close_spider(None)
+    return accepted, time.perf_counter() - started, crawler.stats.get_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--notifications', type=int, default=2000)
+    parser.add_argument('--collections', type=int, default=20)
+    parser.add_argument('--topics', type=int, default=3)
+    parser.add_argument('--repeat-share', type=float, default=0.05, help='notifications for a row already sent')
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds the service takes per request')
+    parser.add_argument('--fail-rate', type=float, default=0.1)
+    parser.add_argument('--window', type=float, default=0.5)
+    parser.add_argument('--max-pending', type=int, default=1000)
+    parser.add_argument('--serve', type=int, metavar='PORT', help='only run the stand-in service')
+    args = parser.parse_args()
+
+    if args.serve:
+        StandInService(args.latency, args.fail_rate, verbose=True).serve(args.serve).serve_forever()
+        return
+
+    rng = random.Random(1)
+    notifications = make_notifications(args.notifications, args.collections, args.topics, args.repeat_share, rng)
+    rows = {(n['country_schema'], n['table_source_name'], n['table_id']) for n in notifications}
+    service = StandInService(args.latency, args.fail_rate)
+    server = service.serve()
+    url = f'http://127.0.0.1:{server.server_port}/'
+    print(f'{len(notifications)} notifications for {len(rows)} rows, service latency {args.latency * 1000:.0f} ms, '
+          f'{args.fail_rate:.0%} failures')
+
+    # Inline delivery holds each item for a whole request; time a sample and scale it
+    sample = notifications[:max(1, min(len(notifications), int(5 / max(args.latency, 0.001))))]
+    elapsed = run_inline(url, sample) * len(notifications) / len(sample)
+    print(f'{"inline":<22} crawl held {elapsed:8.2f}s  delivered {elapsed:8.2f}s  '
+          f'{len(notifications)} requests (extrapolated from {len(sample)})')
+
+    service.reset()
+    accepted, delivered, stats = run_in_reactor(run_pipeline, url, notifications, args)
+    duplicates = len(service.rows) - len(set(service.rows))
+    missing = len(rows - set(service.rows))
+    print(f'{"NotificationPipeline":<22} crawl held {accepted:8.2f}s  delivered {delivered:8.2f}s  '
+          f'{service.requests} requests ({stats.get("notifications/retries", 0)} retries, '
+          f'{stats.get("notifications/backpressure", 0)} items waited)')
+    print(f'{len(set(service.rows))} rows delivered, {missing} missing, {duplicates} delivered twice, '
+          f'{stats.get("notifications/coalesced", 0)} coalesced')
+
+
+def run_in_reactor(function, *args):
+    # Like task.react, without exiting the process afterwards
+    from twisted.internet import reactor
+
+    result = {}
+
+    def run():
+        running = function(*args)
+        running.addCallbacks(lambda value: result.update(value=value), lambda failure: result.update(error=failure))
+        running.addBoth(lambda _: reactor.stop())
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+    if 'error' in result:
+        result['error'].raiseException()
+    return result['value']
+
+
+if __name__ == '__main__':
+    main()
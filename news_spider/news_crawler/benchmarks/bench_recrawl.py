@@ -0,0 +1,144 @@
+"""
+Simulation of recrawl policies on a simulated clock.
+
+Generates --sources sources whose publish rates spread from a few articles
+a year to a few dozen a day (lognormal around --median-per-day), some of
+which go quiet halfway through, and runs the crawl every --run-every hours
+for --days days with three policies:
+
+    every run        every source at every run, as before
+    fixed interval   a source once SOURCES_RECRAWL_INTERVAL has passed
+    RecrawlScheduler a source once it is expected to have a new article
+
+A crawl finds the articles published since the previous one, but a listing
+only shows the latest --listing-size, so older ones are missed. As with
+trafilatura, the scheduler only learns the day an article was published.
+Reports
+listing fetches, fetches per new article found, missed articles and how
+long articles waited to be found.
+
+    python -m benchmarks.bench_recrawl --sources 500 --days 30
+"""
+import argparse
+import bisect
+import math
+import random
+
+from news_crawler.recrawl import RecrawlScheduler
+
+DAY = 86400.0
+
+
+def make_sources(count, days, median_per_day, quiet_share, rng):
+    sources = {}
+    for n in range(count):
+        rate = median_per_day * math.exp(rng.gauss(0, 1.5)) / DAY
+        quiet_from = days * DAY / 2 if rng.random() < quiet_share else days * DAY
+        published, t = [], 0.0
+        while True:
+            t += rng.expovariate(rate)
+            if t >= quiet_from:
+                break
+            published.append(t)
+        sources[f'source-{n}'] = published
+    return sources
+
+
+class Simulation:
+    def __init__(self, sources, listing_size):
+        self.sources = sources
+        self.listing_size = listing_size
+        self.last_crawled = {name: 0.0 for name in sources}
+        self.fetches = 0
+        self.found = 0
+        self.missed = 0
+        self.delays = []
+
+    def crawl(self, name, now):
+        """Returns the publication times a crawl of `name` at `now` finds."""
+        published = self.sources[name]
+        start = bisect.bisect_right(published, self.last_crawled[name])
+        end = bisect.bisect_right(published, now)
+        new = published[max(start, end - self.listing_size):end]
+        self.fetches += 1
+        self.found += len(new)
+        self.missed += end - start - len(new)
+        self.delays.extend(now - t for t in new)
+        self.last_crawled[name] = now
+        return new
+
+    def report(self, label, total):
+        delays = sorted(self.delays)
+        p90 = delays[int(len(delays) * 0.9)] / 3600 if delays else 0.0
+        mean = sum(delays) / len(delays) / 3600 if delays else 0.0
+        print(f'{label:<18} {self.fetches:8d} fetches  {self.found:6d} found  {self.missed:5d} missed  '
+              f'{self.fetches / max(self.found, 1):6.2f} fetches/article  '
+              f'delay mean {mean:6.1f} h  p90 {p90:6.1f} h  ({self.found / max(total, 1):.1%} of articles)')
+
+
+def runs(args):
+    t = 0.0
+    while t <= args.days * DAY:
+        yield t
+        t += args.run_every * 3600
+
+
+def every_run(sources, args):
+    simulation = Simulation(sources, args.listing_size)
+    for now in runs(args):
+        for name in sources:
+            simulation.crawl(name, now)
+    return simulation
+
+
+def fixed_interval(sources, args):
+    simulation = Simulation(sources, args.listing_size)
+    due = {name: 0.0 for name in sources}
+    for now in runs(args):
+        for name in sources:
+            if due[name] <= now:
+                simulation.crawl(name, now)
+                due[name] = now + args.fixed_interval * 3600
+    return simulation
+
+
+def scheduled(sources, args):
+    simulation = Simulation(sources, args.listing_size)
+    clock = [0.0]
+    scheduler = RecrawlScheduler(min_interval=args.run_every * 3600, target_new=args.target_new,
+                                 clock=lambda: clock[0])
+    for name in sources:
+        scheduler.load(name, next_due_at=0.0)
+    for now in runs(args):
+        clock[0] = now
+        for name in sources:
+            if not scheduler.is_due(name, now):
+                continue
+            for published_at in simulation.crawl(name, now):
+                scheduler.observe(name, f'{name}/{published_at}', published_at - published_at % DAY)
+            scheduler.crawled(name, True)
+    return simulation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sources', type=int, default=500)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--run-every', type=float, default=1.0, help='hours between crawls')
+    parser.add_argument('--median-per-day', type=float, default=0.5, help='median articles per source per day')
+    parser.add_argument('--quiet-share', type=float, default=0.1, help='sources that stop publishing halfway')
+    parser.add_argument('--listing-size', type=int, default=20)
+    parser.add_argument('--fixed-interval', type=float, default=24.0, help='hours, for the fixed interval policy')
+    parser.add_argument('--target-new', type=float, default=1.0)
+    args = parser.parse_args()
+
+    sources = make_sources(args.sources, args.days, args.median_per_day, args.quiet_share, random.Random(1))
+    total = sum(len(published) for published in sources.values())
+    print(f'{args.sources} sources, {total} articles over {args.days} days, a run every {args.run_every:g} h')
+    every_run(sources, args).report('every run', total)
+    fixed_interval(sources, args).report(f'fixed {args.fixed_interval:g} h', total)
+    scheduled(sources, args).report('RecrawlScheduler', total)
+
+
+if __name__ == '__main__':
+    main()
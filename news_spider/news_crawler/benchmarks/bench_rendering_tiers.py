@@ -0,0 +1,206 @@
+"""
+Benchmark of Zyte API fetch strategies for source listing pages.
+
+Starts a local mock of the Zyte API /v1/extract endpoint and fetches a set of
+synthetic listing pages, some of which only render with JavaScript, three
+ways:
+
+    browser+screenshot  what start_requests used to ask for on every source
+    tiered (cold)       RenderingTierMiddleware's plain HTTP first, browserHtml
+                        when needs_browser_rendering() says so
+    tiered (warm)       a later crawl, with the decisions cached by the cold run
+
+and reports latency and cost per page. Latencies and prices are made up;
+pass your own from the Zyte dashboard with --http-cost/--browser-cost.
+
+    python -m benchmarks.bench_rendering_tiers --sources 200 --js-share 0.15
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from scrapy.http import HtmlResponse
+
+from news_crawler.middlewares import RenderingTierMiddleware, needs_browser_rendering
+
+
+def listing_html(n):
+    links = ''.join(
+        f'<li><a href="/news/2025/05/agency-announces-update-{n}-{i}">Agency announces update {i}</a>'
+        f'<p>{"Summary of the announcement and what it means for the public. " * 3}</p></li>'
+        for i in range(30)
+    )
+    return (f'<html><head><title>News {n}</title></head><body><nav><a href="/">Home</a>'
+            f'<a href="/about">About</a></nav><h1>Newsroom</h1><ul>{links}</ul></body></html>')
+
+
+def shell_html(n):
+    return (f'<html><head><title>News {n}</title><script src="/static/app.{n}.js"></script></head>'
+            '<body><noscript>You need to enable JavaScript to run this app.</noscript>'
+            '<div id="root"></div><script>window.__STATE__ = {};</script></body></html>')
+
+
+class MockZyteApi:
+    """Answers POST /v1/extract like Zyte API, after a per-mode delay."""
+
+    def __init__(self, js_sources, http_latency, browser_latency, screenshot_latency):
+        self.js_sources = js_sources
+        self.http_latency = http_latency
+        self.browser_latency = browser_latency
+        self.screenshot_latency = screenshot_latency
+        self.screenshot = base64.b64encode(os.urandom(150_000)).decode('ascii')
+
+    def extract(self, params):
+        url = params['url']
+        n = int(url.rstrip('/').rsplit('-', 1)[1])
+        result = {'url': url, 'statusCode': 200}
+        if params.get('browserHtml'):
+            time.sleep(self.browser_latency)
+            result['browserHtml'] = listing_html(n)
+            if params.get('screenshot'):
+                time.sleep(self.screenshot_latency)
+                result['screenshot'] = self.screenshot
+        else:
+            time.sleep(self.http_latency)
+            html = shell_html(n) if n in self.js_sources else listing_html(n)
+            result['httpResponseBody'] = base64.b64encode(html.encode('utf-8')).decode('ascii')
+        return result
+
+    def serve(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                params = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                body = json.dumps(api.extract(params)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 128
+
+        server = Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class Client:
+    def __init__(self, endpoint, costs):
+        self.endpoint = endpoint
+        self.costs = costs
+        self.local = threading.local()
+
+    def fetch(self, url, tier, screenshot=False):
+        """Returns (html, seconds, cost) of one Zyte API request."""
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        params = dict(RenderingTierMiddleware.AUTOMAP[tier], url=url)
+        if screenshot:
+            params['screenshot'] = True
+        started = time.perf_counter()
+        result = session.post(self.endpoint, json=params).json()
+        elapsed = time.perf_counter() - started
+        if tier == RenderingTierMiddleware.BROWSER:
+            html = result['browserHtml']
+        else:
+            html = base64.b64decode(result['httpResponseBody']).decode('utf-8')
+        cost = self.costs[tier] + (self.costs['screenshot'] if screenshot else 0)
+        return html, elapsed, cost
+
+
+def fetch_browser_screenshot(client, url, tier):
+    _, elapsed, cost = client.fetch(url, RenderingTierMiddleware.BROWSER, screenshot=True)
+    return RenderingTierMiddleware.BROWSER, elapsed, cost
+
+
+def fetch_tiered(client, url, tier):
+    html, elapsed, cost = client.fetch(url, tier)
+    if tier == RenderingTierMiddleware.HTTP:
+        response = HtmlResponse(url, body=html.encode('utf-8'), encoding='utf-8')
+        if not needs_browser_rendering(response):
+            return tier, elapsed, cost
+        tier = RenderingTierMiddleware.BROWSER
+        _, browser_elapsed, browser_cost = client.fetch(url, tier)
+        elapsed += browser_elapsed
+        cost += browser_cost
+    return tier, elapsed, cost
+
+
+def run(name, strategy, client, urls, tiers, concurrency):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda url: strategy(client, url, tiers[url]), urls))
+    wall = time.perf_counter() - started
+    latencies = sorted(elapsed for _, elapsed, _ in results)
+    cost = sum(cost for _, _, cost in results)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    print(f'{name:<20} {statistics.mean(latencies) * 1000:>9,.0f} ms {p95 * 1000:>9,.0f} ms '
+          f'{cost / len(urls):>10.2f} {cost:>10,.0f} {wall:>8.1f}s')
+    return {url: tier for url, (tier, _, _) in zip(urls, results)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sources', type=int, default=200)
+    parser.add_argument('--js-share', type=float, default=0.15,
+                        help='share of sources that only render with JavaScript')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--http-latency', type=float, default=0.15)
+    parser.add_argument('--browser-latency', type=float, default=1.2)
+    parser.add_argument('--screenshot-latency', type=float, default=0.3)
+    parser.add_argument('--http-cost', type=float, default=1.0, help='cost units per HTTP request')
+    parser.add_argument('--browser-cost', type=float, default=10.0, help='cost units per browser request')
+    parser.add_argument('--screenshot-cost', type=float, default=0.0, help='extra cost units per screenshot')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    js_sources = set(rng.sample(range(args.sources), int(args.sources * args.js_share)))
+    urls = [f'https://www.agency.gov/newsroom-{n}' for n in range(args.sources)]
+    server = MockZyteApi(js_sources, args.http_latency, args.browser_latency,
+                         args.screenshot_latency).serve()
+    client = Client(f'http://127.0.0.1:{server.server_address[1]}/v1/extract', {
+        RenderingTierMiddleware.HTTP: args.http_cost,
+        RenderingTierMiddleware.BROWSER: args.browser_cost,
+        'screenshot': args.screenshot_cost,
+    })
+
+    print(f'{args.sources} sources, {len(js_sources)} JavaScript-only, concurrency {args.concurrency}')
+    print(f'{"strategy":<20} {"mean/page":>12} {"p95/page":>12} {"cost/page":>10} {"total":>10} {"wall":>9}')
+    with tempfile.TemporaryDirectory() as tmp:
+        middleware = RenderingTierMiddleware(os.path.join(tmp, 'rendering.sqlite'), stats=None)
+        run('browser+screenshot', fetch_browser_screenshot, client, urls,
+            dict.fromkeys(urls, RenderingTierMiddleware.BROWSER), args.concurrency)
+        cold_tiers = {url: middleware.get_tier(url) for url in urls}
+        decided = run('tiered (cold)', fetch_tiered, client, urls, cold_tiers, args.concurrency)
+        for url, tier in decided.items():
+            middleware.set_tier(url, tier)
+        warm_tiers = {url: middleware.get_tier(url) for url in urls}
+        run('tiered (warm)', fetch_tiered, client, urls, warm_tiers, args.concurrency)
+        middleware.db.close()
+    server.shutdown()
+
+    escalated = {n for n, url in enumerate(urls) if decided[url] == RenderingTierMiddleware.BROWSER}
+    if escalated != js_sources:
+        raise SystemExit(f'heuristic misclassified {len(escalated ^ js_sources)} sources')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark of the source lookup the spider starts from.
+
+Writes a synthetic catalogue of --sources sources, spread over a few country
+files, and times getting the first --limit sources of one country and topic
+the way start_requests used to (json.load every file, filter in Python) and
+through SourceRegistry, both on a first run (files loaded into SQLite) and
+on later runs (files unchanged). Reports wall time and peak RSS growth,
+each case in a fresh child process.
+
+    python -m benchmarks.bench_sources --sources 50000 --limit 100
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from news_crawler.sources import SourceRegistry
+
+COUNTRIES = ['United States', 'Canada', 'United Kingdom', 'Australia', 'India']
+BRANCHES = ['Executive', 'Legislative', 'Judicial']
+TOPICS = ['Health', 'Defense', 'Economy', 'Environment', 'Education', 'Justice']
+
+CASES = {
+    'json': 'json.load + filter',
+    'registry_first': 'SourceRegistry, first run',
+    'registry': 'SourceRegistry, files unchanged',
+}
+
+
+def write_catalogue(directory, count, rng):
+    per_country = {country: [] for country in COUNTRIES}
+    for n in range(count):
+        country = rng.choice(COUNTRIES)
+        per_country[country].append({
+            'collection_name': f'Agency {n}',
+            'source_url': f'https://www.agency{n}.gov/news',
+            'url': f'https://www.agency{n}.gov',
+            'country': country,
+            'branch': rng.choice(BRANCHES),
+            'topic': rng.choice(TOPICS),
+            'table_name': 'article_objects',
+            'timezone': 'UTC',
+            'notes': 'Press releases, statements and speeches. ' * 3,
+        })
+    for country, sources in per_country.items():
+        with open(os.path.join(directory, f"{country.lower().replace(' ', '_')}.json"), 'w') as f:
+            json.dump(sources, f)
+
+
+def measure(case, directory, limit):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if case == 'json':
+        sources = []
+        for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+            with open(path) as f:
+                sources.extend(json.load(f))
+        selected = [source for source in sources
+                    if source['country'] == 'Canada' and source['topic'] == 'Health'][:limit]
+    else:
+        registry = SourceRegistry(os.path.join(directory, f'{case}.sqlite'))
+        registry.sync(os.path.join(directory, '*.json'))
+        selected = list(registry.select(country='Canada', topic='Health', limit=limit))
+    elapsed = time.perf_counter() - started
+    return elapsed, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) * 1024, len(selected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sources', type=int, default=50000)
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_catalogue(directory, args.sources, random.Random(1))
+        print(f'{args.sources} sources in {len(COUNTRIES)} files, first {args.limit} Canada / Health')
+        # The unchanged-files case reads the store the first run of the same name left behind
+        for case, store in (('json', None), ('registry_first', 'registry'), ('registry', 'registry')):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                elapsed, peak, selected = executor.submit(measure, store or case, directory, args.limit).result()
+            print(f'{CASES[case]:<32} {elapsed * 1000:9.1f} ms  peak RSS +{peak / 1024 / 1024:7.1f} MiB  '
+                  f'{selected} sources')
+
+
+if __name__ == '__main__':
+    main()
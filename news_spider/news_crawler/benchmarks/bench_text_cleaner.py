@@ -0,0 +1,120 @@
+"""
+Fuzz test and benchmark for the text cleaning in NewsCrawlerPipeline.
+
+Checks that clean_html_text gives exactly the output of the original chain,
+clean_text(remove_tags(remove_script_tags(html.unescape(value)))) with the
+regex-based helpers, on random inputs built from HTML fragments, then times
+both on realistic descriptions and on adversarial inputs that make the
+backtracking regular expressions quadratic.
+
+    python -m benchmarks.bench_text_cleaner --fuzz 20000 --sizes 250 500 1000
+"""
+import argparse
+import html
+import random
+import re
+import time
+
+from w3lib.html import remove_tags
+
+from news_crawler.pipelines import clean_html_text
+
+
+def legacy_remove_script_tags(text):
+    text = re.sub(r'<script.*?>.*?</script>', '', text, flags=re.DOTALL)
+    text = re.sub(r'<.*?>', '', text)
+    return html.unescape(text)
+
+
+def legacy_clean_text(text):
+    main_content = text.split('Tags')[0]
+    cleaned = ' '.join(main_content.split())
+    return cleaned.strip()
+
+
+def legacy_clean_html_text(value):
+    return legacy_clean_text(remove_tags(legacy_remove_script_tags(html.unescape(value))))
+
+
+FRAGMENTS = [
+    '<', '>', '/', ' ', '\n', '\t', '&', ';', '#', 'a', 'p', 'Tags', 'tag', 'x', '<<', '>>',
+    '<p>', '</p>', '<br/>', '< p>', '</ p>', '<//', '</>', '<>', '<a href="/x">', '</a>',
+    '<script', '<script>', '<script type="text/javascript">', '</script>', '</scr', '<SCRIPT>',
+    '</SCRIPT>', '&lt;', '&gt;', '&amp;', '&amp;lt;', '&amp;gt;', '&#60;', '&#x3c;', '&#62;',
+    '&lt;script&gt;', '&lt;/script&gt;', '&nbsp;', '&#8230;', '&quot;', ' ', ' ', 'é',
+    'The agency announced ', 'funding for ', 'rural water systems. ',
+]
+
+
+def random_input(rng):
+    return ''.join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 60)))
+
+
+def fuzz(count, seed):
+    rng = random.Random(seed)
+    for _ in range(count):
+        value = random_input(rng)
+        expected = legacy_clean_html_text(value)
+        actual = clean_html_text(value)
+        if actual != expected:
+            raise SystemExit(f'mismatch for {value!r}:\n  legacy  {expected!r}\n  current {actual!r}')
+    print(f'fuzz: {count} random inputs, identical output')
+
+
+def description(rng):
+    words = 'agency announces grant funding rural water safety weather report program'.split()
+    paragraphs = ''.join(
+        '<p>%s &amp; %s&#8230;</p>\n' % (' '.join(rng.choices(words, k=30)), ' '.join(rng.choices(words, k=8)))
+        for _ in range(5)
+    )
+    return ('<div class="summary"><script type="text/javascript">var x = "<b>";</script>\n%s'
+            '<ul class="tags"><li>Tags: water</li></ul></div>' % paragraphs)
+
+
+ADVERSARIAL = {
+    'unclosed <script': lambda n: '<script>' + 'x' * 8 + '<script' * (n // 7),
+    'line of "<"': lambda n: '<' * n,
+    'tag never closed': lambda n: '<a' + ' ' * n,
+    '"</ " repeated': lambda n: '</ ' * (n // 3) + '>',
+    'escaped tags': lambda n: '&lt;' * (n // 4),
+}
+
+
+def timed(function, values, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for value in values:
+            function(value)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fuzz', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--descriptions', type=int, default=2000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[250, 500, 1000])
+    args = parser.parse_args()
+
+    fuzz(args.fuzz, args.seed)
+
+    rng = random.Random(args.seed)
+    values = [description(rng) for _ in range(args.descriptions)]
+    legacy = timed(legacy_clean_html_text, values)
+    current = timed(clean_html_text, values)
+    print(f'\n{args.descriptions} descriptions: legacy {len(values) / legacy:,.0f}/sec, '
+          f'clean_html_text {len(values) / current:,.0f}/sec ({legacy / current:.1f}x)')
+
+    print(f'\n{"adversarial input":<20} {"chars":>8} {"legacy":>12} {"current":>12}')
+    for name, build in ADVERSARIAL.items():
+        for size in args.sizes:
+            value = build(size)
+            if clean_html_text(value) != legacy_clean_html_text(value):
+                raise SystemExit(f'mismatch on adversarial input {name!r} of {size} chars')
+            legacy = timed(legacy_clean_html_text, [value])
+            current = timed(clean_html_text, [value], repeat=10)
+            print(f'{name:<20} {len(value):>8,} {legacy * 1000:>9.2f} ms {current * 1000:>9.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
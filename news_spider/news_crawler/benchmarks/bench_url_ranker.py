@@ -0,0 +1,305 @@
+"""
+Benchmark for the URL ranking heuristics.
+
+Compares the original rank_urls_for_articles implementation against
+UrlRanker on a synthetic corpus of government listing-page links, checks
+that both produce identical scores and reports URLs/sec. Then compares
+picking the --top best links of each --page-size links listing page with
+a full sort of the candidates and with the heapq partial sort parse uses
+(UrlRanker.best).
+
+Run from the Scrapy project directory:
+
+    python -m benchmarks.bench_url_ranker --urls 50000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+from datetime import date
+from urllib.parse import urlparse
+
+from news_crawler.ranking import UrlRanker
+
+
+def legacy_rank_urls_for_articles(urls_list):
+    """
+    Copy of the original per-call implementation, kept as the baseline.
+    """
+    # --- Configuration ---
+    ARTICLE_INDICATORS_WEIGHTS = {
+        # Regex patterns for dates (strong positive signals)
+        r'/\d{4}/\d{2}/\d{2}/': 5,  # /YYYY/MM/DD/
+        r'/\d{4}-\d{2}-\d{2}/': 5,   # /YYYY-MM-DD/
+        r'/\d{4}/\d{2}/': 2,         # /YYYY/MM/ (weaker, usually needs a slug after)
+        
+        # Common content type slugs (string segments)
+        'article': 4,
+        'issues': 4,
+        'blog': 4,
+        'news': 3,
+        'post': 3,
+        'story': 3,
+        'media': 3,
+        'press-release': 3,
+        'media-release': 3,
+        'speech': 3,
+        'report': 3,
+        'paper': 3,
+        'document': 2,
+        'publication': 2,
+        'release': 2,
+        
+        # Government/official content patterns
+        'announcement': 3,
+        'update': 2,
+        'statement': 3,
+        'advisory': 3,
+        'notice': 2,
+        'bulletin': 3,
+        
+        # Event/time-sensitive indicators
+        'month': 2,  # like "safety-awareness-month"
+        'week': 2,   # like "national-xyz-week"
+        'day': 2,    # like "international-xyz-day"
+        'annual': 2,
+        '2024': 2,   # Current/recent year
+        '2025': 2,
+        '2023': 1,   # Slightly older years
+    }
+    
+    NON_ARTICLE_INDICATORS_WEIGHTS = {
+        # Common navigational/category terms
+        'category': -3,
+        'tag': -3,
+        'archive': -2,
+        '/page/': -2,
+        'list': -2,
+        'search': -3,
+        'collection': -2,
+        'series': -2,
+        'topic': -2,
+        
+        # Common administrative/site structure terms
+        'about': -1,
+        'contact': -1,
+        'privacy': -1,
+        'terms': -1,
+        'dashboard': -4,
+        'admin': -5,
+        'login': -5,
+        'signup': -3,
+        'cart': -2,
+        'checkout': -2,
+        'sitemap': -2,
+        'feed': -1,
+        'json': -1,
+        'xml': -1,
+        'amp': -1,
+        'main-content': -3,
+        
+        # Index/home pages
+        'index': -2,
+        'home': -2,
+        'default': -2,
+    }
+    
+    # Additional slug quality patterns
+    SLUG_QUALITY_PATTERNS = {
+        # Long, hyphenated slugs (like "atv-off-highway-vehicle-safety-awareness-month-3")
+        r'[-\w]{20,}': 3,  # Slugs with 20+ characters
+        r'\w+-\w+-\w+-\w+': 2,  # At least 4 words separated by hyphens
+        r'-\d+/?$': 1,  # Ends with a number (version/part indicator)
+        
+        # Specific content patterns
+        r'(safety|awareness|education|training|program|initiative)': 1,
+        r'(guide|tips|advice|how-to|faq)': 2,
+    }
+    
+    # Domain-specific bonuses
+    DOMAIN_BONUSES = {
+        '.gov': 1,  # Government sites often have articles without typical indicators
+        '.edu': 1,  # Educational sites similar pattern
+        '.org': 0.5,  # Non-profits sometimes similar
+    }
+    
+    MIN_PATH_SEGMENTS = 2
+    MIN_ARTICLE_SCORE_THRESHOLD = 5
+    
+    likely_articles_with_scores = []
+    
+    for url in urls_list:
+        current_score = 0
+        parsed_url = urlparse(url)
+        path = parsed_url.path.strip('/')
+        domain = parsed_url.netloc.lower()
+        
+        # Path segment count heuristic
+        path_segments = path.split('/') if path else []
+        path_segments_count = len(path_segments)
+        
+        # Check for domain-specific bonuses
+        for domain_pattern, bonus in DOMAIN_BONUSES.items():
+            if domain.endswith(domain_pattern):
+                current_score += bonus
+                
+        # Apply Positive Indicators
+        for indicator, weight in ARTICLE_INDICATORS_WEIGHTS.items():
+            if indicator.startswith(r'/') and indicator.endswith(r'/'):  # Regex pattern
+                if re.search(indicator, url):
+                    current_score += weight
+            elif indicator in url.lower():  # Case-insensitive string check
+                # Check for whole segment match for better accuracy
+                if f'/{indicator}/' in url or url.endswith(f'/{indicator}') or url.startswith(f'{indicator}/'):
+                    current_score += weight
+                    
+        # Apply slug quality patterns
+        if path_segments:
+            last_segment = path_segments[-1]
+            for pattern, weight in SLUG_QUALITY_PATTERNS.items():
+                if re.search(pattern, last_segment, re.IGNORECASE):
+                    current_score += weight
+                    
+            # Bonus for slugs that look like titles (multiple hyphenated words)
+            hyphen_count = last_segment.count('-')
+            if hyphen_count >= 3:
+                current_score += min(hyphen_count - 2, 3)  # Cap at +3
+                
+        # Apply Negative Indicators
+        for indicator, weight in NON_ARTICLE_INDICATORS_WEIGHTS.items():
+            if indicator.startswith(r'/') and indicator.endswith(r'/'):  # Regex pattern
+                if re.search(indicator, url):
+                    current_score += weight
+            elif indicator in url.lower():  # Case-insensitive string check
+                if (f'/{indicator}/' in url or url.endswith(f'/{indicator}') or url.startswith(f'{indicator}/') or
+                    (indicator == '#' and '#' in url) or
+                    (indicator == '/page/' and re.search(r'/page/\d+', url))):
+                    current_score += weight
+                    
+        # Apply Minimum Path Segment Length Heuristic
+        if path_segments_count < MIN_PATH_SEGMENTS:
+            current_score -= 3
+        elif path_segments_count > MIN_PATH_SEGMENTS + 1:
+            current_score += min(path_segments_count - MIN_PATH_SEGMENTS, 2)
+            
+        # Special case: if URL has no typical article indicators but has a long, descriptive slug
+        if current_score < MIN_ARTICLE_SCORE_THRESHOLD and path_segments:
+            last_segment = path_segments[-1]
+            # Check if it's a long, descriptive slug (like your example)
+            if len(last_segment) > 30 and '-' in last_segment:
+                word_count = len(last_segment.split('-'))
+                if word_count >= 5:
+                    current_score += 3  # Significant boost for long, descriptive slugs
+                    
+        # Final Filtering
+        if current_score >= MIN_ARTICLE_SCORE_THRESHOLD:
+            likely_articles_with_scores.append({'url': url, 'score': current_score})
+            
+    # Sort results by score in descending order
+    likely_articles_with_scores.sort(key=lambda x: x['score'], reverse=True)
+    
+    return likely_articles_with_scores
+
+
+SEGMENTS = [
+    'news', 'newsroom', 'press-releases', 'press-release', 'blog', 'media', 'article',
+    'about', 'contact', 'search', 'category', 'tag', 'topics', 'archive', 'page',
+    'publications', 'report', 'statement', 'speech', 'update', 'index', 'home',
+    'sitemap', 'feed', 'Login', 'admin', 'events', 'resources', 'data', 'amp',
+]
+SLUG_WORDS = [
+    'epa', 'announces', 'new', 'safety', 'awareness', 'month', 'funding', 'for',
+    'rural', 'water', 'infrastructure', 'program', 'guide', 'tips', 'national',
+    'weather', 'service', 'statement', 'on', 'the', 'annual', 'report', '2023',
+    '2024', '2025', 'faq', 'how-to', 'initiative', 'training', 'week', 'day',
+]
+
+
+def load_domains():
+    path = os.path.join(os.path.dirname(__file__), '..', 'news_crawler', 'html', 'united_states.json')
+    with open(path, encoding='utf-8') as data_file:
+        return sorted({urlparse(source['source_url']).netloc for source in json.load(data_file)})
+
+
+def build_corpus(count, seed=1):
+    rng = random.Random(seed)
+    domains = load_domains() + ['www.example.org', 'data.example.edu', 'example.com']
+    urls = []
+    for _ in range(count):
+        parts = [rng.choice(SEGMENTS) for _ in range(rng.randint(0, 3))]
+        roll = rng.random()
+        if roll < 0.2:
+            parts.append('%d/%02d/%02d' % (rng.randint(2019, 2025), rng.randint(1, 12), rng.randint(1, 28)))
+        elif roll < 0.3:
+            parts.append('%d-%02d-%02d' % (rng.randint(2019, 2025), rng.randint(1, 12), rng.randint(1, 28)))
+        elif roll < 0.4:
+            parts.append('page/%d' % rng.randint(1, 40))
+        if rng.random() < 0.7:
+            slug = '-'.join(rng.choice(SLUG_WORDS) for _ in range(rng.randint(1, 9)))
+            if rng.random() < 0.2:
+                slug += '-%d' % rng.randint(1, 9)
+            parts.append(slug)
+        url = 'https://%s/%s' % (rng.choice(domains), '/'.join(parts))
+        if rng.random() < 0.3:
+            url += '/'
+        if rng.random() < 0.05:
+            url += ';jsessionid=%d' % rng.randint(1, 1000)
+        urls.append(url)
+    return urls
+
+
+def timed(func, urls, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(urls)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--urls', type=int, default=20000)
+    parser.add_argument('--unique', type=int, default=5000,
+                        help='distinct URLs in the corpus; listing pages repeat navigation links')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--page-size', type=int, default=500, help='links per listing page, for the top-k case')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    distinct = build_corpus(args.unique)
+    urls = [distinct[i % len(distinct)] for i in range(args.urls)]
+
+    legacy, legacy_time = timed(legacy_rank_urls_for_articles, urls, args.repeat)
+    uncached, uncached_time = timed(UrlRanker(cache_size=0).rank, urls, args.repeat)
+    cached, cached_time = timed(UrlRanker().rank, urls, args.repeat)
+
+    if not (legacy == uncached == cached):
+        raise SystemExit('UrlRanker scores differ from rank_urls_for_articles')
+
+    print(f'{len(urls)} URLs ({len(distinct)} distinct), {len(legacy)} ranked as articles')
+    for label, elapsed in (('rank_urls_for_articles', legacy_time),
+                           ('UrlRanker (no cache)', uncached_time),
+                           ('UrlRanker', cached_time)):
+        print(f'{label:<24} {len(urls) / elapsed:>12,.0f} URLs/sec  ({legacy_time / elapsed:.1f}x)')
+
+    ranker = UrlRanker()
+    pages = [urls[start:start + args.page_size] for start in range(0, len(urls), args.page_size)]
+    candidates = [ranker.candidates(page) for page in pages]
+    key = lambda url: (url['score'], url['date'] or date.min)
+    full_sort = lambda pages: [sorted(page, key=key, reverse=True)[:args.top] for page in pages]
+    partial_sort = lambda pages: [ranker.best(page, args.top) for page in pages]
+    sorted_top, sorted_time = timed(full_sort, candidates, args.repeat)
+    heap_top, heap_time = timed(partial_sort, candidates, args.repeat)
+    if sorted_top != heap_top:
+        raise SystemExit('best() differs from a full sort')
+    print(f'top {args.top} of {len(pages)} pages of {args.page_size} links:')
+    for label, elapsed in (('full sort', sorted_time), ('UrlRanker.best', heap_time)):
+        print(f'{label:<24} {len(urls) / elapsed:>12,.0f} URLs/sec  ({sorted_time / elapsed:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
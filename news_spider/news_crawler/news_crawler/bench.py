@@ -0,0 +1,149 @@
+# Offline crawl benchmark
+#
+# Replays a crawl recorded with RecordReplayMiddleware at full speed, with
+# the crawl's local state in a scratch directory so every run starts from
+# the same place, and reports items/sec, per-stage latency (from the
+# Instrumentation extension) and memory. Saving a report and passing it as
+# --baseline on a later run shows what a change did, with no network.
+#
+#     python -m news_crawler.bench record --archive corpus -- -a limit=50
+#     python -m news_crawler.bench run --archive corpus --output before.json
+#     python -m news_crawler.bench run --archive corpus --baseline before.json
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import data_path, get_project_settings
+
+REPORTED_STATS = ('item_scraped_count', 'response_received_count', 'replay/served', 'replay/missing',
+                  'item_dropped_count', 'memusage/max')
+
+
+def isolated_settings(settings, directory):
+    """
+    Points every relative *_PATH and *_DIR setting (the crawl's state in
+    .scrapy) into `directory`.
+    """
+    overrides = {}
+    for name, value in settings.items():
+        if name.endswith(('_PATH', '_DIR')) and isinstance(value, str) and value and not os.path.isabs(value):
+            overrides[name] = os.path.join(directory, value)
+    return overrides
+
+
+def split_scrapy_args(args):
+    """Spider arguments (-a name=value) and settings (-s NAME=value) from a scrapy command line."""
+    spider_args, settings = {}, {}
+    for flag, pair in zip(args, args[1:]):
+        if flag in ('-a', '-s'):
+            name, _, value = pair.partition('=')
+            (spider_args if flag == '-a' else settings)[name] = value
+    return spider_args, settings
+
+
+def run(archive, spider, scrapy_args):
+    settings = get_project_settings()
+    spider_args, overrides = split_scrapy_args(scrapy_args)
+    with tempfile.TemporaryDirectory(prefix='news-crawler-bench-') as directory:
+        settings.setdict(isolated_settings(settings, directory), priority='cmdline')
+        settings.setdict({
+            'REPLAY_MODE': 'replay',
+            'REPLAY_PATH': os.path.abspath(archive),
+            'INSTRUMENTATION_ENABLED': True,
+            'LOG_LEVEL': 'WARNING',
+            **overrides,
+        }, priority='cmdline')
+        process = CrawlerProcess(settings)
+        crawler = process.create_crawler(spider)
+        process.crawl(crawler, **spider_args)
+        process.start()
+
+        stats = crawler.stats.get_stats()
+        instrumentation = os.path.join(settings.get('INSTRUMENTATION_DIR'), f'{crawler.spider.name}.json')
+        with open(instrumentation, encoding='utf-8') as instrumentation_file:
+            stages = json.load(instrumentation_file)['stages']
+
+    elapsed = (stats['finish_time'] - stats['start_time']).total_seconds()
+    return {
+        'spider': crawler.spider.name,
+        'elapsed_s': round(elapsed, 3),
+        'items_per_s': round(stats.get('item_scraped_count', 0) / elapsed, 2),
+        'responses_per_s': round(stats.get('response_received_count', 0) / elapsed, 2),
+        # ru_maxrss is in KiB on Linux; extraction workers count once they have exited
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'children_peak_rss_mib': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'stats': {name: stats[name] for name in REPORTED_STATS if name in stats},
+        'stages': stages,
+    }
+
+
+def _change(value, baseline):
+    if not baseline:
+        return ''
+    return f' ({(value - baseline) / baseline:+.1%})'
+
+
+def print_report(report, baseline=None):
+    baseline = baseline or {}
+    print(f"{report['spider']}: {report['stats'].get('item_scraped_count', 0)} items, "
+          f"{report['stats'].get('replay/served', 0)} responses replayed "
+          f"({report['stats'].get('replay/missing', 0)} missing) in {report['elapsed_s']}s")
+    for name, label in (('items_per_s', 'items/sec'), ('responses_per_s', 'responses/sec'),
+                        ('peak_rss_mib', 'peak RSS MiB'), ('children_peak_rss_mib', 'workers peak RSS MiB')):
+        print(f"{label:<22} {report[name]:>10}{_change(report[name], baseline.get(name))}")
+
+    print(f"\n{'stage':<48} {'count':>7} {'mean ms':>9} {'p95 ms':>9} {'cpu ms':>9}")
+    baseline_stages = baseline.get('stages', {})
+    for name, stage in report['stages'].items():
+        wall = stage.get('wall_ms')
+        if wall is None:
+            continue
+        before = baseline_stages.get(name, {}).get('wall_ms', {})
+        print(f"{name:<48} {stage['count']:>7} {wall['mean']:>9} {wall['p95']:>9} "
+              f"{stage.get('cpu_ms', {}).get('total', 0):>9}{_change(wall['mean'], before.get('mean'))}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m news_crawler.bench',
+                                     description='Record a crawl, or replay one offline and report its speed.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('record', 'crawl live sites and record every response'),
+                            ('run', 'replay a recorded crawl and report items/sec, stage latency and memory')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--archive', default=data_path('replay'),
+                             help='archive directory (default .scrapy/replay)')
+        command.add_argument('--spider', default='gov_news')
+        command.add_argument('scrapy_args', nargs=argparse.REMAINDER,
+                             help='scrapy crawl arguments (-a name=value, -s NAME=value), after --')
+        if name == 'run':
+            command.add_argument('--output', help='write the report to this JSON file')
+            command.add_argument('--baseline', help='report of an earlier run to compare with')
+    args = parser.parse_args(argv)
+    scrapy_args = [arg for arg in args.scrapy_args if arg != '--']
+
+    if args.command == 'record':
+        status = subprocess.call([
+            sys.executable, '-m', 'scrapy', 'crawl', args.spider, '-s', 'REPLAY_MODE=record',
+            '-s', f'REPLAY_PATH={os.path.abspath(args.archive)}', *scrapy_args,
+        ])
+        raise SystemExit(status)
+
+    report = run(args.archive, args.spider, scrapy_args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
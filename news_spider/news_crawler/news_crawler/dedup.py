@@ -0,0 +1,174 @@
+# Near-duplicate articles
+#
+# The same press release often lives at several URLs, or is syndicated by
+# several agencies, and every copy went through extraction, the database
+# and a notification. NearDuplicateIndex keeps a MinHash signature of every
+# stored article's text: 64 small integers whose share of equal positions
+# between two articles estimates how many word 3-grams they have in common
+# (their Jaccard similarity). Signatures are cut into bands that are
+# indexed exactly, so a lookup only reads the articles that agree with the
+# new one on a whole band, however many are stored.
+
+import hashlib
+import os
+import re
+import sqlite3
+import struct
+import zlib
+
+_WORD = re.compile(r'\w+')
+_MASK64 = (1 << 64) - 1
+_MULTIPLIER = 0x9E3779B97F4A7C15
+_EMPTY = 1 << 64
+
+SIGNATURE_SIZE = 64
+BANDS = 16
+ROWS = SIGNATURE_SIZE // BANDS
+_SIGNATURE = struct.Struct(f'<{SIGNATURE_SIZE}I')
+
+
+def _word_hash(word):
+    # Only has to tell words apart: the shingle hashes are mixed afterwards
+    return zlib.crc32(word.encode('utf-8'))
+
+
+def minhash_signature(text):
+    """
+    One-permutation MinHash of the word 3-grams of `text`, ignoring case and
+    punctuation: each 3-gram hash lands in one of SIGNATURE_SIZE buckets and
+    each bucket keeps its smallest value, so the whole signature costs one
+    pass over the text. Buckets no 3-gram fell into borrow from the next
+    filled one, so short texts still get a full signature. Returns a tuple
+    of 32-bit integers, or None for a text without words.
+    """
+    cache = {}
+    hashes = []
+    for word in _WORD.findall(text.lower()):
+        value = cache.get(word)
+        if value is None:
+            value = cache[word] = _word_hash(word)
+        hashes.append(value)
+    if not hashes:
+        return None
+    hashes += [0] * (3 - len(hashes))
+
+    mins = [_EMPTY] * SIGNATURE_SIZE
+    bucket_mask = SIGNATURE_SIZE - 1
+    for a, b, c in zip(hashes, hashes[1:], hashes[2:]):
+        # Combine the word hashes, then a multiply-xorshift round to spread the bits
+        x = ((a * _MULTIPLIER + b) * _MULTIPLIER + c) & _MASK64
+        x ^= x >> 32
+        x = (x * 0xD6E8FEB86659FD93) & _MASK64
+        x ^= x >> 32
+        bucket = x & bucket_mask
+        if x < mins[bucket]:
+            mins[bucket] = x
+
+    signature = [value >> 32 for value in mins]
+    for bucket in range(SIGNATURE_SIZE):
+        if mins[bucket] == _EMPTY:
+            distance = 1
+            while mins[(bucket + distance) & bucket_mask] == _EMPTY:
+                distance += 1
+            borrowed = signature[(bucket + distance) & bucket_mask]
+            signature[bucket] = (borrowed + distance * 0x9E3779B9) & 0xFFFFFFFF
+    return tuple(signature)
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / SIGNATURE_SIZE
+
+
+def band_keys(signature):
+    keys = []
+    for band in range(BANDS):
+        values = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(struct.pack(f'<B{ROWS}I', band, *values), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'little', signed=True))
+    return keys
+
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures of stored articles, in SQLite, with banded lookup.
+
+    An article sharing a fraction J of its 3-grams with a stored one agrees
+    with it on a whole band of ROWS positions with probability J ** ROWS,
+    so it is found through at least one of the BANDS bands with probability
+    1 - (1 - J ** ROWS) ** BANDS: 99% at J = 0.7 and about 1% at J = 0.3.
+    Candidates are then compared on the full signature against `threshold`.
+    An article keeps one row per URL: fetched again, it is never its own
+    near-duplicate, and adding it replaces its earlier row.
+    """
+
+    def __init__(self, path, threshold=0.8, timeout=5.0):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.threshold = threshold
+        self.db = sqlite3.connect(path, isolation_level=None, timeout=timeout)
+        # One small transaction per article: the WAL avoids an fsync each time
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS docs (id INTEGER PRIMARY KEY, signature BLOB NOT NULL, url TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS docs_url ON docs (url)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS bands (key INTEGER, doc_id INTEGER, PRIMARY KEY (key, doc_id)) WITHOUT ROWID"
+        )
+        self.lookup = (
+            "SELECT DISTINCT docs.id, docs.signature, docs.url FROM bands "
+            "JOIN docs ON docs.id = bands.doc_id WHERE bands.key IN (%s)" % ', '.join('?' * BANDS)
+        )
+
+    def find(self, signature, url=None):
+        """
+        Returns `(doc_id, url, similarity)` of the most similar stored article
+        above the threshold, or None. The row of `url` itself is left out.
+        """
+        best = None
+        for doc_id, stored, stored_url in self.db.execute(self.lookup, band_keys(signature)):
+            if url is not None and stored_url == url:
+                continue
+            score = similarity(signature, _SIGNATURE.unpack(stored))
+            if score >= self.threshold and (best is None or score > best[2]):
+                best = (doc_id, stored_url, score)
+        return best
+
+    def add(self, signature, url=None):
+        self.db.execute("BEGIN")
+        try:
+            if url is not None:
+                for old_id, old_signature in self.db.execute(
+                        "SELECT id, signature FROM docs WHERE url = ?", (url,)).fetchall():
+                    self._delete(old_id, old_signature)
+            doc_id = self.db.execute("INSERT INTO docs (signature, url) VALUES (?, ?)",
+                                     (_SIGNATURE.pack(*signature), url)).lastrowid
+            self.db.executemany("INSERT OR IGNORE INTO bands (key, doc_id) VALUES (?, ?)",
+                                [(key, doc_id) for key in band_keys(signature)])
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return doc_id
+
+    def remove(self, doc_id):
+        row = self.db.execute("SELECT signature FROM docs WHERE id = ?", (doc_id,)).fetchone()
+        if row is None:
+            return
+        self.db.execute("BEGIN")
+        try:
+            self._delete(doc_id, row[0])
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def _delete(self, doc_id, signature):
+        self.db.executemany("DELETE FROM bands WHERE key = ? AND doc_id = ?",
+                            [(key, doc_id) for key in band_keys(_SIGNATURE.unpack(signature))])
+        self.db.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,237 @@
+# Per-domain adaptive concurrency
+#
+# Scrapy gives every downloader slot (one per host) the same
+# CONCURRENT_REQUESTS_PER_DOMAIN, and AutoThrottle only tunes the delay
+# between requests. DomainThrottle also changes how many requests each host
+# gets at once: one more while responses stay fast, half as many when the
+# host answers 429 or 5xx, the way TCP congestion control does.
+
+import json
+import logging
+import os
+import time
+from email.utils import parsedate_to_datetime
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUSES = {429, 503}
+
+
+def retry_after_seconds(value):
+    """Parses a Retry-After header (seconds or an HTTP date), or returns None."""
+    if not value:
+        return None
+    value = value.decode('latin-1') if isinstance(value, bytes) else value
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def load_domain_limits(path):
+    """
+    Reads the sidecar limits file, a JSON object keyed by host:
+
+        {"www.bea.gov": {"max_concurrency": 2, "download_delay": 1.0}}
+
+    A missing file means no limits.
+    """
+    try:
+        with open(path, encoding='utf-8') as limits_file:
+            return json.load(limits_file)
+    except FileNotFoundError:
+        return {}
+
+
+class DomainState:
+    """What DomainThrottle knows about one downloader slot."""
+
+    def __init__(self, concurrency, max_concurrency, min_delay=0.0):
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.peak_concurrency = concurrency
+        self.min_delay = min_delay
+        self.latency = None
+        self.successes = 0
+        self.last_backoff = 0.0
+        self.responses = 0
+        self.throttled = 0
+        self.errors = 0
+        self.bytes = 0
+        self.first_response = None
+        self.last_response = None
+
+
+class DomainThrottle:
+    """
+    Extension that adapts each downloader slot's concurrency (AIMD).
+
+    A domain starts at DOMAIN_THROTTLE_START_CONCURRENCY. After as many
+    consecutive responses as its current concurrency, all faster than
+    DOMAIN_THROTTLE_TARGET_LATENCY on average, it may take one more request
+    at once, up to its maximum. A 429 or 5xx halves it and pushes the slot
+    delay back, honouring Retry-After; responses slower than twice the target
+    take one away. Run it next to AutoThrottle, which keeps tuning the delay.
+
+    Per-domain maximum concurrency and minimum delay come from, in order:
+    the `max_concurrency` / `download_delay` keys of the source JSON entry
+    (`request.meta['items']`), the DOMAIN_LIMITS_FILE sidecar, and
+    DOMAIN_THROTTLE_MAX_CONCURRENCY.
+
+    Settings:
+        DOMAIN_THROTTLE_ENABLED            default True
+        DOMAIN_THROTTLE_START_CONCURRENCY  requests at once for a new domain
+        DOMAIN_THROTTLE_MAX_CONCURRENCY    default ceiling per domain
+        DOMAIN_THROTTLE_TARGET_LATENCY     seconds, average latency to stay under
+        DOMAIN_LIMITS_FILE                 sidecar JSON, relative to the news_crawler package
+
+    Stats (per domain, under domain_throttle/<domain>/):
+        responses, throttled, errors, bytes, concurrency, concurrency_max,
+        latency_ms_ewma, responses_per_min
+    """
+
+    def __init__(self, crawler, limits=None, start_concurrency=2, max_concurrency=8,
+                 target_latency=2.0, max_delay=60.0):
+        self.crawler = crawler
+        self.limits = limits or {}
+        self.start_concurrency = start_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.max_delay = max_delay
+        self.domains = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DOMAIN_THROTTLE_ENABLED', True):
+            raise NotConfigured
+        limits_path = settings.get('DOMAIN_LIMITS_FILE', 'html/domain_limits.json')
+        if not os.path.isabs(limits_path):
+            limits_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), limits_path)
+        extension = cls(
+            crawler,
+            limits=load_domain_limits(limits_path),
+            start_concurrency=settings.getint('DOMAIN_THROTTLE_START_CONCURRENCY', 2),
+            max_concurrency=settings.getint('DOMAIN_THROTTLE_MAX_CONCURRENCY', 8),
+            target_latency=settings.getfloat('DOMAIN_THROTTLE_TARGET_LATENCY', 2.0),
+            max_delay=settings.getfloat('AUTOTHROTTLE_MAX_DELAY', 60.0),
+        )
+        crawler.signals.connect(extension.request_reached_downloader,
+                                signal=signals.request_reached_downloader)
+        crawler.signals.connect(extension.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def _get_slot(self, request):
+        key = request.meta.get('download_slot')
+        if key is None:
+            return None, None
+        return key, self.crawler.engine.downloader.slots.get(key)
+
+    def _new_state(self, key, request):
+        limits = dict(self.limits.get(key, {}))
+        source = request.meta.get('items') or {}
+        for name in ('max_concurrency', 'download_delay'):
+            if source.get(name) is not None:
+                limits[name] = source[name]
+        max_concurrency = max(1, int(limits.get('max_concurrency', self.max_concurrency)))
+        return DomainState(
+            concurrency=min(self.start_concurrency, max_concurrency),
+            max_concurrency=max_concurrency,
+            min_delay=float(limits.get('download_delay', 0.0)),
+        )
+
+    def request_reached_downloader(self, request, spider):
+        key, slot = self._get_slot(request)
+        if slot is None:
+            return
+        state = self.domains.get(key)
+        if state is None:
+            state = self.domains[key] = self._new_state(key, request)
+        # Idle slots are garbage collected and come back with the defaults
+        slot.concurrency = state.concurrency
+        if slot.delay < state.min_delay:
+            slot.delay = state.min_delay
+
+    def response_downloaded(self, response, request, spider):
+        key, slot = self._get_slot(request)
+        state = self.domains.get(key)
+        if slot is None or state is None:
+            return
+        now = time.monotonic()
+        stats = self.crawler.stats
+        state.responses += 1
+        state.bytes += len(response.body)
+        if state.first_response is None:
+            state.first_response = now
+        state.last_response = now
+        stats.inc_value(f'domain_throttle/{key}/responses')
+
+        status = response.status
+        if status in THROTTLE_STATUSES or status >= 500:
+            if status in THROTTLE_STATUSES:
+                state.throttled += 1
+                stats.inc_value(f'domain_throttle/{key}/throttled')
+            else:
+                state.errors += 1
+                stats.inc_value(f'domain_throttle/{key}/errors')
+            self._back_off(key, slot, state, response, now)
+        elif status < 400:
+            latency = request.meta.get('download_latency')
+            if latency is not None:
+                state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+            if state.latency is not None and state.latency > 2 * self.target_latency:
+                self._set_concurrency(key, slot, state, state.concurrency - 1)
+            elif state.latency is None or state.latency <= self.target_latency:
+                state.successes += 1
+                if state.successes >= state.concurrency:
+                    self._set_concurrency(key, slot, state, state.concurrency + 1)
+
+        if slot.delay < state.min_delay:
+            slot.delay = state.min_delay
+
+    def _back_off(self, key, slot, state, response, now):
+        # Responses to requests already in flight tell us nothing new
+        if now - state.last_backoff < max(state.latency or 0.0, 1.0):
+            return
+        state.last_backoff = now
+        self.crawler.stats.inc_value('domain_throttle/backoffs')
+        self._set_concurrency(key, slot, state, state.concurrency // 2)
+        retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = max(slot.delay * 2, 1.0)
+        slot.delay = min(max(slot.delay, delay), self.max_delay)
+        logger.info(f"{key} answered {response.status}, concurrency {state.concurrency}, "
+                    f"delay {slot.delay:.1f}s")
+
+    def _set_concurrency(self, key, slot, state, concurrency):
+        state.successes = 0
+        concurrency = min(max(1, concurrency), state.max_concurrency)
+        if concurrency == state.concurrency:
+            return
+        state.concurrency = slot.concurrency = concurrency
+        state.peak_concurrency = max(state.peak_concurrency, concurrency)
+
+    def spider_closed(self, spider):
+        stats = self.crawler.stats
+        for key, state in self.domains.items():
+            prefix = f'domain_throttle/{key}'
+            stats.set_value(f'{prefix}/bytes', state.bytes)
+            stats.set_value(f'{prefix}/concurrency', state.concurrency)
+            stats.set_value(f'{prefix}/concurrency_max', state.peak_concurrency)
+            if state.latency is not None:
+                stats.set_value(f'{prefix}/latency_ms_ewma', round(state.latency * 1000))
+            if state.responses > 1:
+                elapsed = state.last_response - state.first_response
+                if elapsed > 0:
+                    stats.set_value(f'{prefix}/responses_per_min',
+                                    round((state.responses - 1) / elapsed * 60, 1))
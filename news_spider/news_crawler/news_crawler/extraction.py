@@ -0,0 +1,241 @@
+# Article extraction off the reactor thread
+#
+# trafilatura is CPU bound; running it inside a callback blocks every
+# download and callback until it finishes. ExtractionExecutor hands the work
+# to a process (or thread) pool and lets the spider await the result through
+# the asyncio reactor set in settings.py. trafilatura itself is only
+# imported by the workers, on their first document: the spider module, and
+# so `scrapy list` and `scrapy check`, don't pay for it.
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from scrapy import signals
+from w3lib.encoding import html_to_unicode
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_STAGES = ('parse', 'metadata', 'markdown')
+
+
+def response_html(response):
+    """
+    The body of `response` as text, decoded as response.text would be but
+    without caching the decoded copy on the response, which Scrapy keeps
+    until the response's items have left the pipelines.
+    """
+    content_type = response.headers.get(b'Content-Type', b'').decode('latin-1')
+    return html_to_unicode(content_type, response.body)[1]
+
+
+@lru_cache(maxsize=None)
+def extraction_options():
+    from trafilatura.settings import Extractor
+
+    # Formatting is kept in the tree for the markdown; the JSON text drops it
+    return Extractor(output_format="json", with_metadata=True, formatting=True)
+
+
+def extract_article(html):
+    """
+    Runs trafilatura on a page once and returns its JSON output as a dict,
+    with the article body as markdown under 'md' and the milliseconds spent
+    in each of EXTRACTION_STAGES under 'timings'. Returns None when nothing
+    could be extracted. Executed inside the pool workers.
+    """
+    from trafilatura import bare_extraction
+    from trafilatura.utils import normalize_unicode
+    from trafilatura.xml import build_json_output, xmltotxt
+
+    options = extraction_options()
+    started = time.perf_counter()
+    document = bare_extraction(html, options=options)
+    parsed = time.perf_counter()
+    if document is None:
+        return None
+    # trafilatura.extract would also compute a content fingerprint here,
+    # nothing downstream reads it
+    data = json.loads(normalize_unicode(build_json_output(document, with_metadata=True)))
+    serialized = time.perf_counter()
+    data['md'] = normalize_unicode(xmltotxt(document.body, include_formatting=True))
+    finished = time.perf_counter()
+    data['timings'] = {
+        'parse': (parsed - started) * 1000,
+        'metadata': (serialized - parsed) * 1000,
+        'markdown': (finished - serialized) * 1000,
+    }
+    return data
+
+
+class ExtractionTimeout(Exception):
+    """Raised in a pool process by a document that ran past EXTRACTION_TIMEOUT."""
+
+
+def _raise_timeout(signum, frame):
+    raise ExtractionTimeout()
+
+
+def extract_article_within(html, timeout):
+    """
+    `extract_article`, interrupted with ExtractionTimeout after `timeout`
+    seconds so the process is free for the next document. Only for pool
+    processes: signal handlers run in a process's main thread.
+    """
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return extract_article(html)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class ExtractionExecutor:
+    """
+    Runs `extract_article` in a process or thread pool.
+
+    In a process pool a document is interrupted once it has run for
+    EXTRACTION_TIMEOUT seconds, which frees its worker. A worker can miss
+    that (a long regex or lxml call only returns to Python at its end),
+    and a thread can't be interrupted at all. So the wait for a document
+    also gives up after the time the documents queued ahead of it could
+    take, plus twice the timeout. The pool is then replaced by a new one,
+    which the documents still queued or running in the old one move to. The
+    old pool's processes are killed; the threads of an old thread pool
+    can't be, and finish on their own.
+
+    Settings:
+        EXTRACTION_EXECUTOR   "process" (default) or "thread"
+        EXTRACTION_POOL_SIZE  number of workers, defaults to the CPU count
+        EXTRACTION_TIMEOUT    seconds a single document may run
+
+    Stats:
+        extraction/queue_depth_max  most documents waiting or running at once
+        extraction/count            documents extracted, empty ones included
+        extraction/latency_ms_total, extraction/latency_ms_max
+        extraction/empty            documents trafilatura returned nothing for
+        extraction/timeout          documents abandoned after the timeout
+        extraction/pool_replaced    pools replaced because a worker was stuck
+        extraction/<stage>_ms_total time spent in each of EXTRACTION_STAGES
+        extraction/wait_ms_total    time spent queued or passing data to and from the pool
+    """
+
+    def __init__(self, crawler, kind='process', pool_size=None, timeout=30):
+        if kind not in ('process', 'thread'):
+            raise ValueError(f"EXTRACTION_EXECUTOR must be 'process' or 'thread', got {kind!r}")
+        self.crawler = crawler
+        self.kind = kind
+        self.pool_size = pool_size or os.cpu_count() or 1
+        self.timeout = timeout
+        self.pending = 0
+        self.pool = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        executor = cls(
+            crawler,
+            kind=settings.get('EXTRACTION_EXECUTOR', 'process'),
+            pool_size=settings.getint('EXTRACTION_POOL_SIZE') or None,
+            timeout=settings.getfloat('EXTRACTION_TIMEOUT', 30),
+        )
+        crawler.signals.connect(executor.spider_closed, signal=signals.spider_closed)
+        return executor
+
+    def _get_pool(self):
+        if self.pool is None:
+            if self.kind == 'process':
+                # spawn, so workers don't inherit the running reactor
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.pool_size,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            else:
+                self.pool = ThreadPoolExecutor(max_workers=self.pool_size,
+                                               thread_name_prefix='extraction')
+        return self.pool
+
+    async def extract(self, html):
+        """
+        Extracts `html` in the pool. Returns the trafilatura JSON dict, or
+        None when extraction produced nothing or timed out.
+        """
+        loop = asyncio.get_running_loop()
+        stats = self.crawler.stats
+        self.pending += 1
+        stats.max_value('extraction/queue_depth_max', self.pending)
+        started = time.perf_counter()
+        try:
+            while True:
+                pool = self._get_pool()
+                # Rounds of documents queued ahead, then this one, plus one round to spare
+                wait_limit = self.timeout * ((self.pending - 1) // self.pool_size + 2)
+                if self.kind == 'process':
+                    future = pool.submit(extract_article_within, html, self.timeout)
+                else:
+                    future = pool.submit(extract_article, html)
+                try:
+                    data = await asyncio.wait_for(asyncio.wrap_future(future, loop=loop), wait_limit)
+                    break
+                except asyncio.CancelledError:
+                    if future.cancelled() and pool is not self.pool:
+                        # Still queued when its pool was replaced: run it in the new one
+                        continue
+                    raise
+                except BrokenProcessPool:
+                    if pool is not self.pool:
+                        # Running in a pool whose processes were killed for another document
+                        continue
+                    raise
+        except ExtractionTimeout:
+            stats.inc_value('extraction/timeout')
+            logger.warning(f"Extraction timed out after {self.timeout}s")
+            return None
+        except asyncio.TimeoutError:
+            stats.inc_value('extraction/timeout')
+            logger.warning(f"Extraction still running after {wait_limit}s, replacing the extraction pool")
+            self._replace_pool(pool)
+            return None
+        finally:
+            self.pending -= 1
+            latency_ms = (time.perf_counter() - started) * 1000
+            stats.inc_value('extraction/latency_ms_total', latency_ms)
+            stats.max_value('extraction/latency_ms_max', latency_ms)
+
+        stats.inc_value('extraction/count')
+        if data is None:
+            stats.inc_value('extraction/empty')
+            return data
+        timings = data.pop('timings')
+        for stage in EXTRACTION_STAGES:
+            stats.inc_value(f'extraction/{stage}_ms_total', timings[stage])
+        stats.inc_value('extraction/wait_ms_total', max(0.0, latency_ms - sum(timings.values())))
+        return data
+
+    def _replace_pool(self, pool):
+        if self.pool is not pool:
+            # Already replaced for another document stuck in it
+            return
+        self.crawler.stats.inc_value('extraction/pool_replaced')
+        self.pool = None
+        # Taken before shutdown, which forgets them
+        processes = list((getattr(pool, '_processes', None) or {}).values())
+        # Cancels the documents queued in it, their extract() submits them again
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            # A worker stuck in C code never sees the timeout, and would
+            # otherwise live on until the crawl ends
+            process.terminate()
+
+    def spider_closed(self, spider):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
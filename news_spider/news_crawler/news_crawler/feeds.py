@@ -0,0 +1,262 @@
+# Sitemap and RSS/Atom discovery
+#
+# Many .gov sites publish a sitemap with <lastmod> dates or a news feed.
+# Reading one is cheaper and more precise than ranking every link on a
+# listing page: entries are articles by construction and their dates say
+# which ones changed since the last crawl. FeedDiscoveryStore remembers,
+# per source, which feeds exist and the newest entry date already handled.
+
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from io import BytesIO
+
+from lxml import etree
+from scrapy import signals
+from scrapy.utils.project import data_path
+
+from news_crawler.sharding import connect_store, store_timeout
+
+FEED_TYPES = ('application/rss+xml', 'application/atom+xml', 'application/rdf+xml')
+
+_ENTRY_TAGS = ('{*}url', '{*}sitemap', '{*}item', '{*}entry')
+_ENTRY_KINDS = {'sitemap': 'sitemap', 'url': 'page'}
+_DATE_TAGS = ('lastmod', 'publication_date', 'pubDate', 'date', 'updated', 'published')
+
+
+def _local_name(element):
+    tag = element.tag
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else None
+
+
+def parse_feed_date(value):
+    """Parses a W3C (sitemap, Atom) or RFC 822 (RSS) date; naive ones are taken as UTC."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def iter_feed_entries(body):
+    """
+    Yields `(kind, url, date)` for each entry of a sitemap, sitemap index,
+    RSS or Atom document. `kind` is 'sitemap' for the children of a sitemap
+    index, 'page' for the URLs of a sitemap and 'item' for feed entries;
+    `date` may be None.
+
+    Gzipped sitemaps are decompressed as they are read and entries are
+    cleared as soon as they are yielded, so memory stays bounded however
+    long the document.
+    """
+    source = BytesIO(body)
+    if body[:2] == b'\x1f\x8b':
+        source = gzip.GzipFile(fileobj=source)
+    context = etree.iterparse(
+        source, events=('end',), tag=_ENTRY_TAGS,
+        resolve_entities=False, no_network=True, recover=True,
+    )
+    try:
+        for _, element in context:
+            kind = _ENTRY_KINDS.get(_local_name(element), 'item')
+            url = None
+            dates = {}
+            for child in element.iter():
+                name = _local_name(child)
+                if name in ('loc', 'link') and url is None:
+                    # Atom links carry the URL in href, RSS and sitemaps in the text
+                    if child.get('href') is not None:
+                        if child.get('rel', 'alternate') == 'alternate':
+                            url = child.get('href')
+                    elif child.text:
+                        url = child.text
+                elif name == 'guid' and child.get('isPermaLink', 'true') != 'false':
+                    dates.setdefault('guid', child.text)
+                elif name in _DATE_TAGS and child.text:
+                    dates.setdefault(name, child.text)
+            url = url or dates.pop('guid', None)
+            if url and url.strip().startswith(('http://', 'https://')):
+                date = next((parse_feed_date(dates[name]) for name in _DATE_TAGS if name in dates), None)
+                yield kind, url.strip(), date
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    except (etree.XMLSyntaxError, OSError, EOFError):
+        # Truncated or corrupt gzip, keep what was read
+        return
+
+
+def find_feed_links(response):
+    """Feed URLs a page advertises with <link rel="alternate" type="application/rss+xml">."""
+    links = []
+    for link in response.xpath('//head/link[@href]'):
+        rel = (link.attrib.get('rel') or '').lower().split()
+        if 'alternate' in rel and (link.attrib.get('type') or '').lower() in FEED_TYPES:
+            links.append(response.urljoin(link.attrib['href']))
+    return links
+
+
+class FeedDiscoveryStore:
+    """
+    Per-source discovery results and lastmod watermarks, in SQLite.
+
+    `feed_urls(source)` returns the feeds to read for a source, an empty
+    list when it was checked and has none (so its listing page is ranked
+    instead), or None when it has not been checked, or was checked with no
+    result more than FEED_DISCOVERY_RECHECK_DAYS ago. A `feed_url` key
+    (string or list) in the source JSON skips discovery. The watermark only
+    advances once every new entry was fetched; until then the source has a
+    backlog and its feeds are downloaded even when unchanged. A source's
+    first crawl sets it from the newest entry either way, so the older
+    entries of a large sitemap aren't worked through crawl after crawl.
+    The lastmod of every entry fetched is kept too, so an article whose
+    lastmod moved forward is fetched again although it was stored before.
+
+    Settings:
+        FEED_DISCOVERY_ENABLED       read sitemaps and feeds before listing pages (default True)
+        FEED_DISCOVERY_PATH          store location, relative paths live in .scrapy
+        FEED_DISCOVERY_RECHECK_DAYS  age after which sources without a feed are checked again
+        FEED_MAX_ARTICLES            articles fetched per source and crawl from its feeds
+        FEED_MAX_SITEMAPS            child sitemaps followed per sitemap index
+        FEED_MAX_AGE_DAYS            entries (and child sitemaps) with an older lastmod are skipped,
+                                     0 for no limit
+
+    Stats:
+        feeds/discovered, feeds/entries, feeds/new_entries, feeds/skipped_stale,
+        feeds/changed, feeds/fetched, feeds/fallback
+    """
+
+    def __init__(self, path, recheck_days=30, max_age_days=30, stats=None, timeout=5.0):
+        self.stats = stats
+        self.recheck_after = recheck_days * 86400
+        self.max_age_days = max_age_days
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = connect_store(path, timeout)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS feeds ("
+            "collection_name TEXT PRIMARY KEY, feed_urls TEXT, checked_at REAL, watermark TEXT, "
+            "backlog INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS feed_entries ("
+            "collection_name TEXT, url TEXT, lastmod REAL, "
+            "PRIMARY KEY (collection_name, url)) WITHOUT ROWID"
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('FEED_DISCOVERY_ENABLED', True):
+            return None
+        store = cls(
+            data_path(settings.get('FEED_DISCOVERY_PATH', 'feeds.sqlite')),
+            recheck_days=settings.getfloat('FEED_DISCOVERY_RECHECK_DAYS', 30),
+            max_age_days=settings.getint('FEED_MAX_AGE_DAYS', 30),
+            timeout=store_timeout(settings),
+        )
+        store.crawler = crawler
+        crawler.signals.connect(store.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(store.spider_closed, signal=signals.spider_closed)
+        return store
+
+    def spider_opened(self, spider):
+        self.stats = self.crawler.stats
+
+    def inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(f'feeds/{key}', count)
+
+    def feed_urls(self, source):
+        configured = source.get('feed_url')
+        if configured:
+            return [configured] if isinstance(configured, str) else list(configured)
+        row = self.db.execute(
+            "SELECT feed_urls, checked_at FROM feeds WHERE collection_name = ?",
+            (source['collection_name'],),
+        ).fetchone()
+        if row is None or row[1] is None:
+            return None
+        feed_urls = json.loads(row[0])
+        if not feed_urls and time.time() - row[1] > self.recheck_after:
+            return None
+        return feed_urls
+
+    def set_feed_urls(self, collection_name, feed_urls):
+        self.db.execute(
+            "INSERT INTO feeds (collection_name, feed_urls, checked_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (collection_name) DO UPDATE SET feed_urls = excluded.feed_urls, "
+            "checked_at = excluded.checked_at",
+            (collection_name, json.dumps(feed_urls), time.time()),
+        )
+        if feed_urls:
+            self.inc_stat('discovered')
+
+    def watermark(self, collection_name):
+        row = self.db.execute(
+            "SELECT watermark FROM feeds WHERE collection_name = ?", (collection_name,)
+        ).fetchone()
+        return parse_feed_date(row[0]) if row and row[0] else None
+
+    def set_watermark(self, collection_name, watermark):
+        current = self.watermark(collection_name)
+        if current is not None and current >= watermark:
+            return
+        self.db.execute(
+            "INSERT INTO feeds (collection_name, feed_urls, watermark) VALUES (?, '[]', ?) "
+            "ON CONFLICT (collection_name) DO UPDATE SET watermark = excluded.watermark",
+            (collection_name, watermark.isoformat()),
+        )
+
+    def not_before(self):
+        """Entries with an older lastmod are not fetched, None without FEED_MAX_AGE_DAYS."""
+        if not self.max_age_days:
+            return None
+        return datetime.now(timezone.utc) - timedelta(days=self.max_age_days)
+
+    def record_fetched(self, collection_name, url, lastmod):
+        """Remembers the lastmod of an entry about to be fetched."""
+        self.db.execute(
+            "INSERT OR REPLACE INTO feed_entries (collection_name, url, lastmod) VALUES (?, ?, ?)",
+            (collection_name, url, lastmod.timestamp() if lastmod is not None else None),
+        )
+
+    def changed(self, collection_name, url, lastmod):
+        """True when `url` was fetched from a feed before, with an older lastmod than `lastmod`."""
+        if lastmod is None:
+            return False
+        row = self.db.execute(
+            "SELECT lastmod FROM feed_entries WHERE collection_name = ? AND url = ?", (collection_name, url)
+        ).fetchone()
+        return row is not None and row[0] is not None and lastmod.timestamp() > row[0]
+
+    def has_backlog(self, collection_name):
+        """True when the last crawl left new entries behind, so feeds are read even if unchanged."""
+        row = self.db.execute(
+            "SELECT backlog FROM feeds WHERE collection_name = ?", (collection_name,)
+        ).fetchone()
+        return bool(row and row[0])
+
+    def set_backlog(self, collection_name, backlog):
+        self.db.execute(
+            "INSERT INTO feeds (collection_name, feed_urls, backlog) VALUES (?, '[]', ?) "
+            "ON CONFLICT (collection_name) DO UPDATE SET backlog = excluded.backlog",
+            (collection_name, int(backlog)),
+        )
+
+    def spider_closed(self, spider):
+        not_before = self.not_before()
+        if not_before is not None:
+            # Entries this old are skipped before their lastmod is looked at
+            self.db.execute("DELETE FROM feed_entries WHERE lastmod < ?", (not_before.timestamp(),))
+        self.db.close()
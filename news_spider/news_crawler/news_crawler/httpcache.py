@@ -0,0 +1,322 @@
+# HTTP cache storage
+#
+# With Scrapy's HTTP cache off, every development run downloads every page
+# again through Zyte. FilesystemCacheStorage, the default backend, keeps six
+# uncompressed files in a directory of their own per response, so a lookup
+# costs several opens and reads and a cache of listing and article pages
+# quickly takes gigabytes of small files. SegmentCacheStorage appends each
+# response, compressed, to a few large segment files, finds it through an
+# index kept in memory, and keeps the cache to a size by evicting the least
+# recently used responses when it compacts the segments.
+
+import fcntl
+import hashlib
+import os
+import re
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.project import data_path
+
+from news_crawler.replay import CODECS, decode_response, encode_response, request_key
+
+# magic, key, stored_at, expires_at (0 for never), length of the compressed payload, its crc32
+_RECORD = struct.Struct('<4s20sddII')
+_MAGIC = b'HCR1'
+_SEGMENT_RE = re.compile(r'segment-(\d{6})\.(\w+)$')
+
+
+class SegmentCacheStorage:
+    """
+    Scrapy HTTP cache storage in append-only segment files.
+
+    Each response is a record: a fixed header (request key, store and
+    expiry times, length and checksum) followed by the response,
+    compressed on its own. The index maps request keys to records and is
+    rebuilt at start by reading the record headers only. A new segment is
+    started once the last one reaches HTTPCACHE_SEGMENT_SIZE bytes.
+
+    Several crawler processes can share a cache directory: appends and
+    compactions hold an exclusive flock on its lock file, and a process
+    picks up the records others appended at most a second later.
+    Compaction copies the records still wanted to new segments and removes
+    the old ones; a process still reading an old segment keeps its open
+    file. Records from an interrupted write are skipped, and cut off by the
+    next append.
+
+    Responses expire HTTPCACHE_EXPIRATION_SECS after they were stored, or
+    after the time HTTPCACHE_DOMAIN_EXPIRATION_SECS gives their domain (or
+    a parent domain, {"whitehouse.gov": 3600}); 0 never expires. Once the
+    segments reach HTTPCACHE_MAX_SIZE bytes they are compacted down to 80%
+    of it, dropping expired responses and then the ones least recently read
+    by this process (or stored, when it didn't read them). Compaction also
+    runs at close when more than HTTPCACHE_COMPACT_RATIO of the bytes are
+    replaced or expired records.
+
+    Settings:
+        HTTPCACHE_DIR, HTTPCACHE_EXPIRATION_SECS   as for Scrapy's storages
+        HTTPCACHE_DOMAIN_EXPIRATION_SECS           {domain: seconds}, for it and its subdomains
+        HTTPCACHE_MAX_SIZE                         bytes on disk, 0 for no cap
+        HTTPCACHE_COMPRESSION                      "zstd" (falls back to zlib when unavailable) or "zlib"
+        HTTPCACHE_SEGMENT_SIZE                     bytes per segment file
+        HTTPCACHE_COMPACT_RATIO                    dead share of the bytes that triggers compaction at close
+
+    Stats:
+        httpcache/expired, httpcache/evicted, httpcache/compactions, httpcache/disk_bytes
+    """
+
+    refresh_interval = 1.0
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'])
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.domain_expiration_secs = settings.getdict('HTTPCACHE_DOMAIN_EXPIRATION_SECS')
+        self.max_size = settings.getint('HTTPCACHE_MAX_SIZE', 0)
+        self.codec = settings.get('HTTPCACHE_COMPRESSION', 'zstd')
+        if self.codec not in CODECS:
+            self.codec = 'zlib'
+        self.segment_size = settings.getint('HTTPCACHE_SEGMENT_SIZE', 64 * 1024 * 1024)
+        self.compact_ratio = settings.getfloat('HTTPCACHE_COMPACT_RATIO', 0.5)
+        self.stats = None
+
+    def open_spider(self, spider):
+        self.path = os.path.join(self.cachedir, spider.name)
+        os.makedirs(self.path, exist_ok=True)
+        self.fingerprinter = spider.crawler.request_fingerprinter
+        self.stats = spider.crawler.stats
+        self.lock_fd = os.open(os.path.join(self.path, 'lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        # key -> (segment, offset, length, stored_at, expires_at)
+        self.index = {}
+        self.accessed = {}
+        # segment -> bytes read so far (the end of its last complete record)
+        self.scanned = {}
+        self.readers = {}
+        self.writer = None
+        self.refreshed_at = 0.0
+        self.refresh()
+
+    def close_spider(self, spider):
+        total = sum(self.scanned.values())
+        live = sum(_RECORD.size + entry[2] for entry in self.index.values())
+        if total and (total - live > self.compact_ratio * total or (self.max_size and total > self.max_size)):
+            self.compact()
+        self.inc_stat('disk_bytes', sum(self.scanned.values()))
+        self._close_files()
+        os.close(self.lock_fd)
+
+    def inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(f'httpcache/{key}', count)
+
+    def key(self, request):
+        return hashlib.sha1(request_key(request, self.fingerprinter).encode('utf-8')).digest()
+
+    def expiration(self, host):
+        """Seconds responses from `host` are kept, 0 for ever."""
+        if self.domain_expiration_secs and host:
+            parts = host.split('.')
+            for start in range(len(parts)):
+                seconds = self.domain_expiration_secs.get('.'.join(parts[start:]))
+                if seconds is not None:
+                    return int(seconds)
+        return self.expiration_secs
+
+    @contextmanager
+    def locked(self):
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.path) if _SEGMENT_RE.match(name))
+
+    def refresh(self):
+        """Reads the record headers appended since the last refresh, by any process."""
+        self.refreshed_at = time.monotonic()
+        names = self.segments()
+        gone = self.scanned.keys() - set(names)
+        if gone:
+            # Compacted away: the records still wanted are in newer segments
+            self.index = {key: entry for key, entry in self.index.items() if entry[0] not in gone}
+            for name in gone:
+                self.scanned.pop(name)
+                reader = self.readers.pop(name, None)
+                if reader is not None:
+                    os.close(reader)
+        for name in names:
+            self._scan(name)
+
+    def _scan(self, name):
+        """Indexes the complete records of `name` past what was read; returns whether it ends with one."""
+        fd = self._reader(name)
+        if fd is None:
+            return True
+        size = os.fstat(fd).st_size
+        offset = self.scanned.get(name, 0)
+        index = self.index
+        while offset + _RECORD.size <= size:
+            magic, key, stored_at, expires_at, length, crc = _RECORD.unpack(os.pread(fd, _RECORD.size, offset))
+            if magic != _MAGIC or offset + _RECORD.size + length > size:
+                break
+            current = index.get(key)
+            if current is None or stored_at >= current[3]:
+                index[key] = (name, offset, length, stored_at, expires_at)
+            offset += _RECORD.size + length
+        self.scanned[name] = offset
+        return offset == size
+
+    def _reader(self, name):
+        reader = self.readers.get(name)
+        if reader is None:
+            try:
+                reader = self.readers[name] = os.open(os.path.join(self.path, name), os.O_RDONLY)
+            except FileNotFoundError:
+                return None
+        return reader
+
+    def _read(self, key, entry):
+        name, offset, length = entry[:3]
+        reader = self._reader(name)
+        if reader is None:
+            return None
+        data = os.pread(reader, _RECORD.size + length, offset)
+        magic, record_key, stored_at, expires_at, length, crc = _RECORD.unpack_from(data)
+        payload = data[_RECORD.size:]
+        if magic != _MAGIC or record_key != key or zlib.crc32(payload) != crc:
+            return None
+        return CODECS[name.rsplit('.', 1)[1]][1](payload)
+
+    def retrieve_response(self, spider, request):
+        key = self.key(request)
+        if time.monotonic() - self.refreshed_at > self.refresh_interval:
+            self.refresh()
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        now = time.time()
+        expiration = self.expiration(urlparse_cached(request).hostname)
+        if (entry[4] and entry[4] < now) or 0 < expiration < now - entry[3]:
+            self.inc_stat('expired')
+            return None
+        data = self._read(key, entry)
+        if data is None:
+            # Compacted away by another process since the last refresh
+            self.refresh()
+            entry = self.index.get(key)
+            data = self._read(key, entry) if entry is not None else None
+            if data is None:
+                return None
+        self.accessed[key] = now
+        return decode_response(data, request)
+
+    def store_response(self, spider, request, response):
+        key = self.key(request)
+        now = time.time()
+        expiration = self.expiration(urlparse_cached(request).hostname)
+        expires_at = now + expiration if expiration > 0 else 0
+        payload = CODECS[self.codec][0](encode_response(response))
+        record = _RECORD.pack(_MAGIC, key, now, expires_at, len(payload), zlib.crc32(payload)) + payload
+        with self.locked():
+            name, fd = self._writer(len(record))
+            offset = os.fstat(fd).st_size
+            os.write(fd, record)
+        if self.scanned.get(name, 0) == offset:
+            self.scanned[name] = offset + len(record)
+        self.index[key] = (name, offset, len(payload), now, expires_at)
+        if self.max_size and sum(self.scanned.values()) > self.max_size:
+            self.compact()
+
+    def _writer(self, size):
+        """The segment to append `size` bytes to, and a descriptor for it. Called with the lock held."""
+        names = self.segments()
+        name = names[-1] if names else None
+        if name is not None:
+            complete = self._scan(name)
+            fd = self._reader(name)
+            length = os.fstat(fd).st_size if fd is not None else 0
+            if not complete:
+                # Left by a writer that died mid-record: nobody else is writing now
+                os.truncate(os.path.join(self.path, name), self.scanned[name])
+                length = self.scanned[name]
+            if not name.endswith('.' + self.codec) or (length and length + size > self.segment_size):
+                name = None
+        if name is None:
+            number = int(_SEGMENT_RE.match(names[-1]).group(1)) + 1 if names else 0
+            name = f'segment-{number:06d}.{self.codec}'
+        if self.writer is None or self.writer[0] != name:
+            if self.writer is not None:
+                os.close(self.writer[1])
+            fd = os.open(os.path.join(self.path, name), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.writer = (name, fd)
+        return self.writer
+
+    def compact(self):
+        """
+        Rewrites the records still wanted into new segments and removes the
+        old ones, evicting the least recently used records over 80% of
+        HTTPCACHE_MAX_SIZE.
+        """
+        with self.locked():
+            self.refresh()
+            now = time.time()
+            live = [(key, entry) for key, entry in self.index.items() if not (entry[4] and entry[4] < now)]
+            self.inc_stat('expired', len(self.index) - len(live))
+            limit = self.max_size * 0.8 if self.max_size else None
+            if limit is not None:
+                live.sort(key=lambda item: self.accessed.get(item[0], item[1][3]), reverse=True)
+            kept, kept_bytes = [], 0
+            for key, entry in live:
+                if limit is not None and kept_bytes + _RECORD.size + entry[2] > limit:
+                    self.inc_stat('evicted', len(live) - len(kept))
+                    break
+                kept.append((key, entry))
+                kept_bytes += _RECORD.size + entry[2]
+            # In file order, so the copy reads each old segment front to back
+            kept.sort(key=lambda item: item[1][:2])
+
+            old = self.segments()
+            number = int(_SEGMENT_RE.match(old[-1]).group(1)) + 1 if old else 0
+            index, scanned = {}, {}
+            name = fd = None
+            for key, entry in kept:
+                data = os.pread(self._reader(entry[0]), _RECORD.size + entry[2], entry[1])
+                codec = entry[0].rsplit('.', 1)[1]
+                if fd is None or not name.endswith('.' + codec) or scanned[name] + len(data) > self.segment_size:
+                    if fd is not None:
+                        os.fsync(fd)
+                        os.close(fd)
+                    name = f'segment-{number:06d}.{codec}'
+                    number += 1
+                    fd = os.open(os.path.join(self.path, name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                    scanned[name] = 0
+                os.write(fd, data)
+                index[key] = (name, scanned[name]) + entry[2:]
+                scanned[name] += len(data)
+            if fd is None:
+                # Segment names are never reused, so descriptors other processes keep can't mix them up
+                name = f'segment-{number:06d}.{self.codec}'
+                fd = os.open(os.path.join(self.path, name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                scanned[name] = 0
+            os.fsync(fd)
+            os.close(fd)
+
+            self._close_files()
+            for name in old:
+                os.remove(os.path.join(self.path, name))
+            self.index = index
+            self.scanned = scanned
+            self.accessed = {key: accessed for key, accessed in self.accessed.items() if key in index}
+        self.inc_stat('compactions')
+
+    def _close_files(self):
+        for reader in self.readers.values():
+            os.close(reader)
+        self.readers = {}
+        if self.writer is not None:
+            os.close(self.writer[1])
+            self.writer = None
@@ -0,0 +1,439 @@
+# Crawl instrumentation
+#
+# A slow run could be waiting on downloads, link extraction, ranking,
+# trafilatura or Postgres, and the Scrapy stats only say how many of each
+# happened. Instrumentation times every call of the hot spots it is told
+# about, wall clock and CPU, keeps a histogram per stage and writes them out
+# when the spider closes, as JSON and in the Prometheus text format (for the
+# node_exporter textfile collector). A sampling profiler can be switched on
+# to see inside the stages.
+
+import bisect
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.project import data_path
+from twisted.internet import defer
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+DEFAULT_STAGES = [
+    'spider.parse',
+    'spider.parse_feed',
+    'spider.parse_robots',
+    'spider.parse_article',
+    'spider.link_extractor.extract_links',
+    'spider.url_ranker.rank',
+    'spider.extractor.extract',
+    'pipeline.WriteToDbPipeline.write_rows',
+]
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus has them."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (the maximum past the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class Stage:
+    def __init__(self):
+        self.wall = Histogram(SECONDS_BUCKETS)
+        self.cpu = Histogram(SECONDS_BUCKETS)
+        self.bytes = None
+
+    def summary(self, scale=1000.0):
+        summary = {'count': self.wall.count}
+        for name, histogram in (('wall_ms', self.wall), ('cpu_ms', self.cpu)):
+            if histogram.count:
+                summary[name] = {
+                    'total': round(histogram.sum * scale, 3),
+                    'mean': round(histogram.sum / histogram.count * scale, 3),
+                    'p50': round(histogram.quantile(0.5) * scale, 3),
+                    'p95': round(histogram.quantile(0.95) * scale, 3),
+                    'p99': round(histogram.quantile(0.99) * scale, 3),
+                    'max': round(histogram.max * scale, 3),
+                }
+        if self.bytes is not None and self.bytes.count:
+            summary['bytes'] = {
+                'total': int(self.bytes.sum),
+                'mean': round(self.bytes.sum / self.bytes.count),
+                'p95': self.bytes.quantile(0.95),
+                'max': int(self.bytes.max),
+            }
+        return summary
+
+
+class _CpuTimed:
+    """Awaitable that adds the CPU time of each step of `awaitable` to clock[0]."""
+
+    def __init__(self, awaitable, clock):
+        self.awaitable = awaitable
+        self.clock = clock
+
+    def __await__(self):
+        iterator = self.awaitable.__await__()
+        value, error = None, None
+        while True:
+            mark = time.thread_time()
+            try:
+                if error is None:
+                    yielded = iterator.send(value)
+                else:
+                    yielded = iterator.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.clock[0] += time.thread_time() - mark
+            value, error = None, None
+            try:
+                value = yield yielded
+            except GeneratorExit:
+                iterator.close()
+                raise
+            except BaseException as exc:
+                error = exc
+
+
+def _timed_generator(generator, started, cpu, record):
+    try:
+        while True:
+            mark = time.thread_time()
+            try:
+                value = next(generator)
+            except StopIteration:
+                return
+            finally:
+                cpu += time.thread_time() - mark
+            yield value
+    finally:
+        generator.close()
+        record(time.perf_counter() - started, cpu)
+
+
+async def _timed_coroutine(coroutine, started, cpu, record):
+    clock = [cpu]
+    try:
+        return await _CpuTimed(coroutine, clock)
+    finally:
+        record(time.perf_counter() - started, clock[0])
+
+
+async def _timed_async_generator(generator, started, cpu, record):
+    clock = [cpu]
+    try:
+        while True:
+            try:
+                value = await _CpuTimed(generator.__anext__(), clock)
+            except StopAsyncIteration:
+                return
+            yield value
+    finally:
+        await generator.aclose()
+        record(time.perf_counter() - started, clock[0])
+
+
+def _record_deferred(result, started, cpu, record):
+    record(time.perf_counter() - started, cpu)
+    return result
+
+
+def instrument(function, record):
+    """
+    Wraps `function` so every call reports `(wall seconds, CPU seconds)` to
+    `record` once its result is complete: generators and async generators
+    when exhausted, coroutines when they return, Deferreds when they fire.
+    CPU time only counts the steps that run in the calling thread, not the
+    time spent waiting on other work.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        mark = time.thread_time()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            record(time.perf_counter() - started, time.thread_time() - mark)
+            raise
+        cpu = time.thread_time() - mark
+        if inspect.isgenerator(result):
+            return _timed_generator(result, started, cpu, record)
+        if inspect.isasyncgen(result):
+            return _timed_async_generator(result, started, cpu, record)
+        if inspect.iscoroutine(result):
+            return _timed_coroutine(result, started, cpu, record)
+        if isinstance(result, defer.Deferred):
+            return result.addBoth(_record_deferred, started, cpu, record)
+        record(time.perf_counter() - started, cpu)
+        return result
+
+    return wrapper
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread every `interval` seconds from a
+    background thread and counts the stacks it sees, in the collapsed
+    format flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, thread_id, interval=0.01):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def top_functions(self, count=30):
+        """Functions seen on top of the stack most often, with their share of samples."""
+        leaves = Counter()
+        for stack, samples in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += samples
+        return [(function, round(samples / self.samples, 4)) for function, samples in leaves.most_common(count)]
+
+    def write_folded(self, path):
+        with open(path, 'w', encoding='utf-8') as folded_file:
+            for stack, samples in self.stacks.most_common():
+                folded_file.write(f'{stack} {samples}\n')
+
+
+class Instrumentation:
+    """
+    Extension that times the crawl's hot paths and exports histograms.
+
+    Stages are downloads (latency and response bytes), scraped items
+    (bytes), every item pipeline's process_item, and the methods listed in
+    INSTRUMENTATION_STAGES, given as "spider.<attribute path>" or
+    "pipeline.<pipeline class>.<method>". Stages nest: parse includes the
+    link extraction and ranking it calls. Wrapped spider callbacks are no
+    longer spider methods, so requests can't go to a JOBDIR disk queue.
+
+    Settings:
+        INSTRUMENTATION_ENABLED            default True
+        INSTRUMENTATION_STAGES             methods to time, see DEFAULT_STAGES
+        INSTRUMENTATION_DIR                output directory, relative paths live in .scrapy
+        INSTRUMENTATION_FORMATS            "json" and/or "prometheus"
+        INSTRUMENTATION_PROFILER           sample the reactor thread's stack (default False)
+        INSTRUMENTATION_PROFILER_INTERVAL  seconds between samples
+
+    Stats (per stage, under instrumentation/<stage>/):
+        count, wall_ms_total, cpu_ms_total
+    """
+
+    def __init__(self, crawler, stages=None, directory='instrumentation', formats=('json', 'prometheus'),
+                 profiler=False, profiler_interval=0.01):
+        self.crawler = crawler
+        self.stage_names = DEFAULT_STAGES if stages is None else stages
+        self.directory = directory
+        self.formats = formats
+        self.profiler_enabled = profiler
+        self.profiler_interval = profiler_interval
+        self.profiler = None
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.started = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('INSTRUMENTATION_ENABLED', True):
+            raise NotConfigured
+        extension = cls(
+            crawler,
+            stages=settings.getlist('INSTRUMENTATION_STAGES', DEFAULT_STAGES),
+            directory=data_path(settings.get('INSTRUMENTATION_DIR', 'instrumentation')),
+            formats=settings.getlist('INSTRUMENTATION_FORMATS', ['json', 'prometheus']),
+            profiler=settings.getbool('INSTRUMENTATION_PROFILER', False),
+            profiler_interval=settings.getfloat('INSTRUMENTATION_PROFILER_INTERVAL', 0.01),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage()
+        return stage
+
+    def observe(self, name, wall=None, cpu=None, size=None):
+        # Pipelines such as WriteToDbPipeline.write_rows report from worker threads
+        with self.lock:
+            stage = self.stage(name)
+            if wall is not None:
+                stage.wall.observe(wall)
+            if cpu is not None:
+                stage.cpu.observe(cpu)
+            if size is not None:
+                if stage.bytes is None:
+                    stage.bytes = Histogram(BYTES_BUCKETS)
+                stage.bytes.observe(size)
+
+    def recorder(self, name):
+        return lambda wall, cpu: self.observe(name, wall, cpu)
+
+    def _resolve(self, spider, path):
+        """Returns the object owning the method a stage path names, and the method name."""
+        parts = path.split('.')
+        if parts[0] == 'spider':
+            owner = spider
+            for attribute in parts[1:-1]:
+                owner = getattr(owner, attribute, None)
+        elif parts[0] == 'pipeline' and len(parts) == 3:
+            pipelines = self.crawler.engine.scraper.itemproc.middlewares
+            owner = next((pipe for pipe in pipelines if type(pipe).__name__ == parts[1]), None)
+        else:
+            raise ValueError(f"INSTRUMENTATION_STAGES entry {path!r} should start with spider. or pipeline.")
+        return owner, parts[-1]
+
+    def spider_opened(self, spider):
+        self.started = time.time()
+        for path in self.stage_names:
+            owner, name = self._resolve(spider, path)
+            method = getattr(owner, name, None) if owner is not None else None
+            if method is None:
+                logger.debug(f"Instrumentation: {path} not found, not timed")
+                continue
+            setattr(owner, name, instrument(method, self.recorder(path)))
+
+        methods = self.crawler.engine.scraper.itemproc.methods['process_item']
+        for index, method in enumerate(methods):
+            pipeline = getattr(getattr(method, '__wrapped__', method), '__self__', None)
+            name = type(pipeline).__name__ if pipeline is not None else method.__name__
+            methods[index] = instrument(method, self.recorder(f'pipeline.{name}.process_item'))
+
+        if self.profiler_enabled:
+            # Spider signals arrive in the reactor thread, where the crawl's Python code runs
+            self.profiler = SamplingProfiler(threading.get_ident(), self.profiler_interval)
+            self.profiler.start()
+
+    def response_downloaded(self, response, request, spider):
+        self.observe('download', wall=request.meta.get('download_latency'), size=len(response.body))
+
+    def item_scraped(self, item, response, spider):
+        size = sum(len(value) for value in ItemAdapter(item).values() if isinstance(value, str))
+        self.observe('item', size=size)
+
+    def spider_closed(self, spider):
+        if self.profiler is not None:
+            self.profiler.stop()
+        stats = self.crawler.stats
+        for name, stage in self.stages.items():
+            stats.set_value(f'instrumentation/{name}/count', max(stage.wall.count, stage.bytes.count if stage.bytes else 0))
+            if stage.wall.count:
+                stats.set_value(f'instrumentation/{name}/wall_ms_total', round(stage.wall.sum * 1000))
+            if stage.cpu.count:
+                stats.set_value(f'instrumentation/{name}/cpu_ms_total', round(stage.cpu.sum * 1000))
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, spider.name)
+        if 'json' in self.formats:
+            with open(base + '.json', 'w', encoding='utf-8') as json_file:
+                json.dump(self.report(spider), json_file, indent=2)
+        if 'prometheus' in self.formats:
+            with open(base + '.prom', 'w', encoding='utf-8') as prom_file:
+                prom_file.write(self.prometheus_text(spider))
+        if self.profiler is not None:
+            self.profiler.write_folded(base + '.folded')
+        logger.info(f"Instrumentation written to {base}.*")
+
+    def report(self, spider):
+        report = {
+            'spider': spider.name,
+            'started': self.started,
+            'elapsed_s': round(time.time() - self.started, 3),
+            'stages': {name: stage.summary() for name, stage in sorted(self.stages.items())},
+        }
+        if self.profiler is not None:
+            report['profile'] = {
+                'samples': self.profiler.samples,
+                'interval_s': self.profiler.interval,
+                'top_functions': self.profiler.top_functions(),
+            }
+        return report
+
+    def prometheus_text(self, spider):
+        lines = []
+        metrics = (('news_crawler_stage_wall_seconds', 'Wall-clock time per call of a crawl stage', 'wall'),
+                   ('news_crawler_stage_cpu_seconds', 'CPU time per call of a crawl stage', 'cpu'),
+                   ('news_crawler_stage_bytes', 'Bytes handled per call of a crawl stage', 'bytes'))
+        for metric, help_text, attribute in metrics:
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} histogram')
+            for name, stage in sorted(self.stages.items()):
+                histogram = getattr(stage, attribute)
+                if histogram is None or not histogram.count:
+                    continue
+                labels = f'spider="{spider.name}",stage="{name}"'
+                for bound, count in histogram.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f'{metric}_sum{{{labels}}} {histogram.sum!r}')
+                lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
@@ -3,6 +3,8 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
+import dataclasses
+
 import scrapy
 
 
@@ -23,6 +25,35 @@ class NewsItems(scrapy.Item):
     topic = scrapy.Field()
     branch = scrapy.Field()
     country = scrapy.Field()
+    # URL of the stored article this one nearly duplicates (NEAR_DUPLICATES_MODE = "link")
+    duplicate_of = scrapy.Field()
+    # NearDuplicateIndex row of the item while it goes through the pipelines, never stored
+    near_duplicate_id = scrapy.Field(store=False)
+
+@dataclasses.dataclass(slots=True, eq=False)
+class ArticleRecord:
+    """
+    An article, with the fields of NewsItems in slots instead of a dict: a
+    fraction of the memory per item, and pipelines (through ItemAdapter)
+    hand the same 'md' and 'description' strings along without copying.
+    Fields marked omit_if_none aren't written to the database while None,
+    fields marked store=False never are.
+    """
+    title: str
+    url: str
+    image_url: str
+    document_url: str
+    created_at: object
+    description: str
+    md: str
+    collection_name: str
+    topic: str
+    branch: str
+    country: str
+    # URL of the stored article this one nearly duplicates (NEAR_DUPLICATES_MODE = "link")
+    duplicate_of: str = dataclasses.field(default=None, metadata={'omit_if_none': True})
+    # NearDuplicateIndex row of the item while it goes through the pipelines
+    near_duplicate_id: int = dataclasses.field(default=None, metadata={'store': False})
 
 class NotificationModel(scrapy.Item):
     title = scrapy.Field()
@@ -0,0 +1,94 @@
+# Link extraction for listing pages
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/link-extractors.html
+
+from urllib.parse import urljoin, urlparse
+
+from lxml import etree
+from scrapy.link import Link
+from scrapy.linkextractors import IGNORED_EXTENSIONS
+from scrapy.utils.misc import rel_has_nofollow
+from scrapy.utils.response import get_base_url
+from scrapy.utils.url import url_has_any_extension
+from w3lib.html import strip_html5_whitespace
+from w3lib.url import safe_url_string
+
+# Page furniture that never contains the article list itself. Tags are
+# matched by name, classes by whole class token (like CSS `.sidebar`).
+BOILERPLATE_TAGS = frozenset([
+    'header', 'nav', 'footer', 'aside', 'sidebar', 'comments',
+])
+BOILERPLATE_CLASSES = frozenset([
+    'sidebar', 'footer', 'header', 'nav', 'sidenav', 'pagination', 'pager',
+    'related-links', 'related-posts', 'comment', 'share-buttons', 'social-links',
+    'ad', 'advertisement', 'promo', 'promotion',
+])
+
+_collect_string_content = etree.XPath("string()")
+
+
+class BoilerplateLinkExtractor:
+    """
+    Extracts links from a listing page while ignoring everything inside
+    header/nav/footer/sidebar style boilerplate.
+
+    Works directly on the tree Scrapy already parsed for `response.selector`
+    and walks it once, skipping boilerplate subtrees as it goes, so the page
+    is never copied or re-parsed. Links are normalized and filtered the same
+    way as the default `LinkExtractor()` (a/area hrefs, ignored file
+    extensions, unique by URL).
+    """
+
+    def __init__(self, tags=('a', 'area'), boilerplate_tags=BOILERPLATE_TAGS,
+                 boilerplate_classes=BOILERPLATE_CLASSES, deny_extensions=None):
+        if deny_extensions is None:
+            deny_extensions = IGNORED_EXTENSIONS
+        self.tags = frozenset(tags)
+        self.boilerplate_tags = frozenset(boilerplate_tags)
+        self.boilerplate_classes = frozenset(boilerplate_classes)
+        self.deny_extensions = {'.' + e for e in deny_extensions}
+
+    def is_boilerplate(self, element):
+        if element.tag in self.boilerplate_tags:
+            return True
+        classes = element.get('class')
+        return bool(classes) and not self.boilerplate_classes.isdisjoint(classes.split())
+
+    def iter_link_elements(self, root):
+        walker = etree.iterwalk(root, events=('start',))
+        for _, element in walker:
+            if not isinstance(element.tag, str):
+                continue  # comments and processing instructions
+            if self.is_boilerplate(element):
+                walker.skip_subtree()
+                continue
+            if element.tag in self.tags:
+                href = element.get('href')
+                if href is not None:
+                    yield element, href
+
+    def extract_links(self, response):
+        base_url = get_base_url(response)
+        response_url = response.url
+        encoding = response.encoding
+        seen = set()
+        links = []
+        for element, href in self.iter_link_elements(response.selector.root):
+            try:
+                url = urljoin(base_url, strip_html5_whitespace(href))
+                url = safe_url_string(url, encoding=encoding)
+            except ValueError:
+                continue  # skipping bogus links
+            url = urljoin(response_url, url)
+            if url in seen or not self._link_allowed(url):
+                continue
+            seen.add(url)
+            links.append(Link(url, _collect_string_content(element) or '',
+                              nofollow=rel_has_nofollow(element.get('rel'))))
+        return links
+
+    def _link_allowed(self, url):
+        if url.split('://', 1)[0] not in ('http', 'https', 'file', 'ftp'):
+            return False
+        return not url_has_any_extension(urlparse(url), self.deny_extensions)
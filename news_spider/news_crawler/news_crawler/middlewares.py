@@ -3,7 +3,18 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import hashlib
+import logging
+import os
+import time
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import TextResponse
+from scrapy.utils.project import data_path
+
+from news_crawler.replay import ResponseArchive, request_key
+from news_crawler.sharding import connect_store, store_timeout
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -101,3 +112,285 @@ class NewsCrawlerDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class NotModified(IgnoreRequest):
+    """
+    Raised by ConditionalGetMiddleware for a page unchanged since the last
+    crawl. Errbacks tell it apart from the other IgnoreRequest failures,
+    HttpError (404, 5xx) included, with `failure.check(NotModified)`.
+    """
+
+
+class ConditionalGetMiddleware:
+    """
+    Revalidates source listing pages instead of downloading and parsing them
+    again when they have not changed since the last crawl.
+
+    Only requests with `meta['conditional_get']` set are handled. For each
+    of their URLs the ETag, Last-Modified and a hash of the body are kept in
+    a local SQLite store; later requests send If-None-Match and
+    If-Modified-Since, and a 304 or a body identical to the stored one is
+    dropped here, with NotModified, so the spider callback never runs.
+
+    Settings:
+        CONDITIONAL_GET_ENABLED  (default True)
+        CONDITIONAL_GET_PATH     store location, relative paths live in .scrapy, shared by shards
+
+    Stats:
+        conditional_get/not_modified, conditional_get/unchanged, conditional_get/changed
+    """
+
+    def __init__(self, path, stats, timeout=5.0):
+        self.stats = stats
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = connect_store(path, timeout)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS validators ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash BLOB, updated_at REAL)"
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CONDITIONAL_GET_ENABLED', True):
+            raise NotConfigured
+        s = cls(data_path(settings.get('CONDITIONAL_GET_PATH', 'conditional_get.sqlite')), crawler.stats,
+                timeout=store_timeout(settings))
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_request(self, request, spider):
+        if not request.meta.get('conditional_get'):
+            return None
+        row = self.db.execute(
+            "SELECT etag, last_modified FROM validators WHERE url = ?", (request.url,)
+        ).fetchone()
+        if row:
+            etag, last_modified = row
+            if etag:
+                request.headers.setdefault('If-None-Match', etag)
+            if last_modified:
+                request.headers.setdefault('If-Modified-Since', last_modified)
+        return None
+
+    def process_response(self, request, response, spider):
+        if not request.meta.get('conditional_get'):
+            return response
+        if response.status == 304:
+            self.stats.inc_value('conditional_get/not_modified')
+            raise NotModified(f"Not modified since last crawl: {request.url}")
+        if response.status != 200:
+            return response
+
+        content_hash = hashlib.blake2b(response.body, digest_size=16).digest()
+        row = self.db.execute(
+            "SELECT content_hash FROM validators WHERE url = ?", (request.url,)
+        ).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?)",
+            (
+                request.url,
+                response.headers.get('ETag', b'').decode('latin-1') or None,
+                response.headers.get('Last-Modified', b'').decode('latin-1') or None,
+                content_hash,
+                time.time(),
+            ),
+        )
+        if row and row[0] == content_hash:
+            self.stats.inc_value('conditional_get/unchanged')
+            raise NotModified(f"Unchanged since last crawl: {request.url}")
+        self.stats.inc_value('conditional_get/changed')
+        return response
+
+    def spider_closed(self, spider):
+        self.db.close()
+
+
+def needs_browser_rendering(response, min_links=10, min_words=100):
+    """
+    True when a plain HTTP response looks like a JavaScript shell: fewer
+    than `min_links` links or `min_words` words of visible text.
+    """
+    if not isinstance(response, TextResponse):
+        return False
+    if float(response.xpath('count(//a[@href])').get()) < min_links:
+        return True
+    text = response.xpath(
+        '//body//text()[not(ancestor::script or ancestor::style or ancestor::noscript)]'
+    ).getall()
+    return sum(len(chunk.split()) for chunk in text) < min_words
+
+
+class RenderingTierMiddleware:
+    """
+    Fetches source listing pages through the cheapest Zyte API mode that
+    works for them.
+
+    Only requests with `meta['tiered_rendering']` set are handled. A source
+    is first fetched as a plain HTTP response (`httpResponseBody`); when
+    `needs_browser_rendering` says the page is a JavaScript shell the request
+    is sent again with `browserHtml`, and that source goes straight to the
+    browser on later crawls. Browser decisions older than
+    RENDERING_REPROBE_DAYS are tried over plain HTTP again, in case the site
+    changed.
+
+    Settings:
+        RENDERING_TIERS_ENABLED   (default True)
+        RENDERING_DECISIONS_PATH  store location, relative paths live in .scrapy
+        RENDERING_MIN_LINKS       fewer links than this escalates to the browser
+        RENDERING_MIN_WORDS       fewer words of visible text than this escalates too
+        RENDERING_REPROBE_DAYS    age after which a browser decision is retried
+
+    Stats:
+        rendering/http, rendering/browser, rendering/escalated
+    """
+
+    HTTP = 'http'
+    BROWSER = 'browser'
+    AUTOMAP = {
+        HTTP: {"httpResponseBody": True},
+        BROWSER: {"browserHtml": True},
+    }
+
+    def __init__(self, path, stats, min_links=10, min_words=100, reprobe_days=30, timeout=5.0):
+        self.stats = stats
+        self.min_links = min_links
+        self.min_words = min_words
+        self.reprobe_after = reprobe_days * 86400
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = connect_store(path, timeout)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS decisions (url TEXT PRIMARY KEY, tier TEXT, updated_at REAL)"
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('RENDERING_TIERS_ENABLED', True):
+            raise NotConfigured
+        s = cls(
+            data_path(settings.get('RENDERING_DECISIONS_PATH', 'rendering.sqlite')),
+            crawler.stats,
+            min_links=settings.getint('RENDERING_MIN_LINKS', 10),
+            min_words=settings.getint('RENDERING_MIN_WORDS', 100),
+            reprobe_days=settings.getfloat('RENDERING_REPROBE_DAYS', 30),
+            timeout=store_timeout(settings),
+        )
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def get_tier(self, url):
+        """The tier to fetch `url` with on this crawl."""
+        row = self.db.execute(
+            "SELECT tier, updated_at FROM decisions WHERE url = ?", (url,)
+        ).fetchone()
+        if row and row[0] == self.BROWSER and time.time() - row[1] < self.reprobe_after:
+            return self.BROWSER
+        return self.HTTP
+
+    def set_tier(self, url, tier):
+        self.db.execute("INSERT OR REPLACE INTO decisions VALUES (?, ?, ?)", (url, tier, time.time()))
+
+    def process_request(self, request, spider):
+        if not request.meta.get('tiered_rendering') or 'render_tier' in request.meta:
+            return None
+        tier = self.get_tier(request.url)
+        request.meta['render_tier'] = tier
+        request.meta['zyte_api_automap'] = self.AUTOMAP[tier]
+        return None
+
+    def process_response(self, request, response, spider):
+        tier = request.meta.get('render_tier')
+        if not request.meta.get('tiered_rendering') or tier is None:
+            return response
+        if tier == self.BROWSER or response.status != 200:
+            self.stats.inc_value(f'rendering/{tier}')
+            return response
+        if needs_browser_rendering(response, self.min_links, self.min_words):
+            self.stats.inc_value('rendering/escalated')
+            self.set_tier(request.url, self.BROWSER)
+            meta = dict(request.meta, render_tier=self.BROWSER,
+                        zyte_api_automap=self.AUTOMAP[self.BROWSER])
+            return request.replace(meta=meta, dont_filter=True)
+        self.stats.inc_value('rendering/http')
+        self.set_tier(request.url, self.HTTP)
+        return response
+
+    def spider_closed(self, spider):
+        self.db.close()
+
+
+class RecordReplayMiddleware:
+    """
+    Records every downloaded response to a ResponseArchive, or serves the
+    crawl from one without touching the network.
+
+    It sits next to the downloader, so it records responses as they arrive
+    (still compressed, redirects not yet followed) and replayed responses go
+    through every other middleware as they did when recorded. Replay
+    ignores download delays and slots. The crawl's other state in .scrapy
+    (seen URLs, feeds, validators) still applies: replay with a fresh data
+    directory, as `python -m news_crawler.bench` does, to get the recorded
+    crawl back.
+
+    Settings:
+        REPLAY_MODE          "record", "replay", or None to do nothing (default)
+        REPLAY_PATH          archive directory, relative paths live in .scrapy
+        REPLAY_COMPRESSION   "zstd" (falls back to zlib when unavailable) or "zlib"
+        REPLAY_SEGMENT_SIZE  bytes per segment file
+        REPLAY_MISSING       "ignore" requests missing from the archive, or "download" them
+
+    Stats:
+        replay/recorded, replay/recorded_bytes, replay/served, replay/missing
+    """
+
+    def __init__(self, archive, mode, stats, fingerprinter, missing='ignore'):
+        self.archive = archive
+        self.mode = mode
+        self.stats = stats
+        self.fingerprinter = fingerprinter
+        self.missing = missing
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        mode = settings.get('REPLAY_MODE')
+        if not mode:
+            raise NotConfigured
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"REPLAY_MODE should be 'record' or 'replay', not {mode!r}")
+        codec = settings.get('REPLAY_COMPRESSION', 'zstd')
+        archive = ResponseArchive(
+            data_path(settings.get('REPLAY_PATH', 'replay')),
+            codec=codec,
+            segment_size=settings.getint('REPLAY_SEGMENT_SIZE', 64 * 1024 * 1024),
+        )
+        if mode == 'record' and archive.codec != codec:
+            logging.warning(f"{codec} is not available, recording with {archive.codec}")
+        s = cls(archive, mode, crawler.stats, crawler.request_fingerprinter,
+                missing=settings.get('REPLAY_MISSING', 'ignore'))
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_request(self, request, spider):
+        if self.mode != 'replay':
+            return None
+        response = self.archive.get(request_key(request, self.fingerprinter), request)
+        if response is not None:
+            self.stats.inc_value('replay/served')
+            return response
+        self.stats.inc_value('replay/missing')
+        if self.missing == 'download':
+            return None
+        raise IgnoreRequest(f"Not in the replay archive: {request.url}")
+
+    def process_response(self, request, response, spider):
+        if self.mode == 'record' and 'replay' not in response.flags:
+            size = self.archive.add(request_key(request, self.fingerprinter), response)
+            self.stats.inc_value('replay/recorded')
+            self.stats.inc_value('replay/recorded_bytes', size)
+        return response
+
+    def spider_closed(self, spider):
+        self.archive.close()
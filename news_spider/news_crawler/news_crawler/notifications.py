@@ -0,0 +1,182 @@
+# Notification delivery
+#
+# WriteToDbPipeline turns every stored article that asks for one into a
+# NotificationModel. Sending each of them as it comes, inside the item
+# pipeline, would hold the item (and, once enough items wait, the crawl)
+# for as long as the notification service takes to answer. NotificationQueue
+# accepts them at once, coalesces the ones for the same collection and
+# topic over a short window, and delivers the batches in the background
+# through a sink, retrying failures, with a bound on how many notifications
+# may wait so a slow or dead service slows the crawl down instead of
+# filling the memory.
+
+import collections
+import logging
+import threading
+
+from twisted.internet import defer, task, threads
+
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryRejected(Exception):
+    """Raised by a sink for a batch that will never be accepted, so it isn't retried."""
+
+
+class HttpNotificationSink:
+    """
+    POSTs each batch as JSON to NOTIFICATIONS_URL, from the reactor thread
+    pool: {"collection_name": ..., "topic": ..., "notifications": [...]}.
+    4xx answers other than 429 reject the batch; anything else is retried.
+
+    A sink is any class built with `from_crawler(crawler)` (or without
+    arguments) whose `deliver(batch)` returns, or returns a Deferred, once
+    the batch is delivered and raises when it isn't. Set NOTIFICATIONS_SINK
+    to its import path to use another one.
+    """
+
+    def __init__(self, url, timeout=10.0, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.local = threading.local()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        url = settings.get('NOTIFICATIONS_URL')
+        if not url:
+            raise NotConfigured('NOTIFICATIONS_URL is not set')
+        return cls(url, timeout=settings.getfloat('NOTIFICATIONS_TIMEOUT', 10.0),
+                   headers=settings.getdict('NOTIFICATIONS_HEADERS'))
+
+    def deliver(self, batch):
+        return threads.deferToThread(self.post, batch)
+
+    def post(self, batch):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            # One keep-alive session per pool thread. requests is only
+            # imported here, it takes longer to import than the rest of the
+            # pipelines together
+            import requests
+            session = self.local.session = requests.Session()
+            session.headers.update(self.headers)
+        response = session.post(self.url, json=batch, timeout=self.timeout)
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            raise DeliveryRejected(f"{response.status_code} from {self.url}: {response.text[:200]}")
+        response.raise_for_status()
+
+
+class NotificationQueue:
+    """
+    Coalesces notifications per (collection_name, topic) and delivers them
+    in batches through `sink`.
+
+    A group is sent `window` seconds after its first notification, or as
+    soon as it holds `batch_size`; the same stored row (schema, table, id)
+    is only sent once per batch. At most `concurrency` batches are in
+    flight. Failed deliveries are retried `retry_times` times, waiting
+    `retry_backoff` seconds and twice as long after each attempt. Once
+    `max_pending` notifications are waiting or in flight, `put` returns a
+    Deferred that only fires when there is room again.
+    """
+
+    def __init__(self, sink, stats, window=2.0, batch_size=50, max_pending=1000, concurrency=4,
+                 retry_times=3, retry_backoff=1.0, clock=None):
+        if clock is None:
+            # Imported here so importing this module doesn't install the default reactor
+            from twisted.internet import reactor as clock
+        self.sink = sink
+        self.stats = stats
+        self.window = window
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.retry_times = retry_times
+        self.retry_backoff = retry_backoff
+        self.clock = clock
+        self.groups = {}
+        self.timers = {}
+        self.pending = 0
+        self.waiting = collections.deque()
+        self.slots = defer.DeferredSemaphore(concurrency)
+        self.deliveries = set()
+
+    def put(self, notification):
+        """Queues a notification dict. The returned Deferred fires once it is accepted."""
+        if self.pending >= self.max_pending:
+            self.stats.inc_value('notifications/backpressure')
+            waiter = defer.Deferred()
+            self.waiting.append((waiter, notification))
+            return waiter
+        self._add(notification)
+        return defer.succeed(None)
+
+    def _add(self, notification):
+        key = (notification.get('collection_name'), notification.get('topic'))
+        row = (notification.get('country_schema'), notification.get('table_source_name'),
+               notification.get('table_id'))
+        group = self.groups.setdefault(key, {})
+        if row in group:
+            self.stats.inc_value('notifications/coalesced')
+            return
+        group[row] = notification
+        self.pending += 1
+        self.stats.inc_value('notifications/queued')
+        self.stats.max_value('notifications/pending_max', self.pending)
+        if len(group) >= self.batch_size:
+            self.flush(key)
+        elif key not in self.timers:
+            self.timers[key] = self.clock.callLater(self.window, self.flush, key)
+
+    def flush(self, key):
+        timer = self.timers.pop(key, None)
+        if timer is not None and timer.active():
+            timer.cancel()
+        group = self.groups.pop(key, None)
+        if not group:
+            return
+        collection_name, topic = key
+        batch = {'collection_name': collection_name, 'topic': topic, 'notifications': list(group.values())}
+        delivery = self.slots.run(self._deliver, batch)
+        self.deliveries.add(delivery)
+        delivery.addBoth(self._delivered, delivery, len(group))
+
+    @defer.inlineCallbacks
+    def _deliver(self, batch):
+        size = len(batch['notifications'])
+        for attempt in range(self.retry_times + 1):
+            try:
+                yield defer.maybeDeferred(self.sink.deliver, batch)
+            except DeliveryRejected as error:
+                logger.error(f"{size} notifications for {batch['collection_name']} rejected: {error}")
+                break
+            except Exception as error:
+                if attempt == self.retry_times:
+                    logger.error(f"{size} notifications for {batch['collection_name']} not delivered "
+                                 f"after {attempt + 1} attempts: {error}")
+                    break
+                self.stats.inc_value('notifications/retries')
+                yield task.deferLater(self.clock, self.retry_backoff * 2 ** attempt, lambda: None)
+            else:
+                self.stats.inc_value('notifications/batches')
+                self.stats.inc_value('notifications/delivered', size)
+                return
+        self.stats.inc_value('notifications/failed', size)
+
+    def _delivered(self, result, delivery, size):
+        self.deliveries.discard(delivery)
+        self.pending -= size
+        while self.waiting and self.pending < self.max_pending:
+            waiter, notification = self.waiting.popleft()
+            self._add(notification)
+            waiter.callback(None)
+        return result
+
+    def close(self):
+        """Sends every group now and fires once all deliveries have finished."""
+        for key in list(self.groups):
+            self.flush(key)
+        return defer.DeferredList(list(self.deliveries))
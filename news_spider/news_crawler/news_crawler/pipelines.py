@@ -2,204 +2,37 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+#
+# dateutil, pytz and psycopg2 are imported where they are first needed, so
+# that `scrapy list`, `scrapy check` and the spider itself start without
+# them; the URL ranking the spider uses is in news_crawler.ranking.
 
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
-from readability import Document
-from markdownify import markdownify as md 
-import dateutil.parser
-import pytz
-import re
 import html
+from collections import Counter, OrderedDict
+from datetime import datetime
+from functools import lru_cache
 from urllib.parse import urlparse
-from w3lib.html import remove_tags
 import json
 import logging
-from scrapy.utils.project import get_project_settings
-import psycopg2
-from psycopg2 import errors
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.utils.misc import build_from_crawler, load_object
+from scrapy.utils.project import data_path
+from twisted.internet import defer, task, threads
 
+from news_crawler.dedup import NearDuplicateIndex, minhash_signature
 from news_crawler.items import NotificationModel
+from news_crawler.notifications import NotificationQueue
+from news_crawler.ranking import (  # noqa: F401, re-exported, the ranking used to live here
+    ARTICLE_INDICATORS_WEIGHTS, DOMAIN_BONUSES, MIN_ARTICLE_SCORE_THRESHOLD, MIN_PATH_SEGMENTS,
+    NON_ARTICLE_INDICATORS_WEIGHTS, SLUG_QUALITY_PATTERNS, UrlRanker, rank_urls_for_articles, url_date,
+)
+from news_crawler.schema import SchemaCache
+from news_crawler.sharding import store_timeout
 
-def rank_urls_for_articles(urls_list):
-    """
-    Ranks a list of URLs based on their likelihood of being individual articles,
-    and returns only the most likely ones.
-    """
-    # --- Configuration ---
-    ARTICLE_INDICATORS_WEIGHTS = {
-        # Regex patterns for dates (strong positive signals)
-        r'/\d{4}/\d{2}/\d{2}/': 5,  # /YYYY/MM/DD/
-        r'/\d{4}-\d{2}-\d{2}/': 5,   # /YYYY-MM-DD/
-        r'/\d{4}/\d{2}/': 2,         # /YYYY/MM/ (weaker, usually needs a slug after)
-        
-        # Common content type slugs (string segments)
-        'article': 4,
-        'issues': 4,
-        'blog': 4,
-        'news': 3,
-        'post': 3,
-        'story': 3,
-        'media': 3,
-        'press-release': 3,
-        'media-release': 3,
-        'speech': 3,
-        'report': 3,
-        'paper': 3,
-        'document': 2,
-        'publication': 2,
-        'release': 2,
-        
-        # Government/official content patterns
-        'announcement': 3,
-        'update': 2,
-        'statement': 3,
-        'advisory': 3,
-        'notice': 2,
-        'bulletin': 3,
-        
-        # Event/time-sensitive indicators
-        'month': 2,  # like "safety-awareness-month"
-        'week': 2,   # like "national-xyz-week"
-        'day': 2,    # like "international-xyz-day"
-        'annual': 2,
-        '2024': 2,   # Current/recent year
-        '2025': 2,
-        '2023': 1,   # Slightly older years
-    }
-    
-    NON_ARTICLE_INDICATORS_WEIGHTS = {
-        # Common navigational/category terms
-        'category': -3,
-        'tag': -3,
-        'archive': -2,
-        '/page/': -2,
-        'list': -2,
-        'search': -3,
-        'collection': -2,
-        'series': -2,
-        'topic': -2,
-        
-        # Common administrative/site structure terms
-        'about': -1,
-        'contact': -1,
-        'privacy': -1,
-        'terms': -1,
-        'dashboard': -4,
-        'admin': -5,
-        'login': -5,
-        'signup': -3,
-        'cart': -2,
-        'checkout': -2,
-        'sitemap': -2,
-        'feed': -1,
-        'json': -1,
-        'xml': -1,
-        'amp': -1,
-        'main-content': -3,
-        
-        # Index/home pages
-        'index': -2,
-        'home': -2,
-        'default': -2,
-    }
-    
-    # Additional slug quality patterns
-    SLUG_QUALITY_PATTERNS = {
-        # Long, hyphenated slugs (like "atv-off-highway-vehicle-safety-awareness-month-3")
-        r'[-\w]{20,}': 3,  # Slugs with 20+ characters
-        r'\w+-\w+-\w+-\w+': 2,  # At least 4 words separated by hyphens
-        r'-\d+/?$': 1,  # Ends with a number (version/part indicator)
-        
-        # Specific content patterns
-        r'(safety|awareness|education|training|program|initiative)': 1,
-        r'(guide|tips|advice|how-to|faq)': 2,
-    }
-    
-    # Domain-specific bonuses
-    DOMAIN_BONUSES = {
-        '.gov': 1,  # Government sites often have articles without typical indicators
-        '.edu': 1,  # Educational sites similar pattern
-        '.org': 0.5,  # Non-profits sometimes similar
-    }
-    
-    MIN_PATH_SEGMENTS = 2
-    MIN_ARTICLE_SCORE_THRESHOLD = 5
-    
-    likely_articles_with_scores = []
-    
-    for url in urls_list:
-        current_score = 0
-        parsed_url = urlparse(url)
-        path = parsed_url.path.strip('/')
-        domain = parsed_url.netloc.lower()
-        
-        # Path segment count heuristic
-        path_segments = path.split('/') if path else []
-        path_segments_count = len(path_segments)
-        
-        # Check for domain-specific bonuses
-        for domain_pattern, bonus in DOMAIN_BONUSES.items():
-            if domain.endswith(domain_pattern):
-                current_score += bonus
-                
-        # Apply Positive Indicators
-        for indicator, weight in ARTICLE_INDICATORS_WEIGHTS.items():
-            if indicator.startswith(r'/') and indicator.endswith(r'/'):  # Regex pattern
-                if re.search(indicator, url):
-                    current_score += weight
-            elif indicator in url.lower():  # Case-insensitive string check
-                # Check for whole segment match for better accuracy
-                if f'/{indicator}/' in url or url.endswith(f'/{indicator}') or url.startswith(f'{indicator}/'):
-                    current_score += weight
-                    
-        # Apply slug quality patterns
-        if path_segments:
-            last_segment = path_segments[-1]
-            for pattern, weight in SLUG_QUALITY_PATTERNS.items():
-                if re.search(pattern, last_segment, re.IGNORECASE):
-                    current_score += weight
-                    
-            # Bonus for slugs that look like titles (multiple hyphenated words)
-            hyphen_count = last_segment.count('-')
-            if hyphen_count >= 3:
-                current_score += min(hyphen_count - 2, 3)  # Cap at +3
-                
-        # Apply Negative Indicators
-        for indicator, weight in NON_ARTICLE_INDICATORS_WEIGHTS.items():
-            if indicator.startswith(r'/') and indicator.endswith(r'/'):  # Regex pattern
-                if re.search(indicator, url):
-                    current_score += weight
-            elif indicator in url.lower():  # Case-insensitive string check
-                if (f'/{indicator}/' in url or url.endswith(f'/{indicator}') or url.startswith(f'{indicator}/') or
-                    (indicator == '#' and '#' in url) or
-                    (indicator == '/page/' and re.search(r'/page/\d+', url))):
-                    current_score += weight
-                    
-        # Apply Minimum Path Segment Length Heuristic
-        if path_segments_count < MIN_PATH_SEGMENTS:
-            current_score -= 3
-        elif path_segments_count > MIN_PATH_SEGMENTS + 1:
-            current_score += min(path_segments_count - MIN_PATH_SEGMENTS, 2)
-            
-        # Special case: if URL has no typical article indicators but has a long, descriptive slug
-        if current_score < MIN_ARTICLE_SCORE_THRESHOLD and path_segments:
-            last_segment = path_segments[-1]
-            # Check if it's a long, descriptive slug (like your example)
-            if len(last_segment) > 30 and '-' in last_segment:
-                word_count = len(last_segment.split('-'))
-                if word_count >= 5:
-                    current_score += 3  # Significant boost for long, descriptive slugs
-                    
-        # Final Filtering
-        if current_score >= MIN_ARTICLE_SCORE_THRESHOLD:
-            likely_articles_with_scores.append({'url': url, 'score': current_score})
-            
-    # Sort results by score in descending order
-    likely_articles_with_scores.sort(key=lambda x: x['score'], reverse=True)
-    
-    return likely_articles_with_scores
 
 def is_relative_url(url):
     """
@@ -216,26 +49,120 @@ def is_relative_url(url):
     # A relative URL won't have a netloc (domain) or scheme (http/https)
     return not (parsed.netloc or parsed.scheme)
 
+# The cleaners below give the same results as the regular expressions in
+# their comments, but scan with str.find and never look at a character
+# twice, so malformed HTML (an unclosed <script, a line full of '<') can't
+# make them quadratic the way the backtracking patterns are.
+
+def strip_script_blocks(text):
+    # re.sub(r'<script.*?>.*?</script>', '', text, flags=re.DOTALL)
+    parts = []
+    position = 0
+    start = text.find('<script')
+    while start != -1:
+        tag_end = text.find('>', start + 7)
+        if tag_end == -1:
+            break
+        close = text.find('</script>', tag_end + 1)
+        if close == -1:
+            # No later <script can be closed either
+            break
+        parts.append(text[position:start])
+        position = close + 9
+        start = text.find('<script', position)
+    if not parts:
+        return text
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+def strip_line_tags(text):
+    # re.sub(r'<.*?>', '', text): a tag ends at the first '>' on its line
+    parts = []
+    position = 0
+    tag_end = -1
+    start = text.find('<')
+    while start != -1:
+        if tag_end <= start:
+            tag_end = text.find('>', start + 1)
+            if tag_end == -1:
+                break
+        newline = text.find('\n', start + 1, tag_end)
+        if newline != -1:
+            # Nothing before the newline can reach this '>'
+            start = text.find('<', newline + 1)
+            continue
+        parts.append(text[position:start])
+        position = tag_end + 1
+        start = text.find('<', position)
+    if not parts:
+        return text
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+def strip_tags(text):
+    # w3lib.html.remove_tags(text), i.e. re.sub(r'</?([^ >/]+).*?>', '', text, flags=re.DOTALL)
+    parts = []
+    position = 0
+    tag_end = -1
+    length = len(text)
+    start = text.find('<')
+    while start != -1:
+        name = start + 1
+        if name < length and text[name] == '/':
+            name += 1
+        if name >= length or text[name] in ' >/':
+            start = text.find('<', start + 1)
+            continue
+        if tag_end <= name:
+            tag_end = text.find('>', name + 1)
+            if tag_end == -1:
+                break
+        parts.append(text[position:start])
+        position = tag_end + 1
+        start = text.find('<', position)
+    if not parts:
+        return text
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
 def remove_script_tags(text):
     # Remove JavaScript code
-    text = re.sub(r'<script.*?>.*?</script>', '', text, flags=re.DOTALL)
-    
+    text = strip_script_blocks(text)
+
     # Remove HTML tags
-    text = re.sub(r'<.*?>', '', text)
-    
+    text = strip_line_tags(text)
+
     # Decode HTML entities like &#8230;
     text = html.unescape(text)
-    
+
     return text
 
 def clean_text(text):
     # Split by 'Tags' and take only the content before it
-    main_content = text.split('Tags')[0]
-    
+    end = text.find('Tags')
+    if end != -1:
+        text = text[:end]
+
     # Remove extra whitespace, newlines and tabs
-    cleaned = ' '.join(main_content.split())
-    
-    return cleaned.strip()
+    return ' '.join(text.split())
+
+
+def clean_html_text(value):
+    """
+    What NewsCrawlerPipeline does to HTML-ish text fields: unescape, drop
+    scripts and tags, unescape again (entities can spell out new tags),
+    drop tags once more and normalize whitespace. Linear in len(value).
+    """
+    return clean_text(strip_tags(remove_script_tags(html.unescape(value))))
+
+@lru_cache(maxsize=None)
+def get_timezone(name):
+    import pytz
+    return pytz.timezone(name)
+
 
 def convert_to_utc(date_string):
     """
@@ -243,6 +170,8 @@ def convert_to_utc(date_string):
     If the string has no timezone info, it assumes local time and converts to UTC.
     If it already has timezone info, it converts that to UTC.
     """
+    import dateutil.parser
+
     # Parse the date string
     dt = dateutil.parser.parse(date_string)
     
@@ -250,16 +179,125 @@ def convert_to_utc(date_string):
     if dt.tzinfo is None:
         # If no timezone info, assume it's in local time
         # and add the local timezone
-        local_tz = pytz.timezone('America/New_York')  # Change to your local timezone
+        local_tz = get_timezone('America/New_York')  # Change to your local timezone
         dt = local_tz.localize(dt)
     
     # Convert to UTC
-    utc_dt = dt.astimezone(pytz.UTC)
+    utc_dt = dt.astimezone(get_timezone('UTC'))
     
     return utc_dt
 
 
+# Formats a source may be learned to use. Only ones that read a value the
+# same way dateutil does are kept (no day-first %d/%m/%Y), and a format is
+# only learned after it gave dateutil's result on a real value.
+DATE_FORMATS = (
+    '%B %d, %Y',
+    '%b %d, %Y',
+    '%b. %d, %Y',
+    '%A, %B %d, %Y',
+    '%d %B %Y',
+    '%m/%d/%Y',
+    '%Y/%m/%d',
+    '%B %d, %Y %I:%M %p',
+    '%m/%d/%Y %I:%M %p',
+    '%a, %d %b %Y %H:%M:%S %z',
+)
+
+
+class DateNormalizer:
+    """
+    Parses created_at strings into datetimes, as dateutil.parser.parse
+    would, without calling dateutil for the common cases:
+
+    1. values that start with YYYY-MM-DD (most of what trafilatura returns)
+       go through datetime.fromisoformat;
+    2. otherwise the strptime formats learned for the value's source are
+       tried, most recently used first;
+    3. dateutil is the fallback; when it succeeds, the first DATE_FORMATS
+       entry that gives the same datetime is learned for the source.
+
+    With a `timezone` name, naive results are localized to it and converted
+    to UTC; without one they stay naive. Results are memoized, so a date
+    repeated across a source's articles is only parsed once.
+    """
+
+    def __init__(self, cache_size=4096, formats=DATE_FORMATS, formats_per_source=4):
+        self.formats = formats
+        self.formats_per_source = formats_per_source
+        self.source_formats = {}
+        self.counts = Counter()
+        self._normalize_cached = lru_cache(maxsize=cache_size)(self._normalize)
+
+    def parse(self, value, source=None):
+        value = value.strip()
+        if len(value) >= 10 and value[4] == '-' and value[7] == '-':
+            try:
+                parsed = datetime.fromisoformat(value)
+            except ValueError:
+                pass
+            else:
+                self.counts['iso'] += 1
+                return parsed
+
+        formats = self.source_formats.get(source)
+        if formats:
+            for date_format in formats:
+                try:
+                    parsed = datetime.strptime(value, date_format)
+                except ValueError:
+                    continue
+                formats.move_to_end(date_format, last=False)
+                self.counts['learned'] += 1
+                return parsed
+
+        import dateutil.parser
+        parsed = dateutil.parser.parse(value)
+        self.counts['dateutil'] += 1
+        self._learn(value, source, parsed)
+        return parsed
+
+    def _learn(self, value, source, parsed):
+        formats = self.source_formats.setdefault(source, OrderedDict())
+        for date_format in self.formats:
+            if date_format in formats:
+                continue
+            try:
+                candidate = datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+            if candidate == parsed and candidate.utcoffset() == parsed.utcoffset():
+                formats[date_format] = True
+                formats.move_to_end(date_format, last=False)
+                while len(formats) > self.formats_per_source:
+                    formats.popitem()
+                return
+
+    def normalize(self, value, source=None, timezone=None):
+        """Returns `value` as a datetime, or None for a missing value."""
+        if not value:
+            return None
+        return self._normalize_cached(value, source, timezone)
+
+    def _normalize(self, value, source, timezone):
+        parsed = self.parse(value, source)
+        if timezone:
+            if parsed.tzinfo is None:
+                parsed = get_timezone(timezone).localize(parsed)
+            parsed = parsed.astimezone(get_timezone('UTC'))
+        return parsed
+
+
 class NewsCrawlerPipeline:
+    """
+    Cleans and normalizes the fields of scraped items. 'md' is left as it
+    is: it arrives as markdown already, rendered from the same trafilatura
+    parse as the other fields (see extraction.py).
+    """
+
+    def __init__(self):
+        self.dates = DateNormalizer()
+
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
         field_names = adapter.field_names()
@@ -268,19 +306,22 @@ class NewsCrawlerPipeline:
             if field_name in adapter:
                 if field_name == 'created_at':
                     value = adapter[field_name]
-                    adapter[field_name] = dateutil.parser.parse(value)
+                    source = adapter.get('collection_name')
+                    # Per-source 'timezone' key from html/*.json, see GovNewsSpider.source_requests
+                    timezone = getattr(spider, 'source_timezones', {}).get(source)
+                    adapter[field_name] = self.dates.normalize(value, source, timezone)
                 if field_name == 'description':
                     value = adapter[field_name]
-                    adapter[field_name] = clean_text(remove_tags(remove_script_tags(html.unescape(value))))
+                    adapter[field_name] = clean_html_text(value)
                 if field_name == 'encoded':
                     value = adapter[field_name]
-                    adapter[field_name] = clean_text(remove_tags(remove_script_tags(html.unescape(value))))
+                    adapter[field_name] = clean_html_text(value)
                 if field_name == 'source_text':
                     value = adapter[field_name]
-                    adapter[field_name] = json.dumps(clean_text(remove_tags(remove_script_tags(html.unescape(value)))))
+                    adapter[field_name] = json.dumps(clean_html_text(value))
                 if field_name == 'response':
                     value = adapter[field_name]
-                    adapter[field_name] = json.dumps(clean_text(remove_tags(remove_script_tags(html.unescape(value)))))
+                    adapter[field_name] = json.dumps(clean_html_text(value))
                 if field_name == 'title':
                     value = adapter[field_name]
                     adapter[field_name] = value.lstrip().rstrip()
@@ -288,97 +329,340 @@ class NewsCrawlerPipeline:
                     value = adapter[field_name]
 
                     adapter[field_name] = ' '.join(value.split())
-                if field_name == 'md':
-                    value = adapter.get(field_name)
-                    if value:
-                        doc = Document(value)
-                        clean_html = doc.summary()
-                        adapter[field_name] = md(clean_html)
         return item
-    
-class WriteToDbPipeline:
 
-    def __init__(self):
-        POSTGRES_USERNAME = get_project_settings().get('POSTGRES_USERNAME')
-        POSTGRES_PASS = get_project_settings().get('POSTGRES_PASSWORD')
-        POSTGRES_ADDRESS = get_project_settings().get('POSTGRES_ADDRESS')
-        POSTGRES_PORT = get_project_settings().get('POSTGRES_PORT')
-        POSTGRES_DBNAME = get_project_settings().get('POSTGRES_DBNAME')
-
-        self.schema = "united_states_of_america"
-        self.connection = psycopg2.connect(
-            user=POSTGRES_USERNAME,
-            password=POSTGRES_PASS,
-            host=POSTGRES_ADDRESS,
-            port=POSTGRES_PORT,
-            database=POSTGRES_DBNAME
+
+class NearDuplicatePipeline:
+    """
+    Drops articles whose text is a near-duplicate of one already stored,
+    the same press release under another URL or syndicated by another
+    agency, before they reach the database and send a notification.
+
+    Signatures of the 'md' text (or the description) go to a
+    NearDuplicateIndex as items pass, and the item keeps its index row in
+    `near_duplicate_id`; items dropped or failing further down the
+    pipeline are taken out again. In "link" mode duplicates are kept with
+    `duplicate_of` set to the URL of the first copy (the table needs a
+    duplicate_of column) and never ask for a notification.
+
+    Settings:
+        NEAR_DUPLICATES_ENABLED    default True
+        NEAR_DUPLICATES_PATH       index location, relative paths live in .scrapy
+        NEAR_DUPLICATES_MODE       "drop" or "link"
+        NEAR_DUPLICATES_THRESHOLD  estimated share of common word 3-grams, default 0.8
+        NEAR_DUPLICATES_MIN_WORDS  shorter texts are never compared
+
+    Stats:
+        near_duplicates/checked, near_duplicates/found, near_duplicates/short,
+        near_duplicates/removed
+    """
+
+    def __init__(self, index, mode='drop', min_words=50, stats=None):
+        if mode not in ('drop', 'link'):
+            raise ValueError(f"NEAR_DUPLICATES_MODE must be 'drop' or 'link', not {mode!r}")
+        self.index = index
+        self.mode = mode
+        self.min_words = min_words
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('NEAR_DUPLICATES_ENABLED', True):
+            raise NotConfigured
+        pipeline = cls(
+            NearDuplicateIndex(
+                data_path(settings.get('NEAR_DUPLICATES_PATH', 'near_duplicates.sqlite')),
+                threshold=settings.getfloat('NEAR_DUPLICATES_THRESHOLD', 0.8),
+                timeout=store_timeout(settings),
+            ),
+            mode=settings.get('NEAR_DUPLICATES_MODE', 'drop'),
+            min_words=settings.getint('NEAR_DUPLICATES_MIN_WORDS', 50),
+            stats=crawler.stats,
         )
-        self.cur = self.connection.cursor()
+        crawler.signals.connect(pipeline.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(pipeline.item_error, signal=signals.item_error)
+        return pipeline
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        text = adapter.get('md') or adapter.get('description') or ''
+        if len(text.split()) < self.min_words:
+            self.stats.inc_value('near_duplicates/short')
+            return item
+        signature = minhash_signature(text)
+        self.stats.inc_value('near_duplicates/checked')
+        # An article fetched again (a newer lastmod, a recrawl) isn't a copy of itself
+        match = self.index.find(signature, adapter.get('url'))
+        if match is None:
+            doc_id = self.index.add(signature, adapter.get('url'))
+            if 'near_duplicate_id' in adapter.field_names():
+                adapter['near_duplicate_id'] = doc_id
+            return item
+
+        _, duplicate_of, score = match
+        self.stats.inc_value('near_duplicates/found')
+        if self.mode == 'drop':
+            raise DropItem(f"Near-duplicate ({score:.0%}) of {duplicate_of}")
+        adapter['duplicate_of'] = duplicate_of
+        if 'notification' in adapter.field_names():
+            adapter['notification'] = False
+        return item
+
+    def item_dropped(self, item, response, exception, spider):
+        self.forget(item)
+
+    def item_error(self, item, response, spider, failure):
+        self.forget(item)
+
+    def forget(self, item):
+        # WriteToDbPipeline hands on a NotificationModel, without the field, once the item is stored
+        doc_id = ItemAdapter(item).get('near_duplicate_id')
+        if doc_id is not None:
+            # Not stored after all, so later copies aren't duplicates of it
+            self.index.remove(doc_id)
+            self.stats.inc_value('near_duplicates/removed')
+
+    def close_spider(self, spider):
+        self.index.close()
+
+
+class WriteToDbPipeline:
+    """
+    Writes items to Postgres in batches.
+
+    Items are buffered per `schema.table_name` (and column set) and written
+    with a single multi-row INSERT ... RETURNING id once DB_BATCH_SIZE items
+    are waiting, or every DB_FLUSH_INTERVAL seconds, and whatever is left
+    is flushed when the spider closes. Writes run in the reactor thread pool
+    on connections taken from a pool of at most DB_POOL_SIZE connections, so
+    the crawl never waits on Postgres. Each item resolves once its batch is
+    committed, to a NotificationModel when the item asks for a notification.
+
+    The schema's tables and columns are read once when the spider opens
+    (see SchemaCache) and every item is checked against them before it is
+    buffered. With DB_AUTO_DDL, missing tables and columns are added in one
+    transaction ahead of the first write that needs them; without it, such
+    items are dropped right away. When a batch fails for any other reason,
+    such as a constraint violation or a bad value, its halves are written
+    again on their own until only the failing rows are left, and only
+    those items are dropped.
+    """
+
+    def __init__(self, settings):
+        self.schema = settings.get('DB_SCHEMA', 'united_states_of_america')
+        self.default_table_name = settings.get('DB_TABLE_NAME', 'article_objects')
+        self.batch_size = settings.getint('DB_BATCH_SIZE', 100)
+        self.flush_interval = settings.getfloat('DB_FLUSH_INTERVAL', 5.0)
+        self.pool_size = settings.getint('DB_POOL_SIZE', 4)
+        self.auto_ddl = settings.getbool('DB_AUTO_DDL', True)
+        self.connection_kwargs = {
+            'user': settings.get('POSTGRES_USERNAME'),
+            'password': settings.get('POSTGRES_PASSWORD'),
+            'host': settings.get('POSTGRES_ADDRESS'),
+            'port': settings.get('POSTGRES_PORT'),
+            'database': settings.get('POSTGRES_DBNAME'),
+        }
+        if settings.getint('SHARD_COUNT', 1) > 1:
+            # Every worker has its own writer, labelled in pg_stat_activity
+            self.connection_kwargs['application_name'] = f"news_crawler shard {settings.getint('SHARD_INDEX')}"
+        self.buffers = {}
+        self.pool = None
+        self.schema_cache = None
+        self.flush_loop = None
+        # Never run more flushes at once than there are pooled connections
+        self.write_slots = defer.DeferredSemaphore(self.pool_size)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+    def open_spider(self, spider):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self.pool = ThreadedConnectionPool(1, self.pool_size, **self.connection_kwargs)
+        connection = self.pool.getconn()
+        try:
+            self.schema_cache = SchemaCache.load(connection, self.schema)
+        finally:
+            self.pool.putconn(connection)
+        self.flush_loop = task.LoopingCall(self.flush_all)
+        self.flush_loop.start(self.flush_interval, now=False)
 
     def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        table_name = (adapter.get('table_name') or self.default_table_name).lower().replace(' ', '_')
+        row = {key: value for key, value in adapter.items()
+               if key != 'notification' and adapter.get_field_meta(key).get('store', True)
+               and not (value is None and adapter.get_field_meta(key).get('omit_if_none'))}
+        if self.auto_ddl:
+            self.schema_cache.plan(table_name, row)
+        else:
+            exists, missing = self.schema_cache.missing(table_name, row)
+            if not exists:
+                logging.critical(f"The table {self.schema}.{table_name} does not exist.")
+                raise DropItem(f"Table {self.schema}.{table_name} does not exist")
+            if missing:
+                logging.critical(f"The columns {', '.join(missing)} do not exist for table: {table_name}.")
+                raise DropItem(f"Columns {', '.join(missing)} missing from {self.schema}.{table_name}")
+
+        result = defer.Deferred()
+        key = (table_name, tuple(row))
+        buffer = self.buffers.setdefault(key, [])
+        buffer.append((row, adapter, result))
+        if len(buffer) >= self.batch_size:
+            self.flush(key)
+        return result
+
+    def flush(self, key):
+        batch = self.buffers.pop(key, None)
+        if not batch:
+            return defer.succeed(None)
+        table_name, columns = key
+        return self.write_batch(table_name, columns, batch)
+
+    def write_batch(self, table_name, columns, batch):
+        rows = [row for row, _, _ in batch]
+        write = self.write_slots.run(threads.deferToThread, self.write_rows, table_name, columns, rows)
+        write.addCallbacks(self._batch_written, self._batch_failed,
+                           callbackArgs=(table_name, batch), errbackArgs=(table_name, columns, batch))
+        return write
 
-        item_with_notification = item.copy()
-        table_name = item['table_name'].lower().replace(' ', '_')
+    def flush_all(self):
+        return defer.DeferredList([self.flush(key) for key in list(self.buffers)])
+
+    def write_rows(self, table_name, columns, rows):
+        """
+        Inserts `rows` (dicts keyed by `columns`) in one statement and returns
+        the new ids in row order. Runs in a worker thread.
+        """
+        from psycopg2 import sql
+        from psycopg2.extras import execute_values
+
+        query = sql.SQL("INSERT INTO {}.{} ({}) VALUES %s RETURNING id").format(
+            sql.Identifier(self.schema),
+            sql.Identifier(table_name),
+            sql.SQL(', ').join(map(sql.Identifier, columns)),
+        )
+        template = '(' + ', '.join('%({})s'.format(column) for column in columns) + ')'
+        connection = self.pool.getconn()
         try:
-            del item['notification']
-            logging.info('item after the delete', item)
-            columns = ', '.join(item.keys())
-            values = ', '.join('%({})s'.format(key) for key in item.keys())
-            query = f"INSERT INTO {self.schema}.{table_name} ({columns}) VALUES ({values}) RETURNING id"
-            # print(query)
-            self.cur.execute(query, item)
-            database_table_id = self.cur.fetchone()[0]
-            print(database_table_id, item)
-            logging.info('stored item with notification variable',item_with_notification)
-            if item_with_notification['notification'] == True:
-                self.connection.commit()
+            # Tables and columns planned by process_item, before the first row needing them
+            self.schema_cache.apply(connection)
+            with connection.cursor() as cur:
+                returned = execute_values(cur, query, rows, template=template,
+                                          page_size=len(rows), fetch=True)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            self.pool.putconn(connection)
+        return [database_table_id for (database_table_id,) in returned]
+
+    def _batch_written(self, database_table_ids, table_name, batch):
+        logging.info(f"Inserted {len(batch)} items to {self.schema}.{table_name}")
+        for (row, adapter, result), database_table_id in zip(batch, database_table_ids):
+            if adapter.get('notification') == True:
                 logging.info('This item requires a notification')
-                return NotificationModel(
+                result.callback(NotificationModel(
                     {
-                        'title': item_with_notification.get('title', None),
+                        'title': adapter.get('title', None),
                         'table_id': database_table_id,
                         'country_schema': self.schema,
                         'table_source_name': table_name,
-                        'image_url': item_with_notification.get('image_url', None),
-                        'description': item_with_notification.get('description', None),
-                        'topic': item_with_notification.get('topic', None),
-                        'collection_name': item_with_notification.get('collection_name', None),
-                        # 'notification': item_with_notification.get('notification', None)
+                        'image_url': adapter.get('image_url', None),
+                        'description': adapter.get('description', None),
+                        'topic': adapter.get('topic', None),
+                        'collection_name': adapter.get('collection_name', None),
                     }
-                )
+                ))
             else:
-                logging.info(f"Item inserted to {self.schema}.{table_name} with id {database_table_id}")
-                self.connection.commit()
-        except errors.UndefinedTable as e:
-            self.does_table_exist(item)
-            # Handle the UndefinedTable exception here
-            logging.critical(f"{e}: The table {table_name} does not exist.")
-            return None
-        except errors.UndefinedColumn as e:
-            error_msg = str(e)
-            match = re.search(r'column "([^"]+)" of relation', error_msg)
-
-            if match:
-                undefined_column = match.group(1)
-                print(undefined_column)
-                self.column_does_not_exist(item,undefined_column)
-                logging.critical(f"The column {undefined_column} does not exist for table: {table_name}.")
-
-                return None
-        except psycopg2.Error as e:
-                
-            self.connection.rollback()
-            logging.critical("Error: ", e)
-
-        except psycopg2.ProgrammingError as e:
-            if "can't adapt type 'Tag'" in str(e):
-                print("Error: Cannot convert Tag object to database format. Please convert to string or other basic type first.")
-                # Optional: print more details about the Tag object
-                print(f"Problematic Tag object: ")
+                result.callback(adapter.item)
+
+    def _batch_failed(self, failure, table_name, columns, batch):
+        from psycopg2 import errors
+
+        error = failure.value
+        if isinstance(error, (errors.UndefinedTable, errors.UndefinedColumn)):
+            # Changed under us since the spider opened: check the table again for the next items
+            self.schema_cache.forget(table_name)
+        elif len(batch) > 1:
+            # Most likely one bad row, which shouldn't take the rest of the batch with it
+            logging.warning(f"Error writing {len(batch)} items to {self.schema}.{table_name}, "
+                            f"writing them in two halves: {error}")
+            middle = len(batch) // 2
+            return defer.DeferredList([
+                self.write_batch(table_name, columns, batch[:middle]),
+                self.write_batch(table_name, columns, batch[middle:]),
+            ])
+        logging.critical(f"Error writing {len(batch)} items to {self.schema}.{table_name}: {error}")
+        for _, _, result in batch:
+            result.errback(DropItem(f"Database write failed: {error}"))
+
+    @defer.inlineCallbacks
+    def close_spider(self, spider):
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+        yield self.flush_all()
+        if self.pool is not None:
+            self.pool.closeall()
+
+
+class NotificationPipeline:
+    """
+    Hands the NotificationModel items WriteToDbPipeline returns to a
+    NotificationQueue, which coalesces them per collection and topic and
+    delivers them in the background, so the crawl doesn't wait on the
+    notification service. Items are passed on unchanged; they only wait
+    here while NOTIFICATIONS_MAX_PENDING notifications are undelivered.
+    Remaining notifications are sent when the spider closes.
+
+    Settings:
+        NOTIFICATIONS_ENABLED        default True, needs NOTIFICATIONS_URL for the HTTP sink
+        NOTIFICATIONS_SINK           sink class, default news_crawler.notifications.HttpNotificationSink
+        NOTIFICATIONS_URL            endpoint the HTTP sink POSTs batches to
+        NOTIFICATIONS_WINDOW         seconds a collection/topic group is held before sending
+        NOTIFICATIONS_BATCH_SIZE     a group this large is sent at once
+        NOTIFICATIONS_MAX_PENDING    undelivered notifications before items wait
+        NOTIFICATIONS_CONCURRENCY    batches in flight
+        NOTIFICATIONS_RETRY_TIMES    retries of a failed batch, NOTIFICATIONS_RETRY_BACKOFF
+                                     seconds apart, doubling
+
+    Stats:
+        notifications/queued, notifications/coalesced, notifications/batches,
+        notifications/delivered, notifications/retries, notifications/failed,
+        notifications/backpressure, notifications/pending_max
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('NOTIFICATIONS_ENABLED', True):
+            raise NotConfigured
+        sink_class = load_object(settings.get('NOTIFICATIONS_SINK',
+                                              'news_crawler.notifications.HttpNotificationSink'))
+        queue = NotificationQueue(
+            build_from_crawler(sink_class, crawler),
+            crawler.stats,
+            window=settings.getfloat('NOTIFICATIONS_WINDOW', 2.0),
+            batch_size=settings.getint('NOTIFICATIONS_BATCH_SIZE', 50),
+            max_pending=settings.getint('NOTIFICATIONS_MAX_PENDING', 1000),
+            concurrency=settings.getint('NOTIFICATIONS_CONCURRENCY', 4),
+            retry_times=settings.getint('NOTIFICATIONS_RETRY_TIMES', 3),
+            retry_backoff=settings.getfloat('NOTIFICATIONS_RETRY_BACKOFF', 1.0),
+        )
+        return cls(queue)
+
+    def process_item(self, item, spider):
+        if not isinstance(item, NotificationModel):
+            return item
+        accepted = self.queue.put(ItemAdapter(item).asdict())
+        accepted.addCallback(lambda _: item)
+        return accepted
 
-            else:
-                # Handle other programming errors
-                print(f"Database programming error: {e}")
     def close_spider(self, spider):
-        self.cur.close()
-        self.connection.close()
\ No newline at end of file
+        return self.queue.close()
@@ -0,0 +1,311 @@
+# URL ranking
+#
+# Scores the links of a listing page by how likely they are to be
+# articles. The spider needs it for every listing it parses, and it only
+# depends on the standard library, so it lives apart from the item
+# pipelines and their database and date-parsing dependencies: importing it
+# doesn't load any of them.
+
+import calendar
+import heapq
+import re
+from datetime import date
+from functools import lru_cache
+from urllib.parse import urlparse
+
+# --- URL ranking configuration ---
+ARTICLE_INDICATORS_WEIGHTS = {
+    # Regex patterns for dates (strong positive signals)
+    r'/\d{4}/\d{2}/\d{2}/': 5,  # /YYYY/MM/DD/
+    r'/\d{4}-\d{2}-\d{2}/': 5,   # /YYYY-MM-DD/
+    r'/\d{4}/\d{2}/': 2,         # /YYYY/MM/ (weaker, usually needs a slug after)
+
+    # Common content type slugs (string segments)
+    'article': 4,
+    'issues': 4,
+    'blog': 4,
+    'news': 3,
+    'post': 3,
+    'story': 3,
+    'media': 3,
+    'press-release': 3,
+    'media-release': 3,
+    'speech': 3,
+    'report': 3,
+    'paper': 3,
+    'document': 2,
+    'publication': 2,
+    'release': 2,
+
+    # Government/official content patterns
+    'announcement': 3,
+    'update': 2,
+    'statement': 3,
+    'advisory': 3,
+    'notice': 2,
+    'bulletin': 3,
+
+    # Event/time-sensitive indicators
+    'month': 2,  # like "safety-awareness-month"
+    'week': 2,   # like "national-xyz-week"
+    'day': 2,    # like "international-xyz-day"
+    'annual': 2,
+    '2024': 2,   # Current/recent year
+    '2025': 2,
+    '2023': 1,   # Slightly older years
+}
+
+NON_ARTICLE_INDICATORS_WEIGHTS = {
+    # Common navigational/category terms
+    'category': -3,
+    'tag': -3,
+    'archive': -2,
+    '/page/': -2,
+    'list': -2,
+    'search': -3,
+    'collection': -2,
+    'series': -2,
+    'topic': -2,
+
+    # Common administrative/site structure terms
+    'about': -1,
+    'contact': -1,
+    'privacy': -1,
+    'terms': -1,
+    'dashboard': -4,
+    'admin': -5,
+    'login': -5,
+    'signup': -3,
+    'cart': -2,
+    'checkout': -2,
+    'sitemap': -2,
+    'feed': -1,
+    'json': -1,
+    'xml': -1,
+    'amp': -1,
+    'main-content': -3,
+
+    # Index/home pages
+    'index': -2,
+    'home': -2,
+    'default': -2,
+}
+
+# Additional slug quality patterns
+SLUG_QUALITY_PATTERNS = {
+    # Long, hyphenated slugs (like "atv-off-highway-vehicle-safety-awareness-month-3")
+    r'[-\w]{20,}': 3,  # Slugs with 20+ characters
+    r'\w+-\w+-\w+-\w+': 2,  # At least 4 words separated by hyphens
+    r'-\d+/?$': 1,  # Ends with a number (version/part indicator)
+
+    # Specific content patterns
+    r'(safety|awareness|education|training|program|initiative)': 1,
+    r'(guide|tips|advice|how-to|faq)': 2,
+}
+
+# Domain-specific bonuses
+DOMAIN_BONUSES = {
+    '.gov': 1,  # Government sites often have articles without typical indicators
+    '.edu': 1,  # Educational sites similar pattern
+    '.org': 0.5,  # Non-profits sometimes similar
+}
+
+MIN_PATH_SEGMENTS = 2
+MIN_ARTICLE_SCORE_THRESHOLD = 5
+
+# The date patterns of ARTICLE_INDICATORS_WEIGHTS in one: /YYYY/MM/DD/, /YYYY-MM-DD/, /YYYY/MM/
+_URL_DATE_RE = re.compile(r'/(\d{4})(?:/(\d{2})(?:/(\d{2}))?|-(\d{2})-(\d{2}))/')
+
+_HTTP_URL_RE = re.compile(r'https?://([^/?#]*)([^?#]*)', re.IGNORECASE)
+_UNSAFE_URL_CHARS_RE = re.compile(r'[\x00-\x20\[\]]')
+
+
+def _split_netloc_path(url):
+    """
+    Returns the (netloc, path) pair `urlparse` would give for `url`, without
+    the overhead of building a full ParseResult for plain http(s) links.
+    """
+    match = _HTTP_URL_RE.match(url)
+    if match is None or _UNSAFE_URL_CHARS_RE.search(url):
+        parsed_url = urlparse(url)
+        return parsed_url.netloc, parsed_url.path
+    netloc, path = match.groups()
+    # urlparse moves ";params" of the last path segment out of the path
+    params_start = path.find(';', path.rfind('/'))
+    if params_start >= 0:
+        path = path[:params_start]
+    return netloc, path
+
+
+def url_date(url):
+    """
+    The date in a URL's path (/YYYY/MM/DD/, /YYYY-MM-DD/ or /YYYY/MM/), or
+    None. For a month only, its last day: the latest the page can be from.
+    """
+    for match in _URL_DATE_RE.finditer(url):
+        year, month, day, dashed_month, dashed_day = match.groups()
+        try:
+            if dashed_month:
+                return date(int(year), int(dashed_month), int(dashed_day))
+            year, month = int(year), int(month)
+            if not day:
+                return date(year, month, calendar.monthrange(year, month)[1])
+            return date(year, month, int(day))
+        except ValueError:
+            # /2024/13/ is not a date, maybe a later part of the URL is
+            continue
+    return None
+
+
+class UrlRanker:
+    """
+    Scores URLs by how likely they are to be individual articles.
+
+    All indicator tables are prepared once, so a single instance should be
+    built at startup and reused for every listing page. Keyword indicators
+    only count when they are a whole path segment (`/news/`, a trailing
+    `/news` or a leading `news/`), which means they can be merged into one
+    segment -> weight lookup instead of being searched for one by one.
+    Regex indicators (the ones wrapped in slashes) are compiled up front.
+    """
+
+    def __init__(self, article_indicators=None, non_article_indicators=None,
+                 slug_patterns=None, domain_bonuses=None,
+                 min_path_segments=MIN_PATH_SEGMENTS,
+                 min_score=MIN_ARTICLE_SCORE_THRESHOLD, cache_size=65536):
+        if article_indicators is None:
+            article_indicators = ARTICLE_INDICATORS_WEIGHTS
+        if non_article_indicators is None:
+            non_article_indicators = NON_ARTICLE_INDICATORS_WEIGHTS
+        if slug_patterns is None:
+            slug_patterns = SLUG_QUALITY_PATTERNS
+        if domain_bonuses is None:
+            domain_bonuses = DOMAIN_BONUSES
+
+        self.url_patterns = []
+        self.segment_weights = {}
+        for indicators in (article_indicators, non_article_indicators):
+            for indicator, weight in indicators.items():
+                if indicator.startswith('/') and indicator.endswith('/'):
+                    self.url_patterns.append((re.compile(indicator), weight))
+                else:
+                    self.segment_weights[indicator] = self.segment_weights.get(indicator, 0) + weight
+
+        self.slug_patterns = [(re.compile(pattern, re.IGNORECASE), weight)
+                              for pattern, weight in slug_patterns.items()]
+        self.domain_bonuses = list(domain_bonuses.items())
+        self.min_path_segments = min_path_segments
+        self.min_score = min_score
+
+        # Navigation links repeat on every page of a site, so remember scores
+        if cache_size:
+            self.score = lru_cache(maxsize=cache_size)(self.score)
+            self.url_date = lru_cache(maxsize=cache_size)(url_date)
+        else:
+            self.url_date = url_date
+
+    def score(self, url):
+        current_score = 0
+        netloc, path = _split_netloc_path(url)
+        path = path.strip('/')
+        domain = netloc.lower()
+
+        path_segments = path.split('/') if path else []
+        path_segments_count = len(path_segments)
+
+        for domain_pattern, bonus in self.domain_bonuses:
+            if domain.endswith(domain_pattern):
+                current_score += bonus
+
+        for pattern, weight in self.url_patterns:
+            if pattern.search(url):
+                current_score += weight
+
+        # Every '/'-delimited part of the full URL is a candidate segment
+        parts = url.split('/')
+        if len(parts) > 1:
+            segment_weights = self.segment_weights
+            for part in set(parts):
+                weight = segment_weights.get(part)
+                if weight:
+                    current_score += weight
+
+        if path_segments:
+            last_segment = path_segments[-1]
+            for pattern, weight in self.slug_patterns:
+                if pattern.search(last_segment):
+                    current_score += weight
+
+            # Bonus for slugs that look like titles (multiple hyphenated words)
+            hyphen_count = last_segment.count('-')
+            if hyphen_count >= 3:
+                current_score += min(hyphen_count - 2, 3)  # Cap at +3
+
+        if path_segments_count < self.min_path_segments:
+            current_score -= 3
+        elif path_segments_count > self.min_path_segments + 1:
+            current_score += min(path_segments_count - self.min_path_segments, 2)
+
+        # Long, descriptive slugs without any other article indicator
+        if current_score < self.min_score and path_segments:
+            last_segment = path_segments[-1]
+            if len(last_segment) > 30 and '-' in last_segment:
+                if len(last_segment.split('-')) >= 5:
+                    current_score += 3
+
+        return current_score
+
+    def rank(self, urls_list):
+        """
+        Scores a batch of URLs and returns the ones above the threshold as
+        `{'url': ..., 'score': ...}` dicts, highest score first.
+        """
+        score = self.score
+        min_score = self.min_score
+        likely_articles_with_scores = []
+        for url in urls_list:
+            current_score = score(url)
+            if current_score >= min_score:
+                likely_articles_with_scores.append({'url': url, 'score': current_score})
+
+        likely_articles_with_scores.sort(key=lambda x: x['score'], reverse=True)
+        return likely_articles_with_scores
+
+    def candidates(self, urls_list, min_score=None):
+        """
+        The URLs scoring at least `min_score` (by default the threshold),
+        unordered, as `{'url': ..., 'score': ..., 'date': ...}` dicts, `date`
+        being url_date(url).
+        """
+        score = self.score
+        url_date = self.url_date
+        if min_score is None:
+            min_score = self.min_score
+        candidates = []
+        for url in urls_list:
+            current_score = score(url)
+            if current_score >= min_score:
+                candidates.append({'url': url, 'score': current_score, 'date': url_date(url)})
+        return candidates
+
+    def best(self, candidates, count):
+        """
+        The `count` best `candidates`, highest score first and, for equal
+        scores, the newest URL date first. Only those are ordered (heapq),
+        not the whole list.
+        """
+        return heapq.nlargest(count, candidates, key=lambda x: (x['score'], x['date'] or date.min))
+
+
+_default_ranker = None
+
+
+def rank_urls_for_articles(urls_list):
+    """
+    Ranks a list of URLs based on their likelihood of being individual articles,
+    and returns only the most likely ones.
+    """
+    global _default_ranker
+    if _default_ranker is None:
+        _default_ranker = UrlRanker()
+    return _default_ranker.rank(urls_list)
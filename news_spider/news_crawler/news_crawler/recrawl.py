@@ -0,0 +1,209 @@
+# Recrawl scheduling
+#
+# Every source used to be crawled once per run, whether it publishes
+# twenty releases a day or two a year, so most listing fetches found
+# nothing new while the busiest press offices were only checked once per
+# run. RecrawlScheduler learns how often each source publishes from the
+# created_at of the articles stored for it, and schedules its next crawl
+# for when about one new article is expected, checking rarely publishing
+# sources less often and busy ones more often. The next crawl times go to
+# the SourceRegistry, which hands out due sources in that order, and the
+# articles a source is expected to have published since its last crawl
+# become the priority of its requests.
+
+import logging
+import time
+from datetime import datetime, timezone
+
+from itemadapter import ItemAdapter
+from scrapy import signals
+
+logger = logging.getLogger(__name__)
+
+
+class SourceSchedule:
+    __slots__ = ('name', 'published', 'first_crawled_at', 'last_crawled_at', 'failures', 'next_due_at')
+
+    def __init__(self, name):
+        self.name = name
+        # (publication time, url) of the latest articles, oldest first
+        self.published = []
+        self.first_crawled_at = None
+        self.last_crawled_at = None
+        self.failures = 0
+        self.next_due_at = None
+
+
+class RecrawlScheduler:
+    """
+    Next crawl times and request priorities from each source's publish rate.
+
+    The rate is a Gamma-Poisson estimate: one article per `prior_interval`
+    to start with, plus the last `history` articles seen over the time since
+    the source was first crawled (or since the oldest of them, once there
+    are `history`), so a source that stops publishing slows down as empty
+    crawls pile up. Articles are told apart by URL, not by publication time:
+    trafilatura mostly gives dates without a time, and the releases a source
+    publishes on the same day all count. After a crawl the source is due
+    again once `target_new` new articles are expected, between
+    `min_interval` and `max_interval`; failed crawls back off exponentially
+    from there, up to 64 times. `clock` returns the current time, as
+    time.time does, so simulations can run on their own.
+
+    Settings:
+        RECRAWL_SCHEDULER_ENABLED   default True, needs SOURCES_REGISTRY_ENABLED
+        RECRAWL_MIN_INTERVAL / RECRAWL_MAX_INTERVAL   bounds of the recrawl interval, in seconds
+        RECRAWL_TARGET_NEW          new articles expected per crawl
+        RECRAWL_PRIOR_INTERVAL      seconds per article assumed for a source not seen publishing yet
+        RECRAWL_HISTORY             publication times kept per source
+        RECRAWL_MAX_PRIORITY        request priority cap
+
+    Stats:
+        recrawl/published (publication times learned), recrawl/priority_max
+    """
+
+    def __init__(self, min_interval=900.0, max_interval=7 * 86400.0, target_new=1.0, prior_interval=86400.0,
+                 history=50, max_priority=100, clock=time.time):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_new = target_new
+        self.prior_interval = prior_interval
+        self.history = history
+        self.max_priority = max_priority
+        self.clock = clock
+        self.sources = {}
+        self.registry = None
+        self.stats = None
+
+    @classmethod
+    def from_crawler(cls, crawler, registry):
+        settings = crawler.settings
+        if registry is None or not settings.getbool('RECRAWL_SCHEDULER_ENABLED', True):
+            return None
+        scheduler = cls(
+            min_interval=settings.getfloat('RECRAWL_MIN_INTERVAL', 900),
+            max_interval=settings.getfloat('RECRAWL_MAX_INTERVAL', 7 * 86400),
+            target_new=settings.getfloat('RECRAWL_TARGET_NEW', 1.0),
+            prior_interval=settings.getfloat('RECRAWL_PRIOR_INTERVAL', 86400),
+            history=settings.getint('RECRAWL_HISTORY', 50),
+            max_priority=settings.getint('RECRAWL_MAX_PRIORITY', 100),
+        )
+        scheduler.registry = registry
+        scheduler.crawler = crawler
+        for name, state in registry.states():
+            scheduler.load(name, **state)
+        for name, url, published_at in registry.publications():
+            scheduler.source(name).published.append((published_at, url))
+        crawler.signals.connect(scheduler.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(scheduler.item_scraped, signal=signals.item_scraped)
+        return scheduler
+
+    def spider_opened(self, spider):
+        self.stats = self.crawler.stats
+
+    def source(self, name):
+        source = self.sources.get(name)
+        if source is None:
+            source = self.sources[name] = SourceSchedule(name)
+        return source
+
+    def load(self, name, last_crawled_at=None, failures=0, next_due_at=None, first_crawled_at=None, **state):
+        source = self.source(name)
+        source.first_crawled_at = first_crawled_at or last_crawled_at
+        source.last_crawled_at = last_crawled_at
+        source.failures = failures or 0
+        source.next_due_at = next_due_at
+
+    def observe(self, name, url, published_at, now=None):
+        """
+        Learns that `name` published the article at `url` at `published_at`
+        (a timestamp); returns False when it was already known. Moves the
+        next crawl of a source crawled before to match the new rate.
+        """
+        now = self.clock() if now is None else now
+        source = self.source(name)
+        published = source.published
+        if published_at > now + 86400:
+            # A date in the future is a parsing mistake, not a publication
+            return False
+        if len(published) >= self.history and published_at < published[0][0]:
+            return False
+        if any(known_url == url for _, known_url in published):
+            return False
+        published.append((published_at, url))
+        published.sort()
+        del published[:-self.history]
+        if source.last_crawled_at is not None and not source.failures:
+            source.next_due_at = source.last_crawled_at + self.interval(name, now)
+        return True
+
+    def rate(self, name, now=None):
+        """Estimated articles per second."""
+        now = self.clock() if now is None else now
+        source = self.sources.get(name)
+        if source is None or not source.published:
+            since = source.first_crawled_at if source is not None else None
+            return 1 / (self.prior_interval + max(0.0, now - (since or now)))
+        published = source.published
+        oldest = published[0][0]
+        if len(published) >= self.history or source.first_crawled_at is None:
+            since, count = oldest, len(published) - 1
+        else:
+            since, count = min(oldest, source.first_crawled_at), len(published)
+        return (1 + count) / (self.prior_interval + max(0.0, now - since))
+
+    def interval(self, name, now=None):
+        """Seconds until `target_new` new articles are expected from `name`."""
+        interval = self.target_new / self.rate(name, now)
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def crawled(self, name, success, now=None):
+        """Records a crawl of `name`; returns when it is due again."""
+        now = self.clock() if now is None else now
+        source = self.source(name)
+        if source.first_crawled_at is None:
+            source.first_crawled_at = now
+        source.last_crawled_at = now
+        source.failures = 0 if success else source.failures + 1
+        source.next_due_at = now + self.interval(name, now) * 2 ** min(source.failures, 6)
+        return source.next_due_at
+
+    def is_due(self, name, now=None):
+        source = self.sources.get(name)
+        if source is None or source.next_due_at is None:
+            return True
+        return source.next_due_at <= (self.clock() if now is None else now)
+
+    def expected_new(self, name, now=None):
+        """Articles `name` is expected to have published since its last crawl."""
+        now = self.clock() if now is None else now
+        source = self.sources.get(name)
+        if source is None or source.last_crawled_at is None:
+            return self.target_new
+        return self.rate(name, now) * max(0.0, now - source.last_crawled_at)
+
+    def priority(self, name, now=None):
+        """Scrapy request priority for the requests of `name`: 10 per expected new article."""
+        priority = min(self.max_priority, round(10 * self.expected_new(name, now)))
+        if self.stats is not None:
+            self.stats.max_value('recrawl/priority_max', priority)
+        return priority
+
+    def item_scraped(self, item, response, spider):
+        adapter = ItemAdapter(item)
+        name = adapter.get('collection_name')
+        url = adapter.get('url')
+        created_at = adapter.get('created_at')
+        if not name or not url or not isinstance(created_at, datetime):
+            return
+        if created_at.tzinfo is None:
+            # Sources without a timezone key give naive dates, taken as UTC
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        published_at = created_at.timestamp()
+        if not self.observe(name, url, published_at):
+            return
+        if self.stats is not None:
+            self.stats.inc_value('recrawl/published')
+        self.registry.record_published(name, url, published_at, keep=self.history)
+        if self.sources[name].next_due_at is not None:
+            self.registry.reschedule(name, self.sources[name].next_due_at, self.rate(name))
@@ -0,0 +1,151 @@
+# Recorded responses
+#
+# Measuring the crawl against live sites mixes our own speed with the
+# sites', Zyte's and the network's, and costs API credits every time.
+# ResponseArchive keeps the responses of one crawl on disk so the same
+# crawl can be replayed offline as many times as needed (see
+# RecordReplayMiddleware and news_crawler/bench.py). Responses are appended
+# to segment files, each compressed on its own so any one can be read back
+# with a single seek, and located through a SQLite index keyed by request.
+
+import json
+import os
+import sqlite3
+import struct
+import zlib
+
+try:
+    from compression import zstd  # Python 3.14
+except ImportError:
+    try:
+        from backports import zstd
+    except ImportError:
+        zstd = None
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+_HEADER_LENGTH = struct.Struct('<I')
+
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+}
+if zstd is not None:
+    CODECS['zstd'] = (lambda data: zstd.compress(data, 3), zstd.decompress)
+
+
+def encode_response(response):
+    """`response` as bytes (before compression): a JSON header with its length, then the body."""
+    header = json.dumps({
+        'url': response.url,
+        'status': response.status,
+        'headers': [(name.decode('latin-1'), value.decode('latin-1'))
+                    for name, values in response.headers.items() for value in values],
+        'flags': response.flags,
+        'protocol': response.protocol,
+    }).encode('utf-8')
+    return _HEADER_LENGTH.pack(len(header)) + header + response.body
+
+
+def decode_response(data, request, flags=()):
+    """The response encode_response gave `data` for, bound to `request`."""
+    header_length = _HEADER_LENGTH.unpack_from(data)[0]
+    end = _HEADER_LENGTH.size + header_length
+    header = json.loads(data[_HEADER_LENGTH.size:end])
+    body = data[end:]
+    headers = Headers()
+    for name, value in header['headers']:
+        headers.appendlist(name, value)
+    cls = responsetypes.from_args(headers=headers, url=header['url'], body=body)
+    return cls(url=header['url'], status=header['status'], headers=headers, body=body,
+               flags=header['flags'] + list(flags), request=request, protocol=header['protocol'])
+
+
+def request_key(request, fingerprinter):
+    """
+    Archive key of a request: its fingerprint, plus the Zyte API mode when
+    one is set, so the plain HTTP and browser renderings of a listing page
+    are kept apart.
+    """
+    key = fingerprinter.fingerprint(request).hex()
+    automap = request.meta.get('zyte_api_automap')
+    if automap:
+        key += ' ' + json.dumps(automap, sort_keys=True)
+    return key
+
+
+class ResponseArchive:
+    """
+    Responses stored in compressed segment files under `path`, with an
+    index in `path`/index.sqlite.
+
+    A new segment is started once the current one reaches `segment_size`
+    bytes. Recording a request that is already archived replaces it. The
+    codec is "zstd" when available (Python 3.14 or backports.zstd) and
+    "zlib" otherwise; each segment's codec is its file extension.
+    """
+
+    def __init__(self, path, codec='zstd', segment_size=64 * 1024 * 1024):
+        os.makedirs(path, exist_ok=True)
+        if codec not in CODECS:
+            codec = 'zlib'
+        self.path = path
+        self.codec = codec
+        self.segment_size = segment_size
+        self.db = sqlite3.connect(os.path.join(path, 'index.sqlite'), isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, url TEXT, segment TEXT, offset INTEGER, length INTEGER, size INTEGER)"
+        )
+        self.readers = {}
+        self.writer = None
+        self.segment = None
+
+    def _open_segment(self):
+        if self.writer is not None:
+            self.writer.close()
+        count = len([name for name in os.listdir(self.path) if name.startswith('segment-')])
+        self.segment = f'segment-{count:05d}.{self.codec}'
+        self.writer = open(os.path.join(self.path, self.segment), 'ab')
+
+    def add(self, key, response):
+        record = CODECS[self.codec][0](encode_response(response))
+        if self.writer is None or self.writer.tell() + len(record) > self.segment_size:
+            self._open_segment()
+        offset = self.writer.tell()
+        self.writer.write(record)
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (key, response.url, self.segment, offset, len(record), len(response.body)),
+        )
+        return len(record)
+
+    def get(self, key, request):
+        """The archived response for `key`, bound to `request`, or None."""
+        row = self.db.execute(
+            "SELECT segment, offset, length FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        segment, offset, length = row
+        if self.writer is not None and segment == self.segment:
+            self.writer.flush()
+        codec = segment.rsplit('.', 1)[1]
+        if codec not in CODECS:
+            raise RuntimeError(f"{segment} is {codec}-compressed: install backports.zstd to replay it")
+        reader = self.readers.get(segment)
+        if reader is None:
+            reader = self.readers[segment] = os.open(os.path.join(self.path, segment), os.O_RDONLY)
+        return decode_response(CODECS[codec][1](os.pread(reader, length, offset)), request, flags=['replay'])
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        for reader in self.readers.values():
+            os.close(reader)
+        self.db.close()
@@ -0,0 +1,124 @@
+# Table metadata for WriteToDbPipeline
+#
+# Without it the only way to find out that a source writes to a table or a
+# column that doesn't exist yet is to send the INSERT and read the error,
+# which costs a round trip and an aborted transaction, and loses the batch.
+# SchemaCache reads the tables and columns of the schema once from
+# information_schema, checks every row against them in memory, and adds
+# what is missing in a single DDL transaction before the write that needs
+# it.
+
+import datetime
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Column types for new columns, from the first value written to them
+COLUMN_TYPES = (
+    (bool, 'boolean'),
+    (int, 'bigint'),
+    (float, 'double precision'),
+    (datetime.datetime, 'timestamp with time zone'),
+    (datetime.date, 'date'),
+)
+
+
+def column_type(value):
+    for python_type, postgres_type in COLUMN_TYPES:
+        if isinstance(value, python_type):
+            return postgres_type
+    return 'text'
+
+
+class SchemaCache:
+    """
+    Tables of one Postgres schema and their columns.
+
+    `missing(table_name, row)` says what a row needs that the schema
+    doesn't have. `plan(table_name, row)` queues the DDL for it, and
+    `apply(connection)` runs everything queued in one transaction, with
+    CREATE TABLE / ADD COLUMN IF NOT EXISTS so concurrent crawlers don't
+    trip over each other. New tables get a bigserial `id` primary key, as
+    WriteToDbPipeline reads it back. `apply` may be called from several
+    writer threads at once.
+    """
+
+    def __init__(self, schema, tables=None):
+        self.schema = schema
+        self.tables = tables if tables is not None else {}
+        # table name -> {column: type}, including the tables to create
+        self.planned = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, connection, schema):
+        with connection.cursor() as cur:
+            cur.execute(
+                "SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = %s",
+                (schema,),
+            )
+            rows = cur.fetchall()
+        connection.rollback()
+        tables = {}
+        for table_name, column_name in rows:
+            tables.setdefault(table_name, set()).add(column_name)
+        return cls(schema, tables)
+
+    def missing(self, table_name, row):
+        """`(table exists, columns it lacks)` for a row about to be written to `table_name`."""
+        columns = self.tables.get(table_name)
+        if columns is None:
+            return False, [column for column in row if column != 'id']
+        return True, [column for column in row if column not in columns]
+
+    def plan(self, table_name, row):
+        """Queues the DDL `row` needs; returns False when it needs none."""
+        exists, missing = self.missing(table_name, row)
+        if exists and not missing:
+            return False
+        with self.lock:
+            planned = self.planned.setdefault(table_name, {})
+            for column in missing:
+                planned.setdefault(column, column_type(row[column]))
+        return True
+
+    def statements(self):
+        from psycopg2 import sql
+
+        statements = []
+        for table_name, columns in self.planned.items():
+            table = sql.Identifier(self.schema, table_name)
+            if table_name not in self.tables:
+                statements.append(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(self.schema)))
+                statements.append(sql.SQL("CREATE TABLE IF NOT EXISTS {} (id bigserial PRIMARY KEY)").format(table))
+            for column, column_type_name in columns.items():
+                statements.append(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} {}").format(
+                    table, sql.Identifier(column), sql.SQL(column_type_name)))
+        return statements
+
+    def apply(self, connection):
+        """Runs the queued DDL, if any, in one transaction on `connection`."""
+        if not self.planned:
+            return
+        with self.lock:
+            if not self.planned:
+                return
+            statements = self.statements()
+            try:
+                with connection.cursor() as cur:
+                    for statement in statements:
+                        cur.execute(statement)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            for table_name, columns in self.planned.items():
+                self.tables.setdefault(table_name, {'id'}).update(columns)
+                logger.info(f"Added {', '.join(columns) or 'no columns'} to {self.schema}.{table_name}")
+            self.planned = {}
+
+    def forget(self, table_name):
+        """Drops what is known of a table, so the next row for it plans its DDL again."""
+        with self.lock:
+            self.tables.pop(table_name, None)
@@ -0,0 +1,212 @@
+# Persistent index of article URLs that were already stored
+#
+# DUPEFILTER_CLASS is BaseDupeFilter, so nothing stops the next run from
+# downloading and extracting the same articles again. SeenUrlIndex remembers
+# every URL whose item made it through the pipelines, and the URLs that
+# redirected to it, in a Bloom filter kept in a memory-mapped file: memory
+# use is fixed by the configured capacity (about 1.8 bytes per URL at a
+# 0.1% false-positive rate) no matter how many runs have written to it.
+# Sharded workers share the file: writes and the URL count in its header
+# are updated under an exclusive lock on it.
+
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+
+from contextlib import contextmanager
+
+from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.utils.project import data_path
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('<8sQIQ')
+_MAGIC = b'NCSEEN01'
+
+
+def url_hash128(url):
+    """
+    Returns a 128-bit fingerprint of `url`, without its fragment, as two
+    64-bit integers. Both stored and extracted URLs already went through
+    Scrapy's URL escaping, so the much slower canonicalize_url isn't needed.
+    """
+    digest = hashlib.blake2b(url.split('#', 1)[0].encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+class SeenUrlIndex:
+    """
+    Disk-backed Bloom filter of URL fingerprints.
+
+    `url in index` never gives a false negative; false positives happen at
+    roughly `error_rate` once `capacity` URLs have been added. An existing
+    file keeps the size it was created with. Lookups don't lock: bits are
+    only ever set, so a lookup racing an add of the same URL at worst misses
+    it once.
+
+    Settings:
+        SEEN_URLS_ENABLED      check listing links against the index (default True)
+        SEEN_URLS_PATH         index file, relative paths live in the project .scrapy dir
+        SEEN_URLS_CAPACITY     number of URLs the filter is sized for
+        SEEN_URLS_ERROR_RATE   false-positive rate at capacity
+        SEEN_URLS_WARMUP       fill a new index from the urls already in Postgres
+
+    Stats:
+        seen_urls/hit, seen_urls/miss, seen_urls/added
+    """
+
+    def __init__(self, path, capacity=10_000_000, error_rate=0.001):
+        self.path = path
+        self.file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b')
+        with self.locked():
+            # Under the lock, so only one of several workers starting together sizes the file
+            self.created = os.fstat(self.file.fileno()).st_size == 0
+            if self.created:
+                num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+                num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+                self.file.truncate(_HEADER.size + (num_bits + 7) // 8)
+                self.file.seek(0)
+                self.file.write(_HEADER.pack(_MAGIC, num_bits, num_hashes, 0))
+                self.file.flush()
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, self.num_bits, self.num_hashes, _ = _HEADER.unpack_from(self.map, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a seen-URL index")
+        self.capacity = capacity
+        self.stats = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('SEEN_URLS_ENABLED', True):
+            return None
+        path = data_path(settings.get('SEEN_URLS_PATH', 'seen_urls.bloom'))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        index = cls(
+            path,
+            capacity=settings.getint('SEEN_URLS_CAPACITY', 10_000_000),
+            error_rate=settings.getfloat('SEEN_URLS_ERROR_RATE', 0.001),
+        )
+        index.crawler = crawler
+        crawler.signals.connect(index.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(index.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(index.spider_closed, signal=signals.spider_closed)
+        return index
+
+    @contextmanager
+    def locked(self):
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+    @property
+    def count(self):
+        """URLs added so far, by every process sharing the file."""
+        return _HEADER.unpack_from(self.map, 0)[3]
+
+    def _positions(self, url):
+        h1, h2 = url_hash128(url)
+        h2 |= 1
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, url):
+        data = self.map
+        offset = _HEADER.size
+        for position in self._positions(url):
+            if not data[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, url):
+        """Adds `url` and returns True if it was not (probably) there yet."""
+        data = self.map
+        offset = _HEADER.size
+        positions = self._positions(url)
+        added = False
+        with self.locked():
+            # Setting a bit rewrites its whole byte, which would lose the bits
+            # another worker set in it meanwhile
+            for position in positions:
+                byte = offset + (position >> 3)
+                bit = 1 << (position & 7)
+                if not data[byte] & bit:
+                    data[byte] |= bit
+                    added = True
+            if added:
+                count = self.count + 1
+                _HEADER.pack_into(data, 0, _MAGIC, self.num_bits, self.num_hashes, count)
+        if added:
+            if count == self.capacity:
+                logger.warning(f"Seen-URL index {self.path} reached its capacity of {self.capacity} URLs; "
+                               f"false positives will rise, consider a larger SEEN_URLS_CAPACITY")
+        return added
+
+    def seen(self, url):
+        """Membership test that also records hit/miss stats."""
+        hit = url in self
+        if self.stats is not None:
+            self.stats.inc_value('seen_urls/hit' if hit else 'seen_urls/miss')
+        return hit
+
+    def warm_up(self, connection_kwargs, schema, table_name, batch_size=10000):
+        """Adds every url already stored in `schema.table_name`."""
+        import psycopg2
+        from psycopg2 import sql
+
+        connection = psycopg2.connect(**connection_kwargs)
+        added = 0
+        try:
+            # Named cursor, so rows are streamed instead of loaded at once
+            with connection.cursor(name='seen_urls_warmup') as cur:
+                cur.itersize = batch_size
+                cur.execute(sql.SQL("SELECT url FROM {}.{} WHERE url IS NOT NULL").format(
+                    sql.Identifier(schema), sql.Identifier(table_name)))
+                for (url,) in cur:
+                    added += self.add(url)
+        finally:
+            connection.close()
+        logger.info(f"Seen-URL index warmed up with {added} URLs from {schema}.{table_name}")
+        return added
+
+    def spider_opened(self, spider):
+        self.stats = self.crawler.stats
+        settings = self.crawler.settings
+        if self.created and settings.getbool('SEEN_URLS_WARMUP', False):
+            self.warm_up(
+                {
+                    'user': settings.get('POSTGRES_USERNAME'),
+                    'password': settings.get('POSTGRES_PASSWORD'),
+                    'host': settings.get('POSTGRES_ADDRESS'),
+                    'port': settings.get('POSTGRES_PORT'),
+                    'database': settings.get('POSTGRES_DBNAME'),
+                },
+                settings.get('DB_SCHEMA', 'united_states_of_america'),
+                settings.get('DB_TABLE_NAME', 'article_objects'),
+            )
+
+    def item_scraped(self, item, response, spider):
+        urls = [ItemAdapter(item).get('url')]
+        if response is not None:
+            # The item has the URL redirected to, listings and feeds link the one before
+            urls.extend(response.meta.get('redirect_urls', ()))
+        for url in urls:
+            if url and self.add(url):
+                self.stats.inc_value('seen_urls/added')
+
+    def spider_closed(self, spider):
+        self.close()
+
+    def close(self):
+        if self.map.closed:
+            return
+        self.map.flush()
+        self.map.close()
+        self.file.close()
@@ -23,6 +23,17 @@ POSTGRES_PASSWORD= os.environ.get('POSTGRES_PASS')
 POSTGRES_DBNAME= os.environ.get('POSTGRES_DBNAME')
 ZYTE_API_KEY = os.environ.get('ZYTE_API_KEY')
 
+# WriteToDbPipeline: items are written in batches of DB_BATCH_SIZE, or every
+# DB_FLUSH_INTERVAL seconds, using at most DB_POOL_SIZE connections
+DB_SCHEMA = "united_states_of_america"
+DB_TABLE_NAME = "article_objects"
+DB_BATCH_SIZE = 100
+DB_FLUSH_INTERVAL = 5.0
+DB_POOL_SIZE = 4
+# Add missing tables and columns before writing (read once from information_schema),
+# otherwise drop items that don't fit the table, see news_crawler/schema.py
+DB_AUTO_DDL = True
+
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 #USER_AGENT = "news_crawler (+http://www.yourdomain.com)"
 
@@ -30,16 +41,76 @@ ZYTE_API_KEY = os.environ.get('ZYTE_API_KEY')
 ROBOTSTXT_OBEY = False
 
 DUPEFILTER_CLASS = 'scrapy.dupefilters.BaseDupeFilter'
+# Article URLs stored by earlier runs are skipped in parse, see news_crawler/seen.py
+SEEN_URLS_ENABLED = True
+SEEN_URLS_PATH = "seen_urls.bloom"
+SEEN_URLS_CAPACITY = 10_000_000
+SEEN_URLS_ERROR_RATE = 0.001
+# Fill a freshly created index from the urls already in DB_SCHEMA.DB_TABLE_NAME
+SEEN_URLS_WARMUP = False
+# Only rank listing links that are new since the previous crawl of the same source
+LINK_SNAPSHOTS_ENABLED = True
+LINK_SNAPSHOTS_DIR = "link_snapshots"
+# Read sitemaps (from robots.txt) and RSS/Atom feeds before ranking listing pages,
+# fetching only entries newer than the source's last lastmod, see news_crawler/feeds.py
+FEED_DISCOVERY_ENABLED = True
+FEED_DISCOVERY_PATH = "feeds.sqlite"
+FEED_DISCOVERY_RECHECK_DAYS = 30
+FEED_MAX_ARTICLES = 10
+FEED_MAX_SITEMAPS = 20
+# Feed entries and child sitemaps with an older lastmod are skipped, 0 for no limit
+FEED_MAX_AGE_DAYS = 30
+# Articles fetched per listing page: the best LISTING_MAX_ARTICLES (or a source's own
+# "max_articles" key) of the links scoring at least LISTING_MIN_SCORE whose URL date, if
+# any, is within LISTING_MAX_AGE_DAYS (0 for no limit). The rest wait for the next crawl
+LISTING_MAX_ARTICLES = 10
+LISTING_MIN_SCORE = 5
+LISTING_MAX_AGE_DAYS = 30
+# Sharded crawl: SHARD_COUNT workers split the sources by domain through a shared
+# frontier, see news_crawler/sharding.py (python -m news_crawler.sharding run --shards 4)
+SHARD_COUNT = 1
+SHARD_INDEX = 0
+SHARD_CRAWL_ID = None
+SHARD_FRONTIER_PATH = "frontier.sqlite"
+SHARD_STEAL = True
+SHARD_CLAIM_TIMEOUT = 600
+SHARD_STATS_DIR = "shard_stats"
+# Seconds the shared stores in .scrapy (feeds, sources, ...) wait for another worker's write
+SHARD_STORE_TIMEOUT = 30
+# Sources are read from an indexed copy of html/*.json, loaded again when a file changes,
+# with per-source crawl state, see news_crawler/sources.py. Filter with -a country=...,
+# -a branch=..., -a topic=... (comma-separated) and -a due=1 (not crawled within the interval)
+SOURCES_REGISTRY_ENABLED = True
+SOURCES_REGISTRY_PATH = "sources.sqlite"
+SOURCES_FILES = "html/*.json"
+SOURCES_RECRAWL_INTERVAL = 3600
+# Learn each source's publish rate from the created_at of its stored articles and only
+# crawl it once about RECRAWL_TARGET_NEW new articles are expected, with request priorities
+# from the articles it is expected to have, see news_crawler/recrawl.py. -a due=0 crawls
+# every source. Replaces SOURCES_RECRAWL_INTERVAL when enabled
+RECRAWL_SCHEDULER_ENABLED = True
+RECRAWL_MIN_INTERVAL = 900
+RECRAWL_MAX_INTERVAL = 604800
+RECRAWL_TARGET_NEW = 1.0
+RECRAWL_PRIOR_INTERVAL = 86400
+RECRAWL_HISTORY = 50
+# Number of sources the spider reads from html/united_states.json, 0 for all.
+# Overridden per run with `scrapy crawl gov_news -a limit=5`
+SOURCES_LIMIT = 0
+
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-#CONCURRENT_REQUESTS = 32
+CONCURRENT_REQUESTS = 64
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
 #DOWNLOAD_DELAY = 3
 # The download delay setting will honor only one of:
-#CONCURRENT_REQUESTS_PER_DOMAIN = 16
+# Starting point only, DomainThrottle adapts it per host
+CONCURRENT_REQUESTS_PER_DOMAIN = 2
 #CONCURRENT_REQUESTS_PER_IP = 16
+# Don't let one slow host hold a slot for the default 180s
+DOWNLOAD_TIMEOUT = 30
 
 # Disable cookies (enabled by default)
 #COOKIES_ENABLED = False
@@ -64,31 +135,98 @@ DUPEFILTER_CLASS = 'scrapy.dupefilters.BaseDupeFilter'
 DOWNLOADER_MIDDLEWARES = {
     'scrapy.downloadermiddlewares.offsite.OffsiteMiddleware': None,
     'scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware': 810,
+    # Below HttpCompressionMiddleware so it hashes the decompressed body
+    'news_crawler.middlewares.ConditionalGetMiddleware': 580,
+    # Above ConditionalGetMiddleware so JavaScript shells are re-fetched before being hashed
+    'news_crawler.middlewares.RenderingTierMiddleware': 590,
+    # Next to the downloader, so replayed responses go through everything above
+    'news_crawler.middlewares.RecordReplayMiddleware': 950,
 }
 
+# Record responses to a local archive, or replay a crawl from it with no network
+# (-s REPLAY_MODE=record / replay), see RecordReplayMiddleware and news_crawler/bench.py
+REPLAY_MODE = None
+REPLAY_PATH = "replay"
+REPLAY_COMPRESSION = "zstd"
+REPLAY_SEGMENT_SIZE = 64 * 1024 * 1024
+REPLAY_MISSING = "ignore"
+
+# Validators and body hashes of source listing pages, see ConditionalGetMiddleware
+CONDITIONAL_GET_ENABLED = True
+CONDITIONAL_GET_PATH = "conditional_get.sqlite"
+
+# Zyte API mode per source listing, plain HTTP unless the page turns out to be
+# a JavaScript shell, see RenderingTierMiddleware
+RENDERING_TIERS_ENABLED = True
+RENDERING_DECISIONS_PATH = "rendering.sqlite"
+RENDERING_MIN_LINKS = 10
+RENDERING_MIN_WORDS = 100
+RENDERING_REPROBE_DAYS = 30
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "news_crawler.instrumentation.Instrumentation": 100,
+    "news_crawler.extensions.DomainThrottle": 500,
+}
+
+# Wall/CPU time and bytes per crawl stage, written as histograms to
+# .scrapy/instrumentation/<spider>.json and .prom at close, see news_crawler/instrumentation.py
+INSTRUMENTATION_ENABLED = True
+INSTRUMENTATION_DIR = "instrumentation"
+INSTRUMENTATION_FORMATS = ["json", "prometheus"]
+# Sample the reactor thread's stack into <spider>.folded (flamegraph input)
+INSTRUMENTATION_PROFILER = False
+INSTRUMENTATION_PROFILER_INTERVAL = 0.01
+
+# Per-host concurrency between 1 and DOMAIN_THROTTLE_MAX_CONCURRENCY, raised while
+# latency stays under the target and halved on 429/5xx, see news_crawler/extensions.py
+DOMAIN_THROTTLE_ENABLED = True
+DOMAIN_THROTTLE_START_CONCURRENCY = 2
+DOMAIN_THROTTLE_MAX_CONCURRENCY = 8
+DOMAIN_THROTTLE_TARGET_LATENCY = 2.0
+# {"<host>": {"max_concurrency": 2, "download_delay": 1.0}}; the same keys on a
+# source in html/*.json take precedence. A missing file means no extra limits
+DOMAIN_LIMITS_FILE = "html/domain_limits.json"
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
+   "news_crawler.pipelines.NearDuplicatePipeline": 150, # Before the database write
    "news_crawler.pipelines.NewsCrawlerPipeline": 300,
 #    "news_crawler.pipelines.WriteToDbPipeline": 200, # Uncomment to enable database writing
+   "news_crawler.pipelines.NotificationPipeline": 250, # After the database write, needs NOTIFICATIONS_URL
 }
 
+# Drop articles sharing most of their text with one already stored, or keep them with
+# duplicate_of set ("link"), see news_crawler/dedup.py
+NEAR_DUPLICATES_ENABLED = True
+NEAR_DUPLICATES_PATH = "near_duplicates.sqlite"
+NEAR_DUPLICATES_MODE = "drop"
+NEAR_DUPLICATES_THRESHOLD = 0.8
+NEAR_DUPLICATES_MIN_WORDS = 50
+
+# Send the NotificationModels WriteToDbPipeline returns in the background, in batches
+# per collection and topic, see news_crawler/notifications.py
+NOTIFICATIONS_ENABLED = True
+NOTIFICATIONS_URL = os.environ.get('NOTIFICATIONS_URL')
+NOTIFICATIONS_WINDOW = 2.0
+NOTIFICATIONS_BATCH_SIZE = 50
+NOTIFICATIONS_MAX_PENDING = 1000
+NOTIFICATIONS_CONCURRENCY = 4
+NOTIFICATIONS_RETRY_TIMES = 3
+NOTIFICATIONS_RETRY_BACKOFF = 1.0
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
-#AUTOTHROTTLE_ENABLED = True
+AUTOTHROTTLE_ENABLED = True
 # The initial download delay
-#AUTOTHROTTLE_START_DELAY = 5
+AUTOTHROTTLE_START_DELAY = 1
 # The maximum download delay to be set in case of high latencies
-#AUTOTHROTTLE_MAX_DELAY = 60
+AUTOTHROTTLE_MAX_DELAY = 30
 # The average number of requests Scrapy should be sending in parallel to
 # each remote server
-#AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0
+AUTOTHROTTLE_TARGET_CONCURRENCY = 2.0
 # Enable showing throttling stats for every response received:
 #AUTOTHROTTLE_DEBUG = False
 
@@ -98,7 +236,22 @@ ITEM_PIPELINES = {
 #HTTPCACHE_EXPIRATION_SECS = 0
 #HTTPCACHE_DIR = "httpcache"
 #HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+# Off for production crawls. For development runs, `-s HTTPCACHE_ENABLED=True` keeps responses
+# zstd-compressed in segment files shared by concurrent crawls, per-domain expiry
+# ({"whitehouse.gov": 3600}) and a size cap, see news_crawler/httpcache.py
+HTTPCACHE_STORAGE = "news_crawler.httpcache.SegmentCacheStorage"
+HTTPCACHE_DOMAIN_EXPIRATION_SECS = {}
+HTTPCACHE_MAX_SIZE = 2 * 1024 ** 3
+HTTPCACHE_COMPRESSION = "zstd"
+HTTPCACHE_SEGMENT_SIZE = 64 * 1024 * 1024
+HTTPCACHE_COMPACT_RATIO = 0.5
+
+# Run trafilatura extraction off the reactor thread, in a "process" or "thread" pool
+EXTRACTION_EXECUTOR = "process"
+# Number of extraction workers (defaults to the CPU count)
+#EXTRACTION_POOL_SIZE = 4
+# Seconds a single document may run before its extraction is interrupted
+EXTRACTION_TIMEOUT = 30
 
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
@@ -0,0 +1,407 @@
+# Sharded crawl over the source catalogue
+#
+# A single process crawls every source in united_states.json on one core.
+# With SHARD_COUNT > 1, that many workers (processes on one machine, or
+# machines sharing the frontier) split the catalogue between them: a
+# consistent hash ring gives each domain a home shard, and a shared frontier
+# hands out whole domains, so no domain is crawled by two workers in the
+# same crawl and a worker that runs out of its own domains can take the
+# ones a slower worker hasn't started. Each worker writes its stats to its
+# own file, which `python -m news_crawler.sharding merge` adds up. The
+# other stores in .scrapy are shared by the workers, in SQLite's WAL mode.
+
+import argparse
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.utils.project import data_path
+from twisted.internet import task, threads
+
+logger = logging.getLogger(__name__)
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def store_timeout(settings):
+    """
+    Seconds a store in .scrapy waits for another process's write: sharded
+    workers share the stores, so SHARD_STORE_TIMEOUT then, SQLite's default
+    of 5 otherwise.
+    """
+    if settings.getint('SHARD_COUNT', 1) > 1:
+        return settings.getfloat('SHARD_STORE_TIMEOUT', 30)
+    return 5.0
+
+
+def connect_store(path, timeout=5.0):
+    """
+    Opens the SQLite store at `path` in WAL mode, where reads in other
+    processes never wait for a write, and writes wait for each other for
+    up to `timeout` seconds.
+    """
+    db = sqlite3.connect(path, isolation_level=None, timeout=timeout)
+    db.execute("PRAGMA journal_mode=WAL")
+    # Commits are flushed to disk at checkpoints rather than one by one
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+def source_domain(source):
+    """The host a source is crawled from, which is what shards are made of."""
+    return (urlparse(source['source_url']).hostname or '').lower()
+
+
+class HashRing:
+    """
+    Consistent hash ring of `shards` shards with `replicas` points each.
+
+    Going from N to N + 1 shards only moves about 1 / (N + 1) of the
+    domains, so per-host state such as conditional GET validators and
+    throttling limits stays with the worker that built it.
+    """
+
+    def __init__(self, shards, replicas=160):
+        points = sorted(
+            (_hash64(f'shard-{shard}-{replica}'), shard)
+            for shard in range(shards) for replica in range(replicas)
+        )
+        self.keys = [key for key, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        index = bisect.bisect(self.keys, _hash64(key)) % len(self.keys)
+        return self.shards[index]
+
+
+class SourceFrontier:
+    """
+    Shared frontier of one sharded crawl, in SQLite.
+
+    Every worker seeds the frontier with the whole catalogue (seeding is
+    idempotent), then claims one domain at a time, first from its own shard
+    and, with SHARD_STEAL, from any shard once its own are taken. Claims
+    are refreshed while the worker runs; a claim not refreshed for
+    SHARD_CLAIM_TIMEOUT seconds belongs to a dead worker and is handed out
+    again. Claimed domains are marked done when the worker closes.
+
+    SQLite locking is only reliable on a local disk: run the workers of one
+    machine against the default path, or put a Redis-backed class with the
+    same seed/claim/heartbeat/finish methods in front of several machines.
+    Those methods block while another worker holds the write lock, so the
+    crawl only calls them in the reactor's thread pool, each on a
+    connection of its own.
+
+    Settings:
+        SHARD_COUNT          workers the catalogue is split across (default 1, no sharding)
+        SHARD_INDEX          this worker, 0 to SHARD_COUNT - 1
+        SHARD_CRAWL_ID       names one crawl, workers with the same id share its frontier
+        SHARD_FRONTIER_PATH  frontier location, relative paths live in .scrapy
+        SHARD_STEAL          take unclaimed domains of other shards (default True)
+        SHARD_CLAIM_TIMEOUT  seconds without a heartbeat before a claim expires
+        SHARD_STATS_DIR      per-worker stats files, relative paths live in .scrapy
+        SHARD_STORE_TIMEOUT  seconds the other .scrapy stores wait for a write of another worker
+
+    Stats:
+        shard/domains_claimed, shard/domains_stolen, shard/sources
+    """
+
+    def __init__(self, path, crawl_id, shard_count, shard_index, steal=True,
+                 claim_timeout=600, stats=None):
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"SHARD_INDEX must be between 0 and {shard_count - 1}, not {shard_index}")
+        self.crawl_id = crawl_id
+        self.shard_count = shard_count
+        self.shard_index = shard_index
+        self.steal = steal
+        self.claim_timeout = claim_timeout
+        self.stats = stats
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.ring = HashRing(shard_count)
+        self.heartbeat_loop = None
+        self.stats_path = None
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self.connect()
+        try:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS frontier ("
+                "crawl_id TEXT, domain TEXT, shard INTEGER, sources TEXT, "
+                "state TEXT NOT NULL DEFAULT 'pending', worker TEXT, claimed_at REAL, "
+                "PRIMARY KEY (crawl_id, domain))"
+            )
+        finally:
+            db.close()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        shard_count = settings.getint('SHARD_COUNT', 1)
+        if shard_count <= 1:
+            return None
+        crawl_id = settings.get('SHARD_CRAWL_ID') or time.strftime('%Y-%m-%d')
+        frontier = cls(
+            data_path(settings.get('SHARD_FRONTIER_PATH', 'frontier.sqlite')),
+            crawl_id,
+            shard_count,
+            settings.getint('SHARD_INDEX', 0),
+            steal=settings.getbool('SHARD_STEAL', True),
+            claim_timeout=settings.getfloat('SHARD_CLAIM_TIMEOUT', 600),
+        )
+        frontier.stats_path = os.path.join(
+            data_path(settings.get('SHARD_STATS_DIR', 'shard_stats')),
+            crawl_id, f'shard-{frontier.shard_index}.json',
+        )
+        frontier.crawler = crawler
+        crawler.signals.connect(frontier.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(frontier.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(frontier.engine_stopped, signal=signals.engine_stopped)
+        return frontier
+
+    def connect(self):
+        # A connection per call, as the calls run on whichever pool thread is free
+        return connect_store(self.path, timeout=60)
+
+    def spider_opened(self, spider):
+        self.stats = self.crawler.stats
+        self.stats.set_value('shard/index', self.shard_index)
+        self.heartbeat_loop = task.LoopingCall(self.heartbeat_in_thread)
+        self.heartbeat_loop.start(self.claim_timeout / 4, now=False)
+
+    def inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(f'shard/{key}', count)
+
+    def seed(self, sources):
+        domains = {}
+        for source in sources:
+            domains.setdefault(source_domain(source), []).append(source)
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT OR IGNORE INTO frontier (crawl_id, domain, shard, sources) VALUES (?, ?, ?, ?)",
+                [(self.crawl_id, domain, self.ring.shard_for(domain), json.dumps(group))
+                 for domain, group in domains.items()],
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def claim(self):
+        """
+        Claims the next domain for this worker and returns its
+        (domain, home shard, sources), or None when none are left.
+        """
+        expired = time.time() - self.claim_timeout
+        available = (
+            "SELECT domain, shard, sources FROM frontier WHERE crawl_id = ? "
+            "AND (state = 'pending' OR (state = 'claimed' AND claimed_at < ?))"
+        )
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(available + " AND shard = ? LIMIT 1",
+                             (self.crawl_id, expired, self.shard_index)).fetchone()
+            if row is None and self.steal:
+                # Domains of the slowest shards first
+                row = db.execute(
+                    available + " ORDER BY (SELECT COUNT(*) FROM frontier AS other "
+                    "WHERE other.crawl_id = frontier.crawl_id AND other.shard = frontier.shard "
+                    "AND other.state = 'pending') DESC LIMIT 1",
+                    (self.crawl_id, expired),
+                ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE frontier SET state = 'claimed', worker = ?, claimed_at = ? "
+                    "WHERE crawl_id = ? AND domain = ?",
+                    (self.worker, time.time(), self.crawl_id, row[0]),
+                )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        if row is None:
+            return None
+        domain, shard, sources = row
+        return domain, shard, json.loads(sources)
+
+    async def claimed_sources(self, sources):
+        """Seeds the frontier with `sources`, then yields the sources of each domain this worker claims."""
+        # Read the catalogue here, SourceRegistry's connection belongs to this thread
+        sources = list(sources)
+        await maybe_deferred_to_future(threads.deferToThread(self.seed, sources))
+        while True:
+            claimed = await maybe_deferred_to_future(threads.deferToThread(self.claim))
+            if claimed is None:
+                return
+            domain, shard, group = claimed
+            self.inc_stat('domains_claimed')
+            if shard != self.shard_index:
+                self.inc_stat('domains_stolen')
+                logger.info(f"Shard {self.shard_index} took {domain} from shard {shard}")
+            self.inc_stat('sources', len(group))
+            for source in group:
+                yield source
+
+    def heartbeat(self):
+        db = self.connect()
+        try:
+            db.execute(
+                "UPDATE frontier SET claimed_at = ? WHERE crawl_id = ? AND worker = ? AND state = 'claimed'",
+                (time.time(), self.crawl_id, self.worker),
+            )
+        finally:
+            db.close()
+
+    def heartbeat_in_thread(self):
+        heartbeat = threads.deferToThread(self.heartbeat)
+        # A missed heartbeat is retried on the next tick, well before the claims expire
+        heartbeat.addErrback(lambda failure: logger.warning(
+            f"Shard {self.shard_index} heartbeat failed: {failure.getErrorMessage()}"))
+        return heartbeat
+
+    def finish(self):
+        db = self.connect()
+        try:
+            db.execute(
+                "UPDATE frontier SET state = 'done' WHERE crawl_id = ? AND worker = ? AND state = 'claimed'",
+                (self.crawl_id, self.worker),
+            )
+        finally:
+            db.close()
+
+    def write_stats(self, stats):
+        os.makedirs(os.path.dirname(self.stats_path), exist_ok=True)
+        with open(self.stats_path, 'w', encoding='utf-8') as stats_file:
+            json.dump({'crawl_id': self.crawl_id, 'shard': self.shard_index, 'worker': self.worker,
+                       'stats': stats}, stats_file, indent=2, sort_keys=True, default=str)
+
+    def spider_closed(self, spider, reason):
+        if self.heartbeat_loop is not None and self.heartbeat_loop.running:
+            self.heartbeat_loop.stop()
+        if reason == 'finished':
+            # spider_closed waits for the returned Deferred
+            return threads.deferToThread(self.finish)
+
+    def engine_stopped(self):
+        # After the spider_closed handlers, so finish_time and elapsed_time_seconds are set
+        self.write_stats(self.crawler.stats.get_stats())
+
+
+def merge_stats(shard_stats):
+    """
+    Adds up the stats of several workers. Counters are summed, `*max` keys
+    and elapsed_time_seconds take the largest value, `*min` keys the
+    smallest, start_time the earliest and finish_time the latest.
+    """
+    merged = {}
+    for stats in shard_stats:
+        for key, value in stats.items():
+            if key not in merged:
+                merged[key] = value
+                continue
+            current = merged[key]
+            if key in ('start_time', 'finish_time'):
+                pick = min if key == 'start_time' else max
+                merged[key] = pick(current, value, key=lambda stamp: datetime.fromisoformat(str(stamp)))
+            elif isinstance(value, (int, float)) and isinstance(current, (int, float)):
+                if key.endswith('max') or key == 'elapsed_time_seconds':
+                    merged[key] = max(current, value)
+                elif key.endswith('min'):
+                    merged[key] = min(current, value)
+                else:
+                    merged[key] = current + value
+            elif current != value:
+                merged[key] = None
+    return merged
+
+
+def load_shard_stats(stats_dir, crawl_id):
+    directory = os.path.join(stats_dir, crawl_id)
+    shards = []
+    for name in sorted(os.listdir(directory)):
+        if name.startswith('shard-') and name.endswith('.json'):
+            with open(os.path.join(directory, name), encoding='utf-8') as stats_file:
+                shards.append(json.load(stats_file))
+    return shards
+
+
+def print_merged(stats_dir, crawl_id, output=None):
+    shards = load_shard_stats(stats_dir, crawl_id)
+    if not shards:
+        raise SystemExit(f'no shard stats for crawl {crawl_id} in {stats_dir}')
+    merged = merge_stats(shard['stats'] for shard in shards)
+    merged.pop('shard/index', None)
+    merged['shard/workers'] = len(shards)
+    for shard in shards:
+        stats = shard['stats']
+        print(f"shard {shard['shard']} ({shard['worker']}): "
+              f"{stats.get('item_scraped_count', 0)} items, "
+              f"{stats.get('shard/domains_claimed', 0)} domains "
+              f"({stats.get('shard/domains_stolen', 0)} stolen), "
+              f"{stats.get('elapsed_time_seconds', 0):.0f}s")
+    if output:
+        with open(output, 'w', encoding='utf-8') as output_file:
+            json.dump(merged, output_file, indent=2, sort_keys=True, default=str)
+    print(json.dumps(merged, indent=2, sort_keys=True, default=str))
+
+
+def main(argv=None):
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    parser = argparse.ArgumentParser(prog='python -m news_crawler.sharding',
+                                     description='Run a sharded crawl and merge its stats.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='start one scrapy worker per shard and wait for them')
+    run.add_argument('--shards', type=int, default=os.cpu_count())
+    run.add_argument('--spider', default='gov_news')
+    run.add_argument('--crawl-id', default=time.strftime('%Y-%m-%dT%H%M%S'))
+    run.add_argument('scrapy_args', nargs=argparse.REMAINDER,
+                     help='passed on to every `scrapy crawl`, after --')
+    merge = commands.add_parser('merge', help='add up the stats files of a sharded crawl')
+    merge.add_argument('--crawl-id', default=settings.get('SHARD_CRAWL_ID') or time.strftime('%Y-%m-%d'))
+    merge.add_argument('--output', help='also write the merged stats to this JSON file')
+    args = parser.parse_args(argv)
+
+    stats_dir = data_path(settings.get('SHARD_STATS_DIR', 'shard_stats'))
+    if args.command == 'merge':
+        print_merged(stats_dir, args.crawl_id, args.output)
+        return
+
+    extra = [arg for arg in args.scrapy_args if arg != '--']
+    workers = [
+        subprocess.Popen([
+            sys.executable, '-m', 'scrapy', 'crawl', args.spider,
+            '-s', f'SHARD_COUNT={args.shards}', '-s', f'SHARD_INDEX={index}',
+            '-s', f'SHARD_CRAWL_ID={args.crawl_id}', *extra,
+        ])
+        for index in range(args.shards)
+    ]
+    failed = sum(1 for worker in workers if worker.wait() != 0)
+    print_merged(stats_dir, args.crawl_id)
+    if failed:
+        raise SystemExit(f'{failed} of {args.shards} workers failed')
+
+
+if __name__ == '__main__':
+    main()
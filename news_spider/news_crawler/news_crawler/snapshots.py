@@ -0,0 +1,124 @@
+# Per-source snapshots of the links seen on listing pages
+#
+# A listing page mostly shows the same links from one crawl to the next.
+# LinkSnapshotStore keeps the links each source showed last time so parse
+# only ranks and fetches the ones that appeared since.
+
+import hashlib
+import os
+from array import array
+from bisect import bisect_left
+
+from scrapy import signals
+from scrapy.utils.project import data_path
+
+from news_crawler.seen import url_hash128
+
+
+def url_hash64(url):
+    return url_hash128(url)[0]
+
+
+class LinkSnapshot:
+    """A sorted array of 64-bit URL hashes, searched with bisect."""
+
+    def __init__(self, hashes=None):
+        self.hashes = hashes if hashes is not None else array('Q')
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, url):
+        hashes = self.hashes
+        url_hash = url_hash64(url)
+        position = bisect_left(hashes, url_hash)
+        return position < len(hashes) and hashes[position] == url_hash
+
+    @classmethod
+    def from_urls(cls, urls):
+        return cls(array('Q', sorted({url_hash64(url) for url in urls})))
+
+
+class LinkSnapshotStore:
+    """
+    One small file of sorted 8-byte hashes per `collection_name`, read only
+    when that source is parsed and replaced atomically after it. A source
+    whose last crawl left articles unfetched has a backlog marker next to
+    its snapshot, so its listing is downloaded even when unchanged. The
+    links whose fetch then fails are `forget`-ten, so they are new again
+    on the next crawl.
+
+    Settings:
+        LINK_SNAPSHOTS_ENABLED  only rank links that are new since the last crawl (default True)
+        LINK_SNAPSHOTS_DIR      snapshot directory, relative paths live in .scrapy
+
+    Stats:
+        link_snapshots/new_links, link_snapshots/known_links, link_snapshots/forgotten
+    """
+
+    def __init__(self, directory, stats=None):
+        self.directory = directory
+        self.stats = stats
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('LINK_SNAPSHOTS_ENABLED', True):
+            return None
+        store = cls(data_path(settings.get('LINK_SNAPSHOTS_DIR', 'link_snapshots')))
+        store.crawler = crawler
+        crawler.signals.connect(store.spider_opened, signal=signals.spider_opened)
+        return store
+
+    def spider_opened(self, spider):
+        self.stats = self.crawler.stats
+
+    def _path(self, collection_name):
+        name = hashlib.blake2b(collection_name.encode('utf-8'), digest_size=8).hexdigest()
+        return os.path.join(self.directory, name + '.bin')
+
+    def load(self, collection_name):
+        hashes = array('Q')
+        try:
+            with open(self._path(collection_name), 'rb') as snapshot_file:
+                hashes.frombytes(snapshot_file.read())
+        except FileNotFoundError:
+            pass
+        return LinkSnapshot(hashes)
+
+    def save(self, collection_name, urls, backlog=False):
+        self._write(collection_name, LinkSnapshot.from_urls(urls).hashes, backlog)
+
+    def forget(self, collection_name, urls):
+        """Takes `urls` out of the source's snapshot and marks it as having a backlog."""
+        forgotten = {url_hash64(url) for url in urls}
+        hashes = self.load(collection_name).hashes
+        kept = array('Q', (url_hash for url_hash in hashes if url_hash not in forgotten))
+        if self.stats is not None:
+            self.stats.inc_value('link_snapshots/forgotten', len(hashes) - len(kept))
+        self._write(collection_name, kept, backlog=True)
+
+    def _write(self, collection_name, hashes, backlog):
+        path = self._path(collection_name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as snapshot_file:
+            hashes.tofile(snapshot_file)
+        os.replace(tmp_path, path)
+        if backlog:
+            open(path + '.backlog', 'wb').close()
+        elif os.path.exists(path + '.backlog'):
+            os.remove(path + '.backlog')
+
+    def has_backlog(self, collection_name):
+        """True when the last crawl left new links unfetched."""
+        return os.path.exists(self._path(collection_name) + '.backlog')
+
+    def new_links(self, collection_name, urls):
+        """Returns the `urls` that were not on the source's previous crawl."""
+        snapshot = self.load(collection_name)
+        new_urls = [url for url in urls if url not in snapshot]
+        if self.stats is not None:
+            self.stats.inc_value('link_snapshots/new_links', len(new_urls))
+            self.stats.inc_value('link_snapshots/known_links', len(urls) - len(new_urls))
+        return new_urls
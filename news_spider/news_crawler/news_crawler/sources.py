@@ -0,0 +1,246 @@
+# Source catalogue
+#
+# start_requests used to json.load the whole of html/united_states.json on
+# every run and filter it in Python, so startup time and memory grew with
+# the catalogue, and nothing was remembered about a source between runs.
+# SourceRegistry copies the source files into an indexed SQLite table,
+# only reading a file again when it changes, and keeps per-source state
+# (last crawl, failures, when it is due again) next to it. Sources are
+# streamed from a query, filtered by country, branch, topic and due time.
+
+import glob
+import json
+import logging
+import os
+import time
+
+from scrapy import signals
+from scrapy.utils.project import data_path
+
+from news_crawler.sharding import connect_store, store_timeout
+
+logger = logging.getLogger(__name__)
+
+
+def _values(value):
+    """A filter given as a list, or as one comma-separated string (-a country=...)."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [part.strip() for part in value.split(',') if part.strip()]
+    return list(value)
+
+
+class SourceRegistry:
+    """
+    Sources from the JSON catalogue files, in SQLite, with crawl state.
+
+    `sync(pattern)` loads the files matching `pattern` whose size or mtime
+    changed since the last run (each file is a JSON list of sources;
+    anything else, such as the domain limits sidecar, is skipped) and
+    forgets sources whose file is gone. `select` streams sources in file
+    order, highest `priority` key first; only due sources, it streams them
+    as a queue: never crawled ones first, then the longest overdue, then
+    the ones publishing the most. `record_crawl` stores the outcome of a
+    crawl of a source: a failure pushes its next due time back
+    exponentially, up to 64 intervals, unless the caller (RecrawlScheduler)
+    says when it is due and how fast the source publishes.
+    `record_published` keeps the publication times of each source's latest
+    articles for the scheduler.
+
+    Settings:
+        SOURCES_REGISTRY_ENABLED   default True, otherwise the spider reads united_states.json
+        SOURCES_REGISTRY_PATH      store location, relative paths live in .scrapy
+        SOURCES_FILES              glob of source files, relative to the news_crawler package
+        SOURCES_RECRAWL_INTERVAL   seconds after a crawl before a source is due again
+
+    Stats:
+        sources/selected, sources/succeeded, sources/failed
+    """
+
+    def __init__(self, path, recrawl_interval=3600.0, stats=None, timeout=5.0):
+        self.stats = stats
+        self.recrawl_interval = recrawl_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = connect_store(path, timeout)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            "collection_name TEXT PRIMARY KEY, file TEXT, position INTEGER, priority INTEGER, "
+            "country TEXT COLLATE NOCASE, branch TEXT COLLATE NOCASE, topic TEXT COLLATE NOCASE, data TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS sources_order ON sources (priority DESC, file, position)")
+        for column in ('country', 'branch', 'topic'):
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS sources_{column} ON sources ({column})")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS source_state ("
+            "collection_name TEXT PRIMARY KEY, last_crawled_at REAL, last_success_at REAL, "
+            "failures INTEGER NOT NULL DEFAULT 0, next_due_at REAL, first_crawled_at REAL, rate REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS source_state_due ON source_state (next_due_at)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS publications (collection_name TEXT, url TEXT, published_at REAL, "
+            "PRIMARY KEY (collection_name, url)) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS publications_time ON publications (collection_name, published_at)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER)")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('SOURCES_REGISTRY_ENABLED', True):
+            return None
+        registry = cls(
+            data_path(settings.get('SOURCES_REGISTRY_PATH', 'sources.sqlite')),
+            recrawl_interval=settings.getfloat('SOURCES_RECRAWL_INTERVAL', 3600),
+            timeout=store_timeout(settings),
+        )
+        pattern = settings.get('SOURCES_FILES', 'html/*.json')
+        if not os.path.isabs(pattern):
+            pattern = os.path.join(os.path.dirname(os.path.abspath(__file__)), pattern)
+        registry.sync(pattern)
+        registry.crawler = crawler
+        crawler.signals.connect(registry.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(registry.spider_closed, signal=signals.spider_closed)
+        return registry
+
+    def spider_opened(self, spider):
+        self.stats = self.crawler.stats
+
+    def inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(f'sources/{key}', count)
+
+    def sync(self, pattern):
+        """Loads the source files matching `pattern` that changed; returns how many were loaded."""
+        paths = sorted(os.path.abspath(path) for path in glob.glob(pattern))
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in self.db.execute("SELECT * FROM files")}
+        loaded = 0
+        for path in paths:
+            stat = os.stat(path)
+            if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            self.load_file(path, stat)
+            loaded += 1
+        for path in known.keys() - set(paths):
+            self.db.execute("BEGIN")
+            self.db.execute("DELETE FROM sources WHERE file = ?", (path,))
+            self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+            self.db.execute("COMMIT")
+        return loaded
+
+    def load_file(self, path, stat):
+        with open(path, encoding='utf-8') as source_file:
+            sources = json.load(source_file)
+        valid = isinstance(sources, list) and all(isinstance(source, dict) and 'source_url' in source
+                                                  for source in sources)
+        if not valid:
+            logger.debug(f"{path} is not a list of sources, skipped")
+            sources = []
+        self.db.execute("BEGIN")
+        try:
+            self.db.execute("DELETE FROM sources WHERE file = ?", (path,))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(source['collection_name'], path, position, source.get('priority', 0), source.get('country'),
+                  source.get('branch'), source.get('topic'), json.dumps(source))
+                 for position, source in enumerate(sources)],
+            )
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (path, stat.st_mtime_ns, stat.st_size))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        logger.info(f"Loaded {len(sources)} sources from {os.path.basename(path)}")
+
+    def select(self, country=None, branch=None, topic=None, due=False, limit=None, now=None):
+        """
+        Yields the sources (dicts, as in the JSON files) matching every given
+        filter; each filter is a value, a list or a comma-separated string.
+        With `due`, only sources never crawled or whose next due time has
+        passed, in the order they became due, the fastest publishing first
+        among sources due at the same time.
+        """
+        query = ("SELECT sources.data FROM sources "
+                 "LEFT JOIN source_state ON source_state.collection_name = sources.collection_name")
+        conditions, parameters = [], []
+        for column, value in (('country', country), ('branch', branch), ('topic', topic)):
+            values = _values(value)
+            if values:
+                conditions.append(f"sources.{column} IN ({', '.join('?' * len(values))})")
+                parameters.extend(values)
+        if due:
+            conditions.append("(source_state.next_due_at IS NULL OR source_state.next_due_at <= ?)")
+            parameters.append(time.time() if now is None else now)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY "
+        if due:
+            # With a limit, the sources waited on the longest are crawled first
+            query += ("source_state.next_due_at IS NOT NULL, source_state.next_due_at, "
+                      "source_state.rate DESC, ")
+        query += "sources.priority DESC, sources.file, sources.position"
+        if limit:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        for (data,) in self.db.execute(query, parameters):
+            self.inc_stat('selected')
+            yield json.loads(data)
+
+    STATE_COLUMNS = ('last_crawled_at', 'last_success_at', 'failures', 'next_due_at', 'first_crawled_at', 'rate')
+
+    def state(self, collection_name):
+        row = self.db.execute(
+            f"SELECT {', '.join(self.STATE_COLUMNS)} FROM source_state WHERE collection_name = ?",
+            (collection_name,),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(self.STATE_COLUMNS, row))
+
+    def states(self):
+        """Yields `(collection_name, state)` for every source crawled before."""
+        for row in self.db.execute(f"SELECT collection_name, {', '.join(self.STATE_COLUMNS)} FROM source_state"):
+            yield row[0], dict(zip(self.STATE_COLUMNS, row[1:]))
+
+    def record_crawl(self, collection_name, success, now=None, next_due_at=None, rate=None):
+        now = time.time() if now is None else now
+        state = self.state(collection_name) or {'last_success_at': None, 'failures': 0, 'first_crawled_at': now,
+                                                'rate': None}
+        failures = 0 if success else state['failures'] + 1
+        if next_due_at is None:
+            next_due_at = now + self.recrawl_interval * 2 ** min(failures, 6)
+        self.db.execute(
+            f"INSERT OR REPLACE INTO source_state (collection_name, {', '.join(self.STATE_COLUMNS)}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (collection_name, now, now if success else state['last_success_at'], failures, next_due_at,
+             state['first_crawled_at'] or now, state['rate'] if rate is None else rate),
+        )
+        self.inc_stat('succeeded' if success else 'failed')
+
+    def reschedule(self, collection_name, next_due_at, rate=None):
+        self.db.execute("UPDATE source_state SET next_due_at = ?, rate = COALESCE(?, rate) WHERE collection_name = ?",
+                        (next_due_at, rate, collection_name))
+
+    def record_published(self, collection_name, url, published_at, keep=50):
+        """Stores the publication time of the article at `url`, keeping the source's latest `keep`."""
+        self.db.execute("BEGIN")
+        self.db.execute("INSERT OR IGNORE INTO publications VALUES (?, ?, ?)", (collection_name, url, published_at))
+        self.db.execute(
+            "DELETE FROM publications WHERE collection_name = ? AND url IN ("
+            "SELECT url FROM publications WHERE collection_name = ? "
+            "ORDER BY published_at DESC, url DESC LIMIT -1 OFFSET ?)",
+            (collection_name, collection_name, keep),
+        )
+        self.db.execute("COMMIT")
+
+    def publications(self):
+        """Yields `(collection_name, url, published_at)`, oldest first for each source."""
+        yield from self.db.execute(
+            "SELECT collection_name, url, published_at FROM publications ORDER BY collection_name, published_at, url"
+        )
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+
+    def spider_closed(self, spider):
+        self.db.close()
@@ -1,53 +1,299 @@
 import scrapy
 import os, json
-from scrapy.http import Request, HtmlResponse
-from bs4 import BeautifulSoup
-from scrapy.linkextractors import LinkExtractor
-from urllib.parse import urlparse
-from news_crawler.items import NewsItems
-from news_crawler.pipelines import rank_urls_for_articles
-from trafilatura import extract
+from datetime import date, timedelta
+from scrapy.http import Request
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.utils.misc import load_object
+from scrapy.utils.sitemap import sitemap_urls_from_robots
+from urllib.parse import urljoin, urlparse
+from news_crawler.extraction import ExtractionExecutor, response_html
+from news_crawler.feeds import FeedDiscoveryStore, find_feed_links, iter_feed_entries
+from news_crawler.items import ArticleRecord
+from news_crawler.linkextractors import BoilerplateLinkExtractor
+from news_crawler.middlewares import NotModified
+from news_crawler.ranking import UrlRanker
+from news_crawler.recrawl import RecrawlScheduler
+from news_crawler.seen import SeenUrlIndex
+from news_crawler.sharding import SourceFrontier
+from news_crawler.snapshots import LinkSnapshotStore
+from news_crawler.sources import SourceRegistry
+
+
+def newest_first(entry):
+    """Sort key of (date, url) feed entries, undated ones last with reverse=True."""
+    return entry[0] is not None, entry[0] or 0
 
 
 class GovNewsSpider(scrapy.Spider):
     name = "gov_news"
 
-    def start_requests(self):
-
-        # data_feed = GetFeedsPipeline().get_url_sources('xml')
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        file_path = os.path.join(script_dir, '../html/united_states.json')
-        with open(file_path, encoding='utf-8') as data_file:
-            data_feed = json.load(data_file)
-
-        for feed_data in data_feed[:5]:  # Try with fewer sites first
-            request = Request(
-                feed_data['source_url'], 
-                meta = {
-                     'items': feed_data,
-                     # Mark this request as having a Firecrawl fallback option
-                      
-                    "zyte_api_automap": {
-                    "browserHtml": True,
-                    'screenshot': True,
-                }
-                }
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.url_ranker = UrlRanker()
+        self.link_extractor = BoilerplateLinkExtractor()
+        self.feed_state = {}
+        # Sources whose dates carry no offset can say which zone they're in
+        self.source_timezones = {}
+        self.source_priorities = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.extractor = ExtractionExecutor.from_crawler(crawler)
+        spider.seen_urls = SeenUrlIndex.from_crawler(crawler)
+        spider.link_snapshots = LinkSnapshotStore.from_crawler(crawler)
+        spider.feeds = FeedDiscoveryStore.from_crawler(crawler)
+        spider.frontier = SourceFrontier.from_crawler(crawler)
+        spider.sources = SourceRegistry.from_crawler(crawler)
+        spider.recrawl = RecrawlScheduler.from_crawler(crawler, spider.sources)
+        # What RetryMiddleware retries is what may work on the next crawl, see article_failed
+        spider.transient_errors = tuple(
+            load_object(error) if isinstance(error, str) else error
+            for error in crawler.settings.getlist('RETRY_EXCEPTIONS')
+        )
+        spider.transient_statuses = {int(code) for code in crawler.settings.getlist('RETRY_HTTP_CODES')}
+        return spider
+
+    async def start(self):
+        # -a limit=5 to try with fewer sites first
+        limit = int(getattr(self, 'limit', 0) or self.settings.getint('SOURCES_LIMIT'))
+        if self.sources is not None:
+            # -a country=..., -a branch=..., -a topic=... (comma-separated), -a due=1.
+            # With the recrawl scheduler only due sources are crawled, -a due=0 for all
+            due = getattr(self, 'due', '1' if self.recrawl is not None else '0')
+            data_feed = self.sources.select(
+                country=getattr(self, 'country', None),
+                branch=getattr(self, 'branch', None),
+                topic=getattr(self, 'topic', None),
+                due=due not in ('0', '', 'false', 'False'),
+                limit=limit,
             )
-            yield request 
+        else:
+            # data_feed = GetFeedsPipeline().get_url_sources('xml')
+            script_dir = os.path.dirname(os.path.abspath(__file__))
+            file_path = os.path.join(script_dir, '../html/united_states.json')
+            with open(file_path, encoding='utf-8') as data_file:
+                data_feed = json.load(data_file)
+            if limit:
+                data_feed = data_feed[:limit]
 
+        # -s SHARD_COUNT=4 -s SHARD_INDEX=0: only the domains this worker claims
+        if self.frontier is not None:
+            async for feed_data in self.frontier.claimed_sources(data_feed):
+                for request in self.source_requests(feed_data):
+                    yield request
+            return
 
-    def parse(self, response):
+        for feed_data in data_feed:
+            for request in self.source_requests(feed_data):
+                yield request
+
+    def source_requests(self, feed_data):
+        if feed_data.get('timezone'):
+            self.source_timezones[feed_data['collection_name']] = feed_data['timezone']
+        if self.recrawl is not None:
+            # Sources expected to have published the most since their last crawl go first
+            self.source_priorities[feed_data['collection_name']] = self.recrawl.priority(feed_data['collection_name'])
+        if self.feeds is None:
+            yield self.listing_request(feed_data)
+            return
+        feed_urls = self.feeds.feed_urls(feed_data)
+        if feed_urls is None:
+            # Never checked: sitemaps listed in robots.txt come first
+            yield Request(
+                urljoin(feed_data['source_url'], '/robots.txt'),
+                callback=self.parse_robots,
+                errback=self.robots_failed,
+                priority=self.source_priority(feed_data),
+                meta={'items': feed_data},
+            )
+        elif feed_urls:
+            yield from self.feed_requests(feed_data, feed_urls)
+        else:
+            yield self.listing_request(feed_data)
+
+    def listing_request(self, feed_data, discover_feeds=False):
+        meta = {
+            'items': feed_data,
+            # Plain HTTP first, browserHtml only for JavaScript-only listings,
+            # see RenderingTierMiddleware
+            'tiered_rendering': True,
+        }
+        if discover_feeds:
+            # parse records the feeds the page advertises, or that it has none
+            meta['discover_feeds'] = True
+        else:
+            # An unchanged listing would hide the links the last crawl had no budget for
+            meta['conditional_get'] = (self.link_snapshots is None
+                                       or not self.link_snapshots.has_backlog(feed_data['collection_name']))
+        return Request(feed_data['source_url'], errback=self.listing_failed, meta=meta,
+                       priority=self.source_priority(feed_data))
+
+    def listing_failed(self, failure):
+        # Unchanged since the last crawl (ConditionalGetMiddleware) still counts as crawled;
+        # a 404 or 5xx (HttpError) is a failure like any other
+        self.source_crawled(failure.request.meta['items'], failure.check(NotModified) is not None)
+
+    def source_priority(self, feed_data):
+        return self.source_priorities.get(feed_data['collection_name'], 0)
+
+    def source_crawled(self, feed_data, success):
+        if self.sources is None:
+            return
+        next_due_at = rate = None
+        if self.recrawl is not None:
+            next_due_at = self.recrawl.crawled(feed_data['collection_name'], success)
+            rate = self.recrawl.rate(feed_data['collection_name'])
+        self.sources.record_crawl(feed_data['collection_name'], success, next_due_at=next_due_at, rate=rate)
+
+    def parse_robots(self, response):
+        feed_data = response.meta['items']
+        host = urlparse(feed_data['source_url']).netloc
+        sitemaps = [url for url in sitemap_urls_from_robots(response.text, base_url=response.url)
+                    if urlparse(url).netloc == host]
+        if sitemaps:
+            self.feeds.set_feed_urls(feed_data['collection_name'], sitemaps)
+            yield from self.feed_requests(feed_data, sitemaps)
+        else:
+            yield self.listing_request(feed_data, discover_feeds=True)
+
+    def robots_failed(self, failure):
+        yield self.listing_request(failure.request.meta['items'], discover_feeds=True)
+
+    def feed_requests(self, feed_data, feed_urls):
+        state = self.feed_state.setdefault(feed_data['collection_name'], {
+            'pending': 0,
+            'in_scope': 0,
+            'unchanged': False,
+            'truncated': False,
+            # Without a watermark yet, older entries are left for good, see feed_finished
+            'first': self.feeds.watermark(feed_data['collection_name']) is None,
+            'newest': None,
+            'budget': self.settings.getint('FEED_MAX_ARTICLES', 10),
+            'sitemaps': self.settings.getint('FEED_MAX_SITEMAPS', 20),
+        })
+        # An unchanged feed would hide the entries the last crawl had no budget for
+        conditional_get = not self.feeds.has_backlog(feed_data['collection_name'])
+        for url in feed_urls:
+            state['pending'] += 1
+            yield Request(url, callback=self.parse_feed, errback=self.feed_failed,
+                          meta={'items': feed_data, 'conditional_get': conditional_get},
+                          priority=self.source_priority(feed_data))
 
-        soup = BeautifulSoup(response.text, 'html.parser')
+    def in_feed_scope(self, feed_data, kind, url):
+        if kind == 'item':
+            # A feed only lists the source's own articles
+            return True
+        # Sitemaps cover the whole site: keep the section the listing page is in
+        source = urlparse(feed_data['source_url'])
+        parsed = urlparse(url)
+        if parsed.netloc != source.netloc:
+            return False
+        section = source.path.strip('/').split('/')[0]
+        return not section or parsed.path.startswith(f'/{section}/')
 
-        for selector in ['header', 'nav', 'footer', 'aside', '.sidebar', '.footer', '.header', '.nav', '.sidenav', 'sidebar', '.pagination', '.pager', '.related-links', '.related-posts','comments', '.comment', '.share-buttons', '.social-links', '.ad', '.advertisement', '.promo', '.promotion']:
-            for element in soup.select(selector):
-                element.decompose()
+    def parse_feed(self, response):
+        feed_data = response.meta['items']
+        collection_name = feed_data['collection_name']
+        state = self.feed_state[collection_name]
+        watermark = self.feeds.watermark(collection_name)
+        not_before = self.feeds.not_before()
 
-        processed_response = HtmlResponse(url=response.url, body=str(soup), encoding='utf-8')
+        sitemaps = []
+        articles = []
+        entries = 0
+        children = 0
+        stale = 0
+        for kind, url, date in iter_feed_entries(response.body):
+            if kind == 'sitemap':
+                children += 1
+            elif self.in_feed_scope(feed_data, kind, url):
+                entries += 1
+            else:
+                continue
+            if not_before is not None and date is not None and date < not_before:
+                # Too old to fetch, and so is everything in a sitemap last changed then
+                stale += 1
+                continue
+            # Only entries that changed since the last crawl of this source
+            if watermark is not None and date is not None and date <= watermark:
+                continue
+            (sitemaps if kind == 'sitemap' else articles).append((date, url))
+        state['in_scope'] += entries + children
+        self.feeds.inc_stat('entries', entries)
+        self.feeds.inc_stat('new_entries', len(articles))
+        self.feeds.inc_stat('skipped_stale', stale)
 
-        le = LinkExtractor()
-        all_links = le.extract_links(processed_response)
+        sitemaps.sort(key=newest_first, reverse=True)
+        for date, url in sitemaps[:state['sitemaps']]:
+            state['sitemaps'] -= 1
+            yield from self.feed_requests(feed_data, [url])
+
+        articles.sort(key=newest_first, reverse=True)
+        dated = [date for date, url in articles if date is not None]
+        if dated and (state['newest'] is None or max(dated) > state['newest']):
+            state['newest'] = max(dated)
+        for date, url in articles:
+            # Stored before, but fetched again when its lastmod moved forward since
+            stored = self.seen_urls is not None and self.seen_urls.seen(url)
+            if stored and not self.feeds.changed(collection_name, url, date):
+                continue
+            if state['budget'] <= 0:
+                # Older entries wait for the next crawl, so the watermark stays put
+                state['truncated'] = True
+                break
+            state['budget'] -= 1
+            self.feeds.inc_stat('fetched')
+            if stored:
+                self.feeds.inc_stat('changed')
+            self.feeds.record_fetched(collection_name, url, date)
+            yield Request(url, callback=self.parse_article, meta={'items': feed_data},
+                          priority=self.source_priority(feed_data))
+
+        yield from self.feed_finished(feed_data)
+
+    def feed_failed(self, failure):
+        feed_data = failure.request.meta['items']
+        # Any other failure (a 404 sitemap, a timeout) counts toward the listing page fallback
+        if failure.check(NotModified):
+            # Unchanged since the last crawl (ConditionalGetMiddleware): nothing new
+            self.feed_state[feed_data['collection_name']]['unchanged'] = True
+        yield from self.feed_finished(feed_data)
+
+    def feed_finished(self, feed_data):
+        collection_name = feed_data['collection_name']
+        state = self.feed_state[collection_name]
+        state['pending'] -= 1
+        if state['pending']:
+            return
+        if not state['in_scope'] and not state['unchanged']:
+            # None of the feeds had anything for this source, rank its listing page
+            self.feeds.set_feed_urls(collection_name, [])
+            self.feeds.inc_stat('fallback')
+            yield self.listing_request(feed_data)
+        else:
+            # What a first crawl has no budget for is the site's archive: the next
+            # crawl starts from its newest entry instead of working back through it
+            backlog = state['truncated'] and not state['first']
+            self.feeds.set_backlog(collection_name, backlog)
+            if state['newest'] is not None and not backlog:
+                self.feeds.set_watermark(collection_name, state['newest'])
+            self.source_crawled(feed_data, True)
+
+
+    def parse(self, response):
+        self.source_crawled(response.meta['items'], True)
+        stats = self.crawler.stats
+
+        if response.meta.get('discover_feeds'):
+            feed_urls = find_feed_links(response)
+            self.feeds.set_feed_urls(response.meta['items']['collection_name'], feed_urls)
+            if feed_urls:
+                yield from self.feed_requests(response.meta['items'], feed_urls)
+                return
+
+        all_links = self.link_extractor.extract_links(response)
+        stats.inc_value('listing/links', len(all_links))
         # print(all_links)
         parsed_urls_features = []
         for link in all_links:
@@ -89,14 +335,83 @@ class GovNewsSpider(scrapy.Spider):
             }
             parsed_urls_features.append(features)
         # print(parsed_urls_features[:5])
-        article_urls = rank_urls_for_articles([feature['url'] for feature in parsed_urls_features])
-        # print(article_urls[:5])
-        for url in article_urls[:1]:
-            yield Request(url['url'], callback=self.parse_article, meta={'items': response.meta['items']})
+        page_urls = [feature['url'] for feature in parsed_urls_features]
+        stats.inc_value('listing/skipped_offsite', len(all_links) - len(page_urls))
+        collection_name = response.meta['items']['collection_name']
+        # Only links that appeared since the last crawl of this source need ranking
+        if self.link_snapshots is not None:
+            candidate_urls = self.link_snapshots.new_links(collection_name, page_urls)
+        else:
+            candidate_urls = page_urls
+        stats.inc_value('listing/skipped_known', len(page_urls) - len(candidate_urls))
+        article_urls = self.select_articles(response.meta['items'], candidate_urls)
+        for url in article_urls['fetched']:
+            # listing_link: the snapshot forgets it again if the article can't be fetched
+            yield Request(url['url'], callback=self.parse_article, errback=self.article_failed,
+                          meta={'items': response.meta['items'], 'listing_link': url['url']},
+                          priority=self.source_priority(response.meta['items']))
+
+        if self.link_snapshots is not None:
+            # Articles left out by the budget stay "new" for the next crawl, and so
+            # do the ones whose fetch fails for a passing reason, see article_failed
+            unfetched = {url['url'] for url in article_urls['over_budget']}
+            self.link_snapshots.save(collection_name, [url for url in page_urls if url not in unfetched],
+                                     backlog=bool(unfetched))
+
+    def select_articles(self, feed_data, urls):
+        """
+        The article links of a listing worth fetching: scored at least
+        LISTING_MIN_SCORE, not dated (in the URL) more than LISTING_MAX_AGE_DAYS
+        ago, and not stored by a previous run. The best LISTING_MAX_ARTICLES of
+        them (or the source's own `max_articles`) are fetched, the others are
+        left for the next crawl.
+        """
+        settings = self.settings
+        stats = self.crawler.stats
+        min_score = settings.getfloat('LISTING_MIN_SCORE', self.url_ranker.min_score)
+        max_age = settings.getint('LISTING_MAX_AGE_DAYS', 30)
+        not_before = date.today() - timedelta(days=max_age) if max_age else None
+        budget = int(feed_data.get('max_articles') or settings.getint('LISTING_MAX_ARTICLES', 10))
+
+        candidates = self.url_ranker.candidates(urls, min_score)
+        stats.inc_value('listing/candidates', len(candidates))
+        stats.inc_value('listing/skipped_score', len(urls) - len(candidates))
+        selectable = []
+        for candidate in candidates:
+            if not_before is not None and candidate['date'] is not None and candidate['date'] < not_before:
+                stats.inc_value('listing/skipped_stale')
+            # Don't spend downloads on articles a previous run already stored
+            elif self.seen_urls is not None and self.seen_urls.seen(candidate['url']):
+                stats.inc_value('listing/skipped_seen')
+            else:
+                selectable.append(candidate)
+
+        fetched = self.url_ranker.best(selectable, budget)
+        stats.inc_value('listing/fetched', len(fetched))
+        stats.inc_value('listing/skipped_budget', len(selectable) - len(fetched))
+        fetched_urls = {url['url'] for url in fetched}
+        return {'fetched': fetched, 'over_budget': [url for url in selectable if url['url'] not in fetched_urls]}
 
-    def parse_article(self, response):
+    def article_failed(self, failure):
+        # Only timeouts, connection errors and 5xx-like statuses: a 404 would be
+        # fetched again on every crawl, and keep the listing from ever being unchanged
+        if failure.check(HttpError):
+            transient = failure.value.response.status in self.transient_statuses
+        else:
+            transient = failure.check(*self.transient_errors) is not None
+        if transient:
+            self.retry_listing_link(failure.request.meta)
+
+    def retry_listing_link(self, meta):
+        if self.link_snapshots is not None and 'listing_link' in meta:
+            self.link_snapshots.forget(meta['items']['collection_name'], [meta['listing_link']])
+
+    async def parse_article(self, response):
       #  print(response.url)
-        data = json.loads(extract(response.text, output_format="json"))
+        data = await self.extractor.extract(response_html(response))
+        if data is None:
+            self.logger.info(f"No article content extracted from {response.url}")
+            return
 
         branch = response.meta['items']['branch']
         country = response.meta['items']['country']
@@ -113,23 +428,20 @@ class GovNewsSpider(scrapy.Spider):
             description = data.get('raw_text')
         else:
             description = data.get('excerpt')
-        DEBUG_MODE = True  # Set to False for production
-    
-        content = response.text
-        if DEBUG_MODE and len(content) > 500:
-            content = content[:500] + f"... [TRUNCATED - Total length: {len(response.text)}]"
-        yield NewsItems(
-            {
-            'title': data.get('title'),
-            'url': response.url,
-            'image_url': image,
-            'document_url': None,
-            'created_at': data.get('date'),
-            'description': description,
-            'md': content,
-            'collection_name': response.meta['items']['collection_name'],
-            'branch': branch,
-            'country': country,
-            'topic': topic
-            }
+        item = ArticleRecord(
+            title=data.get('title'),
+            url=response.url,
+            image_url=image,
+            document_url=None,
+            created_at=data.get('date'),
+            description=description,
+            md=data.get('md'),
+            collection_name=response.meta['items']['collection_name'],
+            branch=branch,
+            country=country,
+            topic=topic,
         )
+        # The generator stays suspended while the item goes through the pipelines:
+        # don't keep trafilatura's full output (text, raw_text, comments) alive with it
+        del data
+        yield item